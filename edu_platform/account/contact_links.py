@@ -0,0 +1,109 @@
+from .models import GHLContactLink
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+def get_contact_links(location_id, emails):
+    """Return {normalized email: GHLContactLink} for the emails already linked in a location"""
+    return {
+        link.email: link
+        for link in GHLContactLink.objects.filter(
+            location_id=location_id,
+            email__in={normalize_email(email) for email in emails}
+        )
+    }
+
+
+def get_contact_ids(location_id, emails):
+    """Return {normalized email: contact id} for the emails already linked in a location"""
+    return {email: link.contact_id for email, link in get_contact_links(location_id, emails).items()}
+
+
+def _upsert_links(links):
+    # One row per (location, email), the last one wins: an upsert can't touch the same row twice
+    links = list({(link.location_id, link.email): link for link in links}.values())
+    if links:
+        GHLContactLink.objects.bulk_create(
+            links,
+            update_conflicts=True,
+            unique_fields=['location_id', 'email'],
+            update_fields=['contact_id', 'payload_hash', 'tags', 'updated_at']
+        )
+
+
+def remember_contacts(location_id, contact_ids_by_email):
+    """
+    Store links for {email: contact id}. Links that already point at the same
+    contact are left alone; new or re-pointed links start with an empty push state.
+    """
+    contact_ids_by_email = {
+        normalize_email(email): contact_id
+        for email, contact_id in contact_ids_by_email.items()
+        if email and contact_id
+    }
+    if not contact_ids_by_email:
+        return
+    known = get_contact_ids(location_id, contact_ids_by_email.keys())
+    _upsert_links([
+        GHLContactLink(location_id=location_id, email=email, contact_id=contact_id)
+        for email, contact_id in contact_ids_by_email.items()
+        if known.get(email) != contact_id
+    ])
+
+
+def forget_contacts(location_id, emails):
+    """Drop links GHL no longer recognises (e.g. the contact was deleted or merged)"""
+    GHLContactLink.objects.filter(
+        location_id=location_id,
+        email__in={normalize_email(email) for email in emails}
+    ).delete()
+
+
+def attach_contact_ids(jobs):
+    """Fill each ContactJob with its stored contact id and push state, one query per location"""
+    emails_by_location = {}
+    for job in jobs:
+        emails_by_location.setdefault(job.location_id, set()).add(job.email)
+
+    for location_id, emails in emails_by_location.items():
+        links = get_contact_links(location_id, emails)
+        for job in jobs:
+            link = links.get(normalize_email(job.email)) if job.location_id == location_id else None
+            if link and not job.contact_id:
+                job.contact_id = link.contact_id
+                job.pushed_hash = link.payload_hash or None
+                job.confirmed_tags = set(link.tags or [])
+    return jobs
+
+
+def record_contact_results(results):
+    """Save the contact ids and push state learnt from a push and drop the links GHL rejected"""
+    links_by_location = {}
+    stale = {}
+    for result in results:
+        job = result.job
+        unchanged = (
+            result.contact_id == job.contact_id
+            and result.payload_hash == job.pushed_hash
+            and not result.tags_confirmed
+        )
+        if result.success and result.contact_id and not unchanged:
+            tags = set(result.tags_confirmed)
+            if result.contact_id == job.contact_id:
+                tags |= set(job.confirmed_tags)
+            links_by_location.setdefault(job.location_id, []).append(GHLContactLink(
+                location_id=job.location_id,
+                email=normalize_email(job.email),
+                contact_id=result.contact_id,
+                payload_hash=result.payload_hash or '',
+                tags=sorted(tags)
+            ))
+        elif result.stale_link and not result.contact_id:
+            stale.setdefault(job.location_id, set()).add(job.email)
+
+    for links in links_by_location.values():
+        _upsert_links(links)
+    for location_id, emails in stale.items():
+        forget_contacts(location_id, emails)
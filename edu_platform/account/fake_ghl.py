@@ -0,0 +1,365 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeGHLDataset:
+    """
+    Seeded, in-memory LeadConnector data for one or more locations.
+    The same arguments always build the same users, contacts, pipelines and opportunities.
+    """
+
+    def __init__(self, location_ids=('fake-location',), users=50, contacts=500, opportunities=200,
+                 pipelines=3, stages_per_pipeline=5, seed=0):
+        rng = random.Random(seed)
+        self._lock = threading.RLock()
+        self._contact_counter = 0
+        self.locations = {}
+        self.users = {}
+        self.contacts = {}
+        self.opportunities = {}
+        self.pipelines = {}
+
+        for location_id in location_ids:
+            self.locations[location_id] = {
+                'id': location_id, 'name': f'Fake {location_id}', 'timezone': 'UTC'
+            }
+            self.users[location_id] = [
+                {
+                    'id': f'{location_id}-user-{i}',
+                    'name': f'User {i}',
+                    'firstName': 'User',
+                    'lastName': str(i),
+                    'email': f'user-{i}@{location_id}.example.com',
+                    'phone': f'+1555{i:07d}',
+                    'role': rng.choice(['admin', 'user']),
+                    'status': 'active',
+                    'dateUpdated': '2024-01-01T00:00:00.000Z',
+                }
+                for i in range(users)
+            ]
+            self.contacts[location_id] = {}
+            for i in range(contacts):
+                self._add_contact(location_id, {
+                    'firstName': 'Contact',
+                    'lastName': str(i),
+                    'email': f'contact-{i}@{location_id}.example.com',
+                    'phone': f'+1666{i:07d}',
+                    'tags': rng.sample(['lead', 'customer', 'vip', 'category added'], rng.randint(0, 2)),
+                    'dateAdded': '2024-01-01T00:00:00.000Z',
+                })
+            location_pipelines = []
+            for p in range(pipelines):
+                pipeline = {
+                    'id': f'{location_id}-pipeline-{p}',
+                    'name': f'Pipeline {p} ({location_id})',
+                    'stages': [
+                        {'id': f'{location_id}-pipeline-{p}-stage-{s}', 'name': f'Stage {s}', 'position': s}
+                        for s in range(stages_per_pipeline)
+                    ],
+                }
+                self.pipelines[pipeline['id']] = pipeline
+                location_pipelines.append(pipeline)
+            contact_ids = list(self.contacts[location_id])
+            self.opportunities[location_id] = []
+            for i in range(opportunities if contact_ids and location_pipelines else 0):
+                pipeline = rng.choice(location_pipelines)
+                stage = rng.choice(pipeline['stages'])
+                self.opportunities[location_id].append({
+                    'id': f'{location_id}-opportunity-{i}',
+                    'name': f'Opportunity {i}',
+                    'contactId': rng.choice(contact_ids),
+                    'pipelineId': pipeline['id'],
+                    'pipelineStageId': stage['id'],
+                    'stageOrder': stage['position'],
+                    'monetaryValue': rng.randint(0, 10000),
+                    'status': rng.choice(['open', 'won', 'lost']),
+                    'source': 'fake_ghl',
+                    'createdAt': '2024-01-01T00:00:00.000Z',
+                })
+
+    def _add_contact(self, location_id, fields):
+        with self._lock:
+            self._contact_counter += 1
+            contact_id = f'{location_id}-contact-{self._contact_counter}'
+            contact = {'id': contact_id, 'locationId': location_id, 'tags': [], **fields}
+            contact['tags'] = [tag.lower() for tag in contact['tags']]
+            self.contacts.setdefault(location_id, {})[contact_id] = contact
+            return contact
+
+    def find_contact(self, contact_id):
+        for contacts in self.contacts.values():
+            if contact_id in contacts:
+                return contacts[contact_id]
+        return None
+
+    def search_contacts(self, location_id, query):
+        query = (query or '').lower()
+        return [
+            contact for contact in self.contacts.get(location_id, {}).values()
+            if query in (contact.get('email') or '').lower()
+        ]
+
+    def upsert_contact(self, location_id, fields):
+        """Return (contact, created); tags in ``fields`` replace the contact's tags like GHL does"""
+        fields = {key: value for key, value in fields.items() if key != 'locationId'}
+        email = (fields.get('email') or '').lower()
+        with self._lock:
+            for contact in self.search_contacts(location_id, email):
+                if (contact.get('email') or '').lower() == email:
+                    contact.update(fields)
+                    return contact, False
+            return self._add_contact(location_id, fields), True
+
+
+class FakeGHLServer:
+    """
+    Local HTTP stand-in for the LeadConnector API endpoints this project calls.
+
+    Every request waits ``latency`` seconds. ``error_rate`` answers that share of
+    requests with a 503 and ``rate_limit_rate`` with a 429 carrying
+    ``Retry-After: retry_after``; injection is seeded so runs are repeatable.
+    Tokens in ``rejected_tokens`` get a 401. Request counts per endpoint are kept in
+    ``request_counts``. Use as ``with FakeGHLServer(dataset) as server: server.base_url``.
+    """
+
+    ROUTES = [
+        ('POST', r'/oauth/token', 'oauth_token'),
+        ('GET', r'/locations/(?P<location_id>[^/]+)', 'get_location'),
+        ('GET', r'/users/', 'list_users'),
+        ('GET', r'/users/(?P<user_id>[^/]+)', 'get_user'),
+        ('GET', r'/contacts/', 'list_contacts'),
+        ('POST', r'/contacts/', 'create_contact'),
+        ('POST', r'/contacts/search', 'search_contacts'),
+        ('POST', r'/contacts/upsert', 'upsert_contact'),
+        ('POST', r'/contacts/(?P<contact_id>[^/]+)/tags', 'add_tags'),
+        ('GET', r'/contacts/(?P<contact_id>[^/]+)', 'get_contact'),
+        ('PUT', r'/contacts/(?P<contact_id>[^/]+)', 'update_contact'),
+        ('GET', r'/opportunities/', 'list_opportunities'),
+        ('GET', r'/pipelines/(?P<pipeline_id>[^/]+)', 'get_pipeline'),
+    ]
+
+    def __init__(self, dataset=None, latency=0.0, error_rate=0.0, rate_limit_rate=0.0, retry_after=1,
+                 seed=0, host='127.0.0.1', port=0):
+        self.dataset = dataset or FakeGHLDataset(seed=seed)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.rejected_tokens = set()
+        self.request_counts = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._token_counter = 0
+        self._routes = [(method, re.compile(f'^{pattern}$'), name) for method, pattern, name in self.ROUTES]
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def total_requests(self):
+        return sum(self.request_counts.values())
+
+    def reset_counts(self):
+        with self._lock:
+            self.request_counts.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                server._dispatch(self, 'GET')
+
+            def do_POST(self):
+                server._dispatch(self, 'POST')
+
+            def do_PUT(self):
+                server._dispatch(self, 'PUT')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _dispatch(self, handler, method):
+        length = int(handler.headers.get('Content-Length') or 0)
+        raw_body = handler.rfile.read(length) if length else b''
+        url = urlparse(handler.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        for route_method, pattern, name in self._routes:
+            match = pattern.match(url.path) if route_method == method else None
+            if match:
+                break
+        else:
+            return self._reply(handler, 404, {'message': f'No route for {method} {url.path}'})
+
+        with self._lock:
+            self.request_counts[name] += 1
+            roll = self._rng.random()
+        if self.latency:
+            time.sleep(self.latency)
+        if roll < self.rate_limit_rate:
+            return self._reply(handler, 429, {'message': 'Too many requests'}, {'Retry-After': str(self.retry_after)})
+        if roll < self.rate_limit_rate + self.error_rate:
+            return self._reply(handler, 503, {'message': 'Injected failure'})
+
+        token = (handler.headers.get('Authorization') or '').removeprefix('Bearer ')
+        if name != 'oauth_token' and (not token or token in self.rejected_tokens):
+            return self._reply(handler, 401, {'message': 'Invalid JWT'})
+
+        if handler.headers.get_content_type() == 'application/x-www-form-urlencoded':
+            body = {key: values[-1] for key, values in parse_qs(raw_body.decode()).items()}
+        else:
+            body = json.loads(raw_body or b'{}')
+        status, payload = getattr(self, f'_{name}')(body=body, query=query, **match.groupdict())
+        return self._reply(handler, status, payload)
+
+    def _reply(self, handler, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _page(self, items, query):
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', 100))
+        return items[offset:offset + limit], {'total': len(items)}
+
+    # Endpoints
+
+    def _oauth_token(self, body, query):
+        with self._lock:
+            self._token_counter += 1
+            number = self._token_counter
+        location_id = next(iter(self.dataset.locations), 'fake-location')
+        return 200, {
+            'access_token': f'fake-access-{number}',
+            'refresh_token': f'fake-refresh-{number}',
+            'expires_in': 86399,
+            'scope': 'contacts.readonly contacts.write',
+            'userType': 'Location',
+            'companyId': 'fake-company',
+            'locationId': location_id,
+            'userId': 'fake-user',
+        }
+
+    def _get_location(self, body, query, location_id):
+        location = self.dataset.locations.get(location_id)
+        return (200, {'location': location}) if location else (404, {'message': 'Location not found'})
+
+    def _list_users(self, body, query):
+        # Like the real endpoint: skip/limit are ignored and every user comes back at once
+        return 200, {'users': self.dataset.users.get(query.get('locationId'), [])}
+
+    def _get_user(self, body, query, user_id):
+        for users in self.dataset.users.values():
+            for user in users:
+                if user['id'] == user_id:
+                    return 200, user
+        return 404, {'message': 'User not found'}
+
+    def _list_contacts(self, body, query):
+        contacts, meta = self._page(list(self.dataset.contacts.get(query.get('locationId'), {}).values()), query)
+        return 200, {'contacts': contacts, 'meta': meta}
+
+    def _create_contact(self, body, query):
+        contact, _ = self.dataset.upsert_contact(body.get('locationId'), body)
+        return 201, {'contact': contact}
+
+    def _search_contacts(self, body, query):
+        contacts = self.dataset.search_contacts(body.get('locationId'), body.get('query'))
+        return 200, {'contacts': contacts[:int(body.get('pageLimit', 20))], 'total': len(contacts)}
+
+    def _upsert_contact(self, body, query):
+        contact, created = self.dataset.upsert_contact(body.get('locationId'), body)
+        return 200, {'new': created, 'contact': contact}
+
+    def _add_tags(self, body, query, contact_id):
+        contact = self.dataset.find_contact(contact_id)
+        if not contact:
+            return 404, {'message': 'Contact not found'}
+        added = [tag.lower() for tag in body.get('tags', []) if tag.lower() not in contact['tags']]
+        contact['tags'].extend(added)
+        return 201, {'tags': contact['tags'], 'tagsAdded': added}
+
+    def _get_contact(self, body, query, contact_id):
+        contact = self.dataset.find_contact(contact_id)
+        return (200, {'contact': contact}) if contact else (404, {'message': 'Contact not found'})
+
+    def _update_contact(self, body, query, contact_id):
+        contact = self.dataset.find_contact(contact_id)
+        if not contact:
+            return 404, {'message': 'Contact not found'}
+        contact.update({k: v for k, v in body.items() if k not in ('locationId', 'tags')})
+        return 200, {'succeded': True, 'contact': contact}
+
+    def _list_opportunities(self, body, query):
+        opportunities, meta = self._page(self.dataset.opportunities.get(query.get('locationId'), []), query)
+        return 200, {'opportunities': opportunities, 'meta': meta}
+
+    def _get_pipeline(self, body, query, pipeline_id):
+        pipeline = self.dataset.pipelines.get(pipeline_id)
+        return (200, pipeline) if pipeline else (404, {'message': 'Pipeline not found'})
+
+
+@contextmanager
+def use_fake_ghl(server, rate_limit_per_second=1e9, rate_limit_burst=1e9):
+    """
+    Point every GHL client at ``server`` for the duration, with process-local
+    state (memory backend) and, by default, no client-side rate limiting
+    """
+    from django.test.utils import override_settings
+    from . import ghl_client, notifications, ratelimit, tokens
+
+    def reset():
+        ghl_client._client = None
+        ratelimit._rate_limiter = None
+        notifications._store = None
+        tokens._token_cache.clear()
+
+    with override_settings(
+        GHL_BASE_URL=server.base_url,
+        GHL_STATE_BACKEND='memory',
+        GHL_RATE_LIMIT_PER_SECOND=rate_limit_per_second,
+        GHL_RATE_LIMIT_BURST=rate_limit_burst,
+    ):
+        reset()
+        try:
+            yield server
+        finally:
+            reset()
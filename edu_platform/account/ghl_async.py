@@ -0,0 +1,339 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional, Set
+import httpx
+from django.conf import settings
+from .ghl_client import GHL_API_VERSION, GHLAPIError, GHLRateLimitError, ReplacedTokens, refresh_expired_token
+from .metrics import record_call, record_rate_limit_wait, record_retry
+from .ratelimit import get_rate_limiter, get_retry_policy, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+
+async def _record(metric, *args, **kwargs):
+    """Metrics go to Redis with blocking calls, so record them off the event loop"""
+    if settings.GHL_METRICS_ENABLED:
+        await asyncio.to_thread(metric, *args, **kwargs)
+
+
+class AsyncGHLClient:
+    """
+    asyncio counterpart of GHLClient for fan-out work.
+
+    Shares the same rate limiter and retry policy, and additionally caps the
+    number of in-flight requests per location so one big location can't use
+    the whole connection pool. Use as ``async with AsyncGHLClient() as client``.
+    """
+
+    def __init__(self, base_url=None, timeout=None, max_connections=None, concurrency_per_location=None,
+                 rate_limiter=None, retry_policy=None):
+        self.base_url = (base_url or settings.GHL_BASE_URL).rstrip('/')
+        self.timeout = timeout or httpx.Timeout(settings.GHL_HTTP_READ_TIMEOUT, connect=settings.GHL_HTTP_CONNECT_TIMEOUT)
+        self.max_connections = max_connections or settings.GHL_ASYNC_MAX_CONNECTIONS
+        self.concurrency_per_location = concurrency_per_location or settings.GHL_ASYNC_CONCURRENCY_PER_LOCATION
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.retry_policy = retry_policy or get_retry_policy()
+        self._semaphores = {}
+        self._http = None
+        self.replaced_tokens = ReplacedTokens()
+
+    async def __aenter__(self):
+        self._http = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={"Accept": "application/json", "Version": GHL_API_VERSION},
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._http.aclose()
+        self._http = None
+
+    def _semaphore(self, location_id):
+        key = location_id or "global"
+        if key not in self._semaphores:
+            self._semaphores[key] = asyncio.Semaphore(self.concurrency_per_location)
+        return self._semaphores[key]
+
+    async def request(self, method, path, access_token=None, location_id=None, headers=None, **kwargs):
+        """
+        Same contract as GHLClient.request: rate limited, retried, GHLRateLimitError
+        on a persistent 429, one token refresh and retry on a 401
+        """
+        request_headers = dict(headers or {})
+        access_token = self.replaced_tokens.get(access_token, access_token)
+        if access_token:
+            request_headers["Authorization"] = f"Bearer {access_token}"
+
+        async with self._semaphore(location_id):
+            attempt = 0
+            token_refreshed = False
+            while True:
+                await _record(record_rate_limit_wait, await self.rate_limiter.acquire_async(location_id or "global"))
+                started = time.perf_counter()
+                try:
+                    response = await self._http.request(method, path, headers=request_headers, **kwargs)
+                except httpx.TransportError as e:
+                    await _record(record_call, method, path, type(e).__name__, time.perf_counter() - started,
+                                  location_id=location_id, attempt=attempt)
+                    if not self.retry_policy.should_retry_error(method, attempt):
+                        raise
+                    await _record(record_retry, method, path, type(e).__name__)
+                    delay = self.retry_policy.backoff(attempt)
+                    logger.warning(f"GHL {method} {path} failed ({e}), retry {attempt + 1} in {delay:.1f}s")
+                else:
+                    await _record(record_call, method, path, response.status_code, time.perf_counter() - started,
+                                  bytes_sent=len(response.request.content), bytes_received=len(response.content),
+                                  location_id=location_id, attempt=attempt)
+                    if response.status_code == 401 and not token_refreshed:
+                        token_refreshed = True
+                        # The refresh takes a lock and hits the database, keep it off the event loop
+                        new_token = await asyncio.to_thread(refresh_expired_token, self, location_id, access_token)
+                        if new_token:
+                            await _record(record_retry, method, path, 401)
+                            access_token = new_token
+                            request_headers["Authorization"] = f"Bearer {access_token}"
+                            continue
+                    if not self.retry_policy.should_retry(method, response.status_code, attempt):
+                        if response.status_code == 429:
+                            raise GHLRateLimitError(
+                                f"GHL rate limit exceeded for {method} {path}",
+                                retry_after=retry_after_seconds(response)
+                            )
+                        return response
+                    await _record(record_retry, method, path, response.status_code)
+                    delay = self.retry_policy.delay(attempt, response)
+                    logger.warning(f"GHL {method} {path} returned {response.status_code}, retry {attempt + 1} in {delay:.1f}s")
+
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def get(self, path, access_token=None, location_id=None, **kwargs):
+        return await self.request("GET", path, access_token, location_id, **kwargs)
+
+    async def post(self, path, access_token=None, location_id=None, **kwargs):
+        return await self.request("POST", path, access_token, location_id, **kwargs)
+
+    async def put(self, path, access_token=None, location_id=None, **kwargs):
+        return await self.request("PUT", path, access_token, location_id, **kwargs)
+
+    async def fetch_all_pages(self, path, access_token, location_id, items_key, page_size=100, params=None):
+        """
+        Fetch every page of an offset-paginated GHL list.
+        The first page tells us the total, the remaining pages are then fetched concurrently.
+        Raises GHLAPIError if a page fails after retries, so callers never get a partial listing.
+        """
+        base_params = dict(params or {})
+
+        async def fetch_page(offset):
+            response = await self.get(path, access_token, location_id, params={**base_params, "limit": page_size, "offset": offset})
+            if response.status_code != 200:
+                raise GHLAPIError(f"Fetching {path} at offset {offset} failed: {response.status_code} - {response.text}")
+            return response.json()
+
+        first_page = await fetch_page(0)
+        items = list(first_page.get(items_key, []))
+        total = (first_page.get("meta") or {}).get("total")
+
+        if total is not None:
+            offsets = range(page_size, int(total), page_size)
+            for page in await asyncio.gather(*(fetch_page(offset) for offset in offsets)):
+                items.extend(page.get(items_key, []))
+            return items
+
+        # No total in the response: walk the pages one by one
+        offset = page_size
+        page_items = items
+        while len(page_items) == page_size:
+            page = await fetch_page(offset)
+            page_items = page.get(items_key, [])
+            items.extend(page_items)
+            offset += page_size
+        return items
+
+
+@dataclass
+class ContactJob:
+    """One contact to push to GHL: updated (or created) and tagged"""
+    email: str
+    first_name: str
+    last_name: str
+    phone: str
+    location_id: str
+    access_token: str
+    tags: List[str] = field(default_factory=list)
+    create_if_missing: bool = True
+    # Reconciliation runs set force to re-send the payload and every tag
+    force: bool = False
+    # Known contact id and push state (from GHLContactLink); when set the search call is skipped
+    contact_id: Optional[str] = None
+    pushed_hash: Optional[str] = None
+    confirmed_tags: Set[str] = field(default_factory=set)
+
+
+@dataclass
+class ContactResult:
+    job: ContactJob
+    success: bool = False
+    contact_id: Optional[str] = None
+    created: bool = False
+    stale_link: bool = False
+    payload_hash: Optional[str] = None
+    tags_confirmed: List[str] = field(default_factory=list)
+    rate_limited: bool = False
+    retry_after: Optional[float] = None
+    error: Optional[str] = None
+
+
+class _PushError(Exception):
+    pass
+
+
+def _pick_contact(contacts, email):
+    """/contacts/search is fuzzy: only the contact with exactly this email (ignoring case) counts"""
+    for contact in contacts:
+        if (contact.get("email") or "").lower() == email.lower():
+            return contact
+    return None
+
+
+def contact_payload_hash(contact_fields):
+    """Stable hash of a contact payload, used to skip updates GHL already has"""
+    return hashlib.sha256(json.dumps(contact_fields, sort_keys=True).encode()).hexdigest()
+
+
+async def _search_contact_id(client, job):
+    response = await client.post(
+        "/contacts/search", job.access_token, job.location_id,
+        json={"locationId": job.location_id, "query": job.email, "pageLimit": 10}
+    )
+    if response.status_code != 200:
+        raise _PushError(f"search failed: {response.status_code} - {response.text}")
+    contact = _pick_contact(response.json().get("contacts", []), job.email)
+    return contact.get("id") if contact else None
+
+
+async def _upsert_contact(client, job, contact_fields):
+    """
+    Create or update the contact by email in one call and return (contact, created).
+    Tags are left out: GHL replaces a contact's tags with the upserted list, so
+    they are added through the tags endpoint instead.
+    """
+    response = await client.post(
+        "/contacts/upsert", job.access_token, job.location_id,
+        json={**contact_fields, "locationId": job.location_id}
+    )
+    if response.status_code not in [200, 201]:
+        raise _PushError(f"upsert failed: {response.status_code} - {response.text}")
+    data = response.json()
+    return data.get("contact") or {}, bool(data.get("new"))
+
+
+async def push_contact(client, job):
+    """
+    Create or update the contact and make sure it has the job's tags.
+
+    A contact with a stored id is updated with a PUT, skipped entirely when the
+    payload matches the last pushed one (unless job.force). Otherwise one upsert
+    by email creates or updates it; jobs that must not create contacts search
+    first. Tags are only posted when GHL does not report them on the contact yet.
+    """
+    result = ContactResult(job=job)
+    contact_fields = {
+        "email": job.email,
+        "firstName": job.first_name or "",
+        "lastName": job.last_name or "",
+    }
+    if job.phone:
+        contact_fields["phone"] = job.phone
+    payload_hash = contact_payload_hash(contact_fields)
+
+    try:
+        contact_id = job.contact_id
+        confirmed_tags = set() if job.force else set(job.confirmed_tags)
+        if contact_id and (job.force or payload_hash != job.pushed_hash):
+            # Do NOT include locationId when updating existing contacts
+            response = await client.put(f"/contacts/{contact_id}", job.access_token, job.location_id, json=contact_fields)
+            if response.status_code == 404:
+                result.stale_link = True
+                contact_id = None
+            elif response.status_code != 200:
+                raise _PushError(f"update failed: {response.status_code} - {response.text}")
+
+        if not contact_id and job.create_if_missing:
+            contact, result.created = await _upsert_contact(client, job, contact_fields)
+            contact_id = contact.get("id")
+            if not contact_id:
+                raise _PushError("upsert returned no contact id")
+            # GHL stores tags lowercased; the ones it already has count as confirmed
+            confirmed_tags = {tag.lower() for tag in contact.get("tags") or []}
+            result.tags_confirmed = [tag for tag in job.tags if tag.lower() in confirmed_tags]
+
+        elif not contact_id:
+            confirmed_tags = set()
+            contact_id = await _search_contact_id(client, job)
+            if not contact_id:
+                result.error = "contact not found"
+                return result
+            response = await client.put(f"/contacts/{contact_id}", job.access_token, job.location_id, json=contact_fields)
+            if response.status_code != 200:
+                raise _PushError(f"update failed: {response.status_code} - {response.text}")
+
+        result.contact_id = contact_id
+        result.payload_hash = payload_hash
+        confirmed_tags = {tag.lower() for tag in confirmed_tags}
+        new_tags = [tag for tag in job.tags if tag.lower() not in confirmed_tags]
+        if new_tags:
+            response = await client.post(
+                f"/contacts/{contact_id}/tags", job.access_token, job.location_id, json={"tags": new_tags}
+            )
+            if response.status_code in [200, 201]:
+                result.tags_confirmed += new_tags
+            else:
+                # Contact was updated, only the tag failed
+                logger.warning(f"Tag operation failed for {job.email}: {response.status_code} - {response.text}")
+        result.success = True
+
+    except _PushError as e:
+        result.error = str(e)
+    except GHLRateLimitError as e:
+        result.rate_limited = True
+        result.retry_after = e.retry_after
+        result.error = str(e)
+    except Exception as e:
+        result.error = str(e)
+    return result
+
+
+async def push_contacts(jobs, client=None):
+    """Push many contacts concurrently (bounded per location by the client)"""
+    if client is None:
+        async with AsyncGHLClient() as client:
+            return await push_contacts(jobs, client)
+    return list(await asyncio.gather(*(push_contact(client, job) for job in jobs)))
+
+
+def push_contacts_sync(jobs):
+    """
+    Blocking wrapper for Celery tasks. Known contact ids are attached from
+    GHLContactLink before the push and the ids learnt are stored afterwards.
+    """
+    from .contact_links import attach_contact_ids, record_contact_results
+
+    attach_contact_ids(jobs)
+    results = asyncio.run(push_contacts(jobs))
+    record_contact_results(results)
+    return results
+
+
+def fetch_all_pages_sync(path, access_token, location_id, items_key, page_size=100, params=None):
+    """Blocking wrapper around AsyncGHLClient.fetch_all_pages"""
+    async def fetch():
+        async with AsyncGHLClient() as client:
+            return await client.fetch_all_pages(path, access_token, location_id, items_key, page_size, params)
+    return asyncio.run(fetch())
@@ -0,0 +1,189 @@
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from .metrics import record_call, record_rate_limit_wait, record_retry
+from .ratelimit import get_rate_limiter, get_retry_policy, retry_after_seconds
+
+GHL_API_VERSION = "2021-07-28"
+
+logger = logging.getLogger(__name__)
+
+
+class GHLRateLimitError(Exception):
+    """Raised when GHL keeps answering 429 after all retries; callers should re-queue the work"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GHLAPIError(Exception):
+    """Raised when a GHL listing can't be fetched completely"""
+
+
+class GHLClient:
+    """
+    HTTP client for the LeadConnector (GHL) API.
+
+    Wraps one requests.Session with a sized keep-alive connection pool, default
+    timeouts and the headers every GHL call needs, so services only pass the
+    path, the access token and the payload. Every call first takes a token from
+    the per-location rate limiter and is retried on 429/5xx per the retry policy.
+    A 401 refreshes the location's access token and retries the call once.
+    """
+
+    def __init__(self, base_url=None, timeout=None, pool_connections=None, pool_maxsize=None,
+                 rate_limiter=None, retry_policy=None):
+        self.base_url = (base_url or settings.GHL_BASE_URL).rstrip('/')
+        self.timeout = timeout or (settings.GHL_HTTP_CONNECT_TIMEOUT, settings.GHL_HTTP_READ_TIMEOUT)
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.retry_policy = retry_policy or get_retry_policy()
+        # Rejected access token -> its replacement, so callers holding an old token refresh only once
+        self.replaced_tokens = ReplacedTokens()
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Accept": "application/json",
+            "Version": GHL_API_VERSION,
+        })
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections or settings.GHL_HTTP_POOL_CONNECTIONS,
+            pool_maxsize=pool_maxsize or settings.GHL_HTTP_POOL_MAXSIZE,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def url(self, path):
+        if path.startswith(("http://", "https://")):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method, path, access_token=None, location_id=None, headers=None, **kwargs):
+        """
+        Send a request, waiting for the location's rate limit and retrying
+        throttled or failed calls. Raises GHLRateLimitError if GHL still
+        answers 429 once the retries are used up.
+        """
+        request_headers = dict(headers or {})
+        access_token = self.replaced_tokens.get(access_token, access_token)
+        if access_token:
+            request_headers["Authorization"] = f"Bearer {access_token}"
+        kwargs.setdefault("timeout", self.timeout)
+        url = self.url(path)
+
+        attempt = 0
+        token_refreshed = False
+        while True:
+            record_rate_limit_wait(self.rate_limiter.acquire(location_id or "global"))
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, headers=request_headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                record_call(method, path, type(e).__name__, time.perf_counter() - started,
+                            location_id=location_id, attempt=attempt)
+                if not self.retry_policy.should_retry_error(method, attempt):
+                    raise
+                record_retry(method, path, type(e).__name__)
+                delay = self.retry_policy.backoff(attempt)
+                logger.warning(f"GHL {method} {path} failed ({e}), retry {attempt + 1} in {delay:.1f}s")
+            else:
+                record_call(method, path, response.status_code, time.perf_counter() - started,
+                            bytes_sent=len(response.request.body or b""), bytes_received=len(response.content),
+                            location_id=location_id, attempt=attempt)
+                if response.status_code == 401 and not token_refreshed:
+                    token_refreshed = True
+                    new_token = refresh_expired_token(self, location_id, access_token)
+                    if new_token:
+                        record_retry(method, path, 401)
+                        access_token = new_token
+                        request_headers["Authorization"] = f"Bearer {access_token}"
+                        continue
+                if not self.retry_policy.should_retry(method, response.status_code, attempt):
+                    if response.status_code == 429:
+                        raise GHLRateLimitError(
+                            f"GHL rate limit exceeded for {method} {path}",
+                            retry_after=retry_after_seconds(response)
+                        )
+                    return response
+                record_retry(method, path, response.status_code)
+                delay = self.retry_policy.delay(attempt, response)
+                logger.warning(f"GHL {method} {path} returned {response.status_code}, retry {attempt + 1} in {delay:.1f}s")
+
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, path, access_token=None, location_id=None, **kwargs):
+        return self.request("GET", path, access_token, location_id, **kwargs)
+
+    def post(self, path, access_token=None, location_id=None, **kwargs):
+        return self.request("POST", path, access_token, location_id, **kwargs)
+
+    def put(self, path, access_token=None, location_id=None, **kwargs):
+        return self.request("PUT", path, access_token, location_id, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+class ReplacedTokens:
+    """
+    Rejected access token -> its replacement. Only the most recent ``size`` entries
+    are kept: an entry only matters while callers still hold the old token.
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self._lock = threading.Lock()
+        self._tokens = OrderedDict()
+
+    def get(self, token, default=None):
+        with self._lock:
+            return self._tokens.get(token, default)
+
+    def __setitem__(self, token, new_token):
+        with self._lock:
+            self._tokens[token] = new_token
+            self._tokens.move_to_end(token)
+            while len(self._tokens) > self.size:
+                self._tokens.popitem(last=False)
+
+    def __len__(self):
+        return len(self._tokens)
+
+
+def refresh_expired_token(client, location_id, access_token):
+    """
+    Refresh a location's token after GHL rejected ``access_token`` with a 401.
+    Returns the token to retry with, or None when there is nothing to retry.
+    """
+    if not access_token or not location_id:
+        return None
+    from .tokens import refresh_location_token
+
+    new_token = refresh_location_token(location_id, stale_token=access_token)
+    if not new_token or new_token == access_token:
+        return None
+    client.replaced_tokens[access_token] = new_token
+    logger.info(f"Retrying with a refreshed token for location {location_id}")
+    return new_token
+
+
+_client = None
+_client_pid = None
+
+
+def get_ghl_client():
+    """
+    Return the process-wide GHL client.
+    A new one is built after a fork so Celery workers never share pooled sockets with their parent.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _client = GHLClient()
+        _client_pid = os.getpid()
+    return _client
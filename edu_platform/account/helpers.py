@@ -1,219 +1,333 @@
 from django.db import transaction
-from .models import GHLUser, GHLAuthCredentials
-from .services import get_ghl_users, get_ghl_user
-from roleplay.models import Category, UserCategoryAssignment
+from django.db.models import Case, FloatField, Q, Value, When
+from django.utils.dateparse import parse_datetime
+from .models import GHLUser, GHLAuthCredentials, GHLSyncState
+from .notifications import queue_contact_update
+from .services import iter_ghl_users
+from .webhooks import event_version
+from roleplay.models import Category
+from roleplay.helpers import bulk_assign_categories
 from django.utils.timezone import now
 
-def sync_ghl_users(location_id, access_token):
+# GHLUser fields that a GHL sync writes
+GHL_USER_SYNC_FIELDS = [
+    'location_id', 'location_ghl_id', 'name', 'first_name', 'last_name', 'email', 'phone', 'role', 'status'
+]
+
+def _ghl_user_fields(user_data, location):
+    return {
+        'location_id': location.pk,
+        'location_ghl_id': location.location_id,
+        'name': user_data.get('name') or '',
+        'first_name': user_data.get('firstName') or '',
+        'last_name': user_data.get('lastName') or '',
+        'email': user_data.get('email') or '',
+        'phone': user_data.get('phone') or '',
+        'role': user_data.get('role') or '',
+        'status': user_data.get('status') or 'active',
+    }
+
+def upsert_ghl_users(location, users_data, batch_size=1000):
+    """
+    Write a batch of GHL users for a location in bulk.
+
+    Existing rows are loaded with one query and diffed in memory: new users are
+    inserted with one bulk_create, and only changed rows (and fields) are written
+    with bulk_update. Bulk writes skip the per-row signals, so their side effects
+    run once for the batch: new users get every category, users that became
+    active get the default ones, and the GHL notifications are queued in batches.
+    """
+    rows = {
+        user_data['id']: _ghl_user_fields(user_data, location)
+        for user_data in users_data if user_data.get('id')
+    }
+    existing_users = {user.user_id: user for user in GHLUser.objects.filter(user_id__in=rows.keys())}
+    
+    stamp = now()
+    new_users = []
+    changed_users = []
+    changed_fields = set()
+    reactivated_pks = []
+    for user_id, fields in rows.items():
+        user = existing_users.get(user_id)
+        if user is None:
+            new_users.append(GHLUser(user_id=user_id, **fields))
+            continue
+        
+        diff = [name for name, value in fields.items() if getattr(user, name) != value]
+        if not diff:
+            continue
+        if 'status' in diff and fields['status'] == 'active':
+            reactivated_pks.append(user.pk)
+        for name in diff:
+            setattr(user, name, fields[name])
+        # bulk_update skips auto_now
+        user.updated_at = stamp
+        changed_users.append(user)
+        changed_fields.update(diff)
+    
+    with transaction.atomic():
+        if new_users:
+            GHLUser.objects.bulk_create(
+                new_users,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=['user_id'],
+                update_fields=GHL_USER_SYNC_FIELDS + ['updated_at']
+            )
+        if changed_users:
+            GHLUser.objects.bulk_update(changed_users, sorted(changed_fields) + ['updated_at'], batch_size=batch_size)
+    
+    assignments_created = 0
+    if new_users:
+        result = bulk_assign_categories(
+            GHLUser.objects.filter(user_id__in=[user.user_id for user in new_users]),
+            Category.objects.all()
+        )
+        assignments_created += result['assignments_created']
+    if reactivated_pks:
+        result = bulk_assign_categories(
+            GHLUser.objects.filter(pk__in=reactivated_pks),
+            Category.objects.filter(is_default=True)
+        )
+        assignments_created += result['assignments_created']
+    
+    return {
+        'synced': len(rows),
+        'created': len(new_users),
+        'updated': len(changed_users),
+        'assignments_created': assignments_created,
+    }
+
+def reconcile_removed_ghl_users(location_id, ghl_user_ids, dry_run=False):
+    """
+    Deactivate the local active users of a location that GHL no longer returns.
+    ``ghl_user_ids`` must be the complete listing from GHL. The difference is
+    computed as one set operation and applied with a single UPDATE.
+    Returns the removed users as (user_id, email) pairs.
+    """
+    active_users = dict(
+        GHLUser.objects.filter(location_ghl_id=location_id, status='active').values_list('user_id', 'email')
+    )
+    removed_ids = active_users.keys() - set(ghl_user_ids)
+    removed = sorted((user_id, active_users[user_id]) for user_id in removed_ids)
+    
+    if removed and not dry_run:
+        GHLUser.objects.filter(location_ghl_id=location_id, user_id__in=removed_ids).update(
+            status='inactive', updated_at=now()
+        )
+    return removed
+
+def _user_updated_at(user_data):
+    value = user_data.get('dateUpdated') or user_data.get('updatedAt')
+    return parse_datetime(value) if value else None
+
+def sync_ghl_users(location_id, access_token, incremental=False, page_size=100, reconcile=True,
+                   progress=None, raise_errors=False):
     """
-    Sync all users from GHL for a location and auto-assign all categories to NEW users only
+    Sync all users from GHL for a location and auto-assign all categories to NEW users only.
+    Users are fetched page by page and each page goes through the bulk upsert.
+    With ``incremental`` only users changed since the location's stored watermark
+    are written; the watermark only moves forward after a complete run.
+    A full sync with ``reconcile`` also deactivates local users GHL no longer returns.
+    ``progress`` (if given) is called after each page with the running totals of
+    users fetched, users upserted and category assignments created.
     """
     try:
         location = GHLAuthCredentials.objects.get(location_id=location_id)
+        state, _ = GHLSyncState.objects.get_or_create(location_id=location_id, resource='users')
+        since = state.watermark if incremental else None
+        newest = state.watermark
         
-        # Get users from GHL
-        users_data = get_ghl_users(location_id, access_token)
+        fetched = 0
+        seen_user_ids = set()
+        totals = {'synced': 0, 'created': 0, 'updated': 0, 'assignments_created': 0}
+        for page in iter_ghl_users(location_id, access_token, page_size=page_size):
+            fetched += len(page)
+            seen_user_ids.update(user_data.get('id') for user_data in page)
+            changed = []
+            for user_data in page:
+                updated_at = _user_updated_at(user_data)
+                if updated_at and (newest is None or updated_at > newest):
+                    newest = updated_at
+                # Users without a change timestamp are always written
+                if since is None or updated_at is None or updated_at > since:
+                    changed.append(user_data)
+            if changed:
+                result = upsert_ghl_users(location, changed)
+                for key in totals:
+                    totals[key] += result[key]
+            if progress:
+                progress(fetched, totals['synced'], totals['assignments_created'])
         
-        if users_data and isinstance(users_data, dict) and 'users' in users_data:
-            users_list = users_data['users']
-            synced_count = 0
-            assignments_created = 0
-            
-            # Get all existing categories once
-            all_categories = Category.objects.all()
-            
-            for user_data in users_list:
-                user_id = user_data.get('id')
-                if not user_id:
-                    continue
-                
-                # Create or update user with ALL available data including phone
-                user_obj, created = GHLUser.objects.update_or_create(
-                    user_id=user_id,
-                    location=location,
-                    defaults={
-                        'location_ghl_id': location_id,
-                        'name': user_data.get('name', ''),
-                        'first_name': user_data.get('firstName', ''),
-                        'last_name': user_data.get('lastName', ''),
-                        'email': user_data.get('email', ''),
-                        'phone': user_data.get('phone', ''),
-                        'role': user_data.get('role', ''),
-                        'status': user_data.get('status', 'active'),
-                    }
-                )
-                
-                # AUTO-ASSIGN ALL CATEGORIES ONLY TO NEWLY CREATED USERS
-                if created and all_categories.exists():
-                    for category in all_categories:
-                        assignment, assignment_created = UserCategoryAssignment.objects.get_or_create(
-                            user=user_obj,
-                            category=category
-                        )
-                        if assignment_created:
-                            assignments_created += 1
-                            print(f"✅ Auto-assigned category {category.name} to new user: {user_obj.email}")
-                            # The signal will automatically trigger GHL notification
-                
-                synced_count += 1
-            
-            print(f"Synced {synced_count} users for location {location_id}")
-            print(f"Created {assignments_created} category assignments for new users")
-            return synced_count
-            
-        else:
-            print(f"No users found or error in response for location {location_id}")
-            return 0
+        # An empty listing is more likely a GHL hiccup than every user being removed
+        if reconcile and not incremental and seen_user_ids:
+            removed = reconcile_removed_ghl_users(location_id, seen_user_ids)
+            if removed:
+                print(f"🚫 Deactivated {len(removed)} users no longer in GHL for location {location_id}")
+        
+        state.watermark = newest
+        if not incremental:
+            state.last_full_sync_at = now()
+        state.save()
+        
+        print(f"Synced {totals['synced']} of {fetched} users for location {location_id} "
+              f"({totals['created']} new, {totals['updated']} changed{', incremental' if incremental else ''})")
+        print(f"Created {totals['assignments_created']} category assignments for new users")
+        return totals['synced']
             
     except Exception as e:
         print(f"Error syncing users for location {location_id}: {e}")
+        if raise_errors:
+            raise
         return 0
 
 def assign_all_categories_to_users(location_id):
     """
-    Assign all existing categories to all users in a location
+    Assign all existing categories to all users in a location.
+    Only the missing pairs are inserted, in short per-batch transactions, and the
+    GHL notifications are queued as batches once the inserts have committed.
     """
     try:
-        with transaction.atomic():
-            # Get all users for the location - use the new location_ghl_id field
-            users = GHLUser.objects.filter(location_ghl_id=location_id)  # CHANGE THIS LINE
-            
-            print(f"DEBUG: Looking for users with location_ghl_id: {location_id}")
-            print(f"DEBUG: Found {users.count()} users")
-            
-            # Get all categories
-            categories = Category.objects.all()
-            print(f"DEBUG: Found {categories.count()} categories")
-            
-            assignments_created = 0
-            
-            for user in users:
-                print(f"DEBUG: Processing user: {user.email} (ID: {user.user_id})")
-                for category in categories:
-                    # Create assignment if it doesn't exist
-                    assignment, created = UserCategoryAssignment.objects.get_or_create(
-                        user=user,
-                        category=category
-                    )
-                    if created:
-                        assignments_created += 1
-                        print(f"DEBUG: Created assignment for user {user.email} to category {category.name}")
-            
-            print(f"DEBUG: Total assignments created: {assignments_created}")
-            
-            return {
-                'success': True,
-                'users_count': users.count(),
-                'categories_count': categories.count(),
-                'assignments_created': assignments_created
-            }
+        users = GHLUser.objects.filter(location_ghl_id=location_id)
+        result = bulk_assign_categories(users, Category.objects.all())
+
+        print(f"✅ Created {result['assignments_created']} assignments for {result['users_count']} users in location {location_id}")
+
+        return {
+            'success': True,
+            'users_count': result['users_count'],
+            'categories_count': result['categories_count'],
+            'assignments_created': result['assignments_created']
+        }
             
     except Exception as e:
-        print(f"DEBUG: Error in assign_all_categories_to_users: {e}")
+        print(f"❌ Error in assign_all_categories_to_users: {e}")
         return {
             'success': False,
             'error': str(e)
         }
     
-def handle_user_webhook(data, event_type):
+# Map GHL event types to your expected types
+USER_EVENT_TYPE_MAP = {
+    "UserCreate": "UserCreated",
+    "UserUpdate": "UserUpdated", 
+    "UserDelete": "UserDeleted"
+}
+
+def _webhook_user_data(data):
+    """A user webhook payload in the shape of a GHL users listing entry, as upsert_ghl_users reads it"""
+    return {
+        'id': data.get('id'),
+        'name': f"{data.get('firstName') or ''} {data.get('lastName') or ''}".strip(),
+        'firstName': data.get('firstName'),
+        'lastName': data.get('lastName'),
+        'email': data.get('email'),
+        'phone': data.get('phone'),
+        'role': data.get('role'),
+        'status': 'active',
+    }
+
+class StaleWebhookWrite(Exception):
+    """A newer webhook of a new user was written concurrently; the batch must be retried"""
+
+def _record_webhook_versions(versions):
     """
-    Handle user webhook events and automatically assign categories to new users
-    Also update GHL contacts when user information changes
+    Store the applied event versions with one UPDATE, only where they are newer.
+    Rows that existed are locked by the caller and always newer; a user created in
+    this batch may have been inserted concurrently by a newer event, in which case
+    StaleWebhookWrite is raised so the batch rolls back and is retried.
     """
-    try:
-        location_id = data.get("locationId")
-        user_id = data.get("id")
-        first_name = data.get("firstName")
-        last_name = data.get("lastName")
-        email = data.get("email")
-        phone = data.get("phone")  # Get phone from webhook
+    if not versions:
+        return
+    version = Case(
+        *[When(user_id=user_id, then=Value(user_version)) for user_id, user_version in versions.items()],
+        output_field=FloatField()
+    )
+    updated = GHLUser.objects.filter(
+        Q(webhook_version__isnull=True) | Q(webhook_version__lt=version), user_id__in=versions.keys()
+    ).update(webhook_version=version)
+    if updated < len(versions):
+        raise StaleWebhookWrite(f"{len(versions) - updated} users were written by newer webhooks concurrently")
+
+def apply_user_webhooks(events):
+    """
+    Apply a batch of user webhook events, given as (data, event_type, received_at), with bulk queries.
+    Credentials and existing users are loaded once for the batch, creates and updates go
+    through upsert_ghl_users per location and deletes are one DELETE. The newest event of
+    a user in the batch wins. Query count depends on the number of locations, not events.
+
+    Each user row keeps the version of the last event written to it and is locked
+    while the batch is applied, so an event older than one already written is skipped
+    even if another worker claimed it first.
+    """
+    latest = {}
+    invalid = 0
+    for data, event_type, received_at in events:
+        if not data.get("locationId") or not data.get("id"):
+            invalid += 1
+            continue
+        version = event_version(data, received_at)
+        if data["id"] not in latest or version >= latest[data["id"]][2]:
+            latest[data["id"]] = (USER_EVENT_TYPE_MAP.get(event_type, event_type), data, version)
+    
+    with transaction.atomic():
+        applied_versions = dict(
+            GHLUser.objects.select_for_update().filter(user_id__in=latest.keys()).values_list('user_id', 'webhook_version')
+        )
+        stale = [
+            user_id for user_id, (_, _, version) in latest.items()
+            if applied_versions.get(user_id) is not None and applied_versions[user_id] >= version
+        ]
+        for user_id in stale:
+            del latest[user_id]
         
-        print(f"🔄 Processing webhook: {event_type} for user: {email}")
+        upserts = [data for mapped, data, _ in latest.values() if mapped in ("UserCreated", "UserUpdated")]
+        deleted_ids = [user_id for user_id, (mapped, _, _) in latest.items() if mapped == "UserDeleted"]
         
-        if not location_id or not user_id:
-            print(f"❌ Invalid webhook data: location_id={location_id}, user_id={user_id}")
-            return
-
-        # Map GHL event types to your expected types
-        event_type_map = {
-            "UserCreate": "UserCreated",
-            "UserUpdate": "UserUpdated", 
-            "UserDelete": "UserDeleted"
-        }
+        locations = GHLAuthCredentials.objects.in_bulk(
+            {data["locationId"] for data in upserts}, field_name='location_id'
+        )
+        users_by_location = {}
+        for data in upserts:
+            location = locations.get(data["locationId"])
+            if location is None:
+                print(f"❌ Location not found: {data['locationId']}")
+                continue
+            users_by_location.setdefault(location, []).append(_webhook_user_data(data))
         
-        mapped_event_type = event_type_map.get(event_type, event_type)
-        print(f"📋 Event type mapped: {event_type} -> {mapped_event_type}")
-
-        if mapped_event_type in ["UserCreated", "UserUpdated"]:
-            try:
-                location = GHLAuthCredentials.objects.get(location_id=location_id)
-            except GHLAuthCredentials.DoesNotExist:
-                print(f"❌ Location not found: {location_id}")
-                return
-
-            # Create or update user - data is at root level, not nested
-            user, created = GHLUser.objects.update_or_create(
-                user_id=user_id,
-                defaults={
-                    'location': location,
-                    'location_ghl_id': location_id,
-                    'name': f"{first_name or ''} {last_name or ''}".strip(),
-                    'first_name': first_name or '',
-                    'last_name': last_name or '',
-                    'email': email or '',
-                    'phone': phone or '',  # Update phone field
-                    'role': data.get('role', ''),
-                    'status': 'active'
-                }
-            )
-            
-            print(f"👤 User {'created' if created else 'updated'}: {user.email}")
-            
-            # If this is a new user, assign all categories to them
-            if created:
-                categories = Category.objects.all()
-                if categories.exists():
-                    assignments_created = 0
-                    for category in categories:
-                        assignment, assignment_created = UserCategoryAssignment.objects.get_or_create(
-                            user=user,
-                            category=category
-                        )
-                        if assignment_created:
-                            assignments_created += 1
-                    
-                    print(f"✅ Auto-assigned {assignments_created} categories to new user: {user.email}")
-                else:
-                    print(f"⚠️ No categories available to assign to new user: {user.email}")
-            
-            # For UserUpdated events, also ensure the contact info is updated in GHL
-            if mapped_event_type == "UserUpdated":
-                from account.tasks import update_user_contact_task
-                update_user_contact_task.delay(
-                    user_email=user.email,
-                    user_first_name=user.first_name,
-                    user_last_name=user.last_name,
-                    user_phone=user.phone,
-                    location_id=user.location_ghl_id,
-                    access_token=location.access_token
-                )
-                print(f"📞 Contact update queued for: {user.email}")
-                
-        elif mapped_event_type == "UserDeleted":
-            # Delete user and their category assignments
-            try:
-                user = GHLUser.objects.get(user_id=user_id)
-                # Delete category assignments first (due to foreign key constraints)
-                UserCategoryAssignment.objects.filter(user=user).delete()
-                # Then delete the user
-                user.delete()
-                print(f"🗑️ Deleted user and their category assignments: {user_id}")
-            except GHLUser.DoesNotExist:
-                print(f"⚠️ User not found for deletion: {user_id}")
-            
-        print(f"✅ Webhook {mapped_event_type} processed successfully for user: {email}")
-            
-    except Exception as e:
-        print(f"❌ Error handling user webhook: {e}")
-        import traceback
-        traceback.print_exc()
\ No newline at end of file
+        totals = {'synced': 0, 'created': 0, 'updated': 0, 'assignments_created': 0}
+        for location, users_data in users_by_location.items():
+            result = upsert_ghl_users(location, users_data)
+            for key in totals:
+                totals[key] += result[key]
+        _record_webhook_versions(
+            {data["id"]: latest[data["id"]][2] for data in upserts if data["locationId"] in locations}
+        )
+        
+        deleted = 0
+        if deleted_ids:
+            # Category assignments go with the users
+            deleted = GHLUser.objects.filter(user_id__in=deleted_ids).delete()[1].get(GHLUser._meta.label, 0)
+    
+    # Ids only: the task reads the latest user data and token when it runs
+    updated_ids = [
+        user_id for user_id, (mapped, data, _) in latest.items()
+        if mapped == "UserUpdated" and data["locationId"] in locations
+    ]
+    contact_updates = 0
+    for user_pk in GHLUser.objects.filter(user_id__in=updated_ids).values_list('pk', flat=True):
+        contact_updates += queue_contact_update(user_pk)
+    
+    print(f"✅ Applied {len(events)} user webhooks: {totals['created']} created, {totals['updated']} updated, "
+          f"{deleted} deleted, {contact_updates} contact updates queued, {len(stale)} stale, {invalid} invalid")
+    return {
+        'events': len(events),
+        'created': totals['created'],
+        'updated': totals['updated'],
+        'deleted': deleted,
+        'assignments_created': totals['assignments_created'],
+        'contact_updates': contact_updates,
+        'stale': len(stale),
+        'invalid': invalid,
+    }
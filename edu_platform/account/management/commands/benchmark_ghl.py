@@ -0,0 +1,106 @@
+# account/management/commands/benchmark_ghl.py
+import time
+from django.core.management.base import BaseCommand, CommandError
+from edu_platform.celery import app as celery_app
+from account.fake_ghl import FakeGHLDataset, FakeGHLServer, use_fake_ghl
+from account.helpers import sync_ghl_users
+from account.models import GHLAuthCredentials, GHLContactLink, GHLUser
+from account.notifications import get_coalescing_store
+from account.tasks import flush_category_notifications_task
+from data_management.helpers import sync_ghl_contacts_and_opportunities
+from data_management.models import Contact, Opportunity, Pipeline
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the user sync, the contact/opportunity sync and the category notifications '
+        'against a seeded local fake GHL server and report time and GHL calls per phase. '
+        'Writes to the configured database under a dedicated location id.'
+    )
+
+    PHASES = ['users', 'data', 'notify']
+
+    def add_arguments(self, parser):
+        parser.add_argument('--location', default='fake-benchmark', help='Location id used for the run')
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--contacts', type=int, default=500)
+        parser.add_argument('--opportunities', type=int, default=200)
+        parser.add_argument('--latency', type=float, default=0.02, help='Fake server latency per request in seconds')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with 503')
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Share of requests answered with 429')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--phase', action='append', choices=self.PHASES, help='Phases to run (default: all)')
+        parser.add_argument('--keep', action='store_true', help='Keep the rows written by the run')
+
+    def handle(self, *args, **options):
+        location_id = options['location']
+        if GHLAuthCredentials.objects.filter(location_id=location_id).exclude(company_id='fake-company').exists():
+            raise CommandError(f'Location {location_id} belongs to a real connection, pick another --location')
+
+        dataset = FakeGHLDataset(
+            location_ids=[location_id],
+            users=options['users'],
+            contacts=options['contacts'],
+            opportunities=options['opportunities'],
+            seed=options['seed'],
+        )
+        server = FakeGHLServer(
+            dataset,
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+            rate_limit_rate=options['rate_limit_rate'],
+            retry_after=0,
+            seed=options['seed'],
+        )
+
+        # Run notification tasks inline so their GHL calls are counted in the phase that caused them
+        always_eager = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+        try:
+            with server, use_fake_ghl(server):
+                GHLAuthCredentials.objects.update_or_create(
+                    location_id=location_id,
+                    defaults={
+                        'user_id': 'fake-user', 'access_token': 'fake-access-0', 'refresh_token': 'fake-refresh-0',
+                        'expires_in': 86399, 'company_id': 'fake-company', 'location_name': f'Fake {location_id}',
+                    }
+                )
+                for phase in options['phase'] or self.PHASES:
+                    server.reset_counts()
+                    started = time.perf_counter()
+                    result = getattr(self, f'_run_{phase}')(location_id)
+                    self._report(phase, time.perf_counter() - started, result, server)
+        finally:
+            celery_app.conf.task_always_eager = always_eager
+            if not options['keep']:
+                self._cleanup(location_id, dataset)
+
+    def _run_users(self, location_id):
+        return sync_ghl_users(location_id, 'fake-access-0')
+
+    def _run_data(self, location_id):
+        sync_ghl_contacts_and_opportunities(location_id, 'fake-access-0')
+        return Contact.objects.filter(contact_id__startswith=f'{location_id}-').count()
+
+    def _run_notify(self, location_id):
+        """Notify every user twice; the second round shows what the stored push state saves"""
+        user_pks = list(GHLUser.objects.filter(location_ghl_id=location_id).values_list('pk', flat=True))
+        notified = 0
+        for _ in range(2):
+            get_coalescing_store().add(location_id, {f'{pk}:Benchmark' for pk in user_pks})
+            notified += flush_category_notifications_task(location_id)
+        return notified
+
+    def _report(self, phase, seconds, result, server):
+        calls = ', '.join(f'{name}={count}' for name, count in sorted(server.request_counts.items()))
+        self.stdout.write(
+            f'{phase:<7}: {seconds:6.2f}s, result={result}, {server.total_requests} GHL calls ({calls or "none"})'
+        )
+
+    def _cleanup(self, location_id, dataset):
+        # Users, category assignments and contact links go with the location
+        GHLContactLink.objects.filter(location_id=location_id).delete()
+        GHLAuthCredentials.objects.filter(location_id=location_id).delete()
+        Opportunity.objects.filter(opportunity_id__startswith=f'{location_id}-').delete()
+        Contact.objects.filter(contact_id__startswith=f'{location_id}-').delete()
+        Pipeline.objects.filter(pipeline_id__in=dataset.pipelines.keys()).delete()
@@ -0,0 +1,63 @@
+# account/management/commands/benchmark_ghl_async.py
+import asyncio
+import time
+from django.core.management.base import BaseCommand
+from account.fake_ghl import FakeGHLDataset, FakeGHLServer
+from account.ghl_async import AsyncGHLClient, ContactJob, push_contact, push_contacts
+from account.ratelimit import InMemoryTokenBucketStore, TokenBucketRateLimiter
+
+
+class Command(BaseCommand):
+    help = 'Compare sequential and concurrent GHL contact notifications against the local fake GHL server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Number of users to notify')
+        parser.add_argument('--latency', type=float, default=0.05, help='Fake server latency per request in seconds')
+        parser.add_argument('--concurrency', type=int, default=10, help='In-flight requests per location')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        users = options['users']
+        jobs = [
+            ContactJob(
+                email=f'contact-{i}@benchmark.example.com', first_name='Bench', last_name=str(i), phone='',
+                location_id='benchmark', access_token='benchmark', tags=['category added']
+            )
+            for i in range(users)
+        ]
+
+        def make_client(server):
+            # Unthrottled so only the overlap of network waits is measured
+            unlimited = TokenBucketRateLimiter(InMemoryTokenBucketStore(), rate=1e9, capacity=1e9)
+            return AsyncGHLClient(
+                base_url=server.base_url, rate_limiter=unlimited, concurrency_per_location=options['concurrency']
+            )
+
+        async def sequential(server):
+            async with make_client(server) as client:
+                return [await push_contact(client, job) for job in jobs]
+
+        async def concurrent(server):
+            async with make_client(server) as client:
+                return await push_contacts(jobs, client)
+
+        durations = {}
+        for label, run in [('sequential', sequential), ('concurrent', concurrent)]:
+            seconds, results, calls = self._measure(run, users, options)
+            durations[label] = seconds
+            ok = sum(1 for result in results if result.success)
+            self.stdout.write(
+                f'{label:<11}: {seconds:6.2f}s, {users / seconds:7.1f} users/s, '
+                f'{calls / users:.2f} calls/user ({ok}/{users} succeeded)'
+            )
+        self.stdout.write(self.style.SUCCESS(f"Speedup: {durations['sequential'] / durations['concurrent']:.2f}x"))
+
+    def _measure(self, coroutine_factory, users, options):
+        # A fresh dataset per run: half of the users already exist as contacts, some with the tag
+        dataset = FakeGHLDataset(
+            location_ids=['benchmark'], users=0, contacts=users // 2, opportunities=0, seed=options['seed']
+        )
+        with FakeGHLServer(dataset, latency=options['latency'], seed=options['seed']) as server:
+            started = time.perf_counter()
+            results = asyncio.run(coroutine_factory(server))
+            return time.perf_counter() - started, results, server.total_requests
@@ -0,0 +1,53 @@
+# account/management/commands/benchmark_ghl_client.py
+import time
+import requests
+from django.core.management.base import BaseCommand
+from account.fake_ghl import FakeGHLDataset, FakeGHLServer
+from account.ghl_client import GHLClient, GHL_API_VERSION
+from account.ratelimit import InMemoryTokenBucketStore, TokenBucketRateLimiter
+
+
+class Command(BaseCommand):
+    help = 'Compare calls per second of one-off requests calls and the pooled GHL client against the local fake GHL server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=500, help='Number of calls per run')
+
+    def handle(self, *args, **options):
+        calls = options['calls']
+        dataset = FakeGHLDataset(location_ids=['benchmark'], users=0, contacts=0, opportunities=0)
+        server = FakeGHLServer(dataset).start()
+        base_url = server.base_url
+        params = {'locationId': 'benchmark'}
+
+        try:
+            def one_off_call():
+                headers = {
+                    "Accept": "application/json",
+                    "Authorization": "Bearer benchmark",
+                    "Version": GHL_API_VERSION
+                }
+                requests.get(f'{base_url}/users/', headers=headers, params=params)
+
+            # Unthrottled so only connection handling is compared
+            unlimited = TokenBucketRateLimiter(InMemoryTokenBucketStore(), rate=1e9, capacity=1e9)
+            client = GHLClient(base_url=base_url, rate_limiter=unlimited)
+
+            def pooled_call():
+                client.get('/users/', 'benchmark', params=params)
+
+            one_off_rate = self._measure(one_off_call, calls)
+            pooled_rate = self._measure(pooled_call, calls)
+            client.close()
+        finally:
+            server.stop()
+
+        self.stdout.write(f'requests.get per call : {one_off_rate:8.1f} calls/s')
+        self.stdout.write(f'pooled GHLClient      : {pooled_rate:8.1f} calls/s')
+        self.stdout.write(self.style.SUCCESS(f'Speedup: {pooled_rate / one_off_rate:.2f}x over {calls} calls'))
+
+    def _measure(self, call, calls):
+        started = time.perf_counter()
+        for _ in range(calls):
+            call()
+        return calls / (time.perf_counter() - started)
@@ -0,0 +1,105 @@
+# account/management/commands/benchmark_webhooks.py
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from unittest import mock
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+from account import webhooks
+from account.models import WebhookLog
+from account.tasks import flush_webhook_buffer_task, handle_user_webhook_event, process_user_webhooks_task
+from account.views import GHLWebhookView
+from account.webhooks import USER_WEBHOOK_EVENTS, flush_webhook_buffer, get_webhook_buffer
+
+
+class Command(BaseCommand):
+    help = (
+        'Send a burst of webhooks through the webhook endpoint and report acknowledgement latency, '
+        'compared with writing WebhookLog and queueing the event inside the request. '
+        'Runs against a private in-memory buffer with task dispatch stubbed out, so the '
+        'shared Redis buffer and the broker are never touched; the WebhookLog rows written '
+        'by the run are deleted afterwards.'
+    )
+
+    LOCATION_ID = 'webhook-benchmark'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--webhooks', type=int, default=1000, help='Webhooks in the burst')
+        parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight at once')
+        parser.add_argument('--event-type', default='UserUpdate')
+
+    def handle(self, *args, **options):
+        with ExitStack() as stack:
+            stack.enter_context(override_settings(GHL_STATE_BACKEND='memory'))
+            # Fresh process-local stores, restored afterwards
+            for name in ('_buffer', '_state_store'):
+                stack.enter_context(mock.patch.object(webhooks, name, None))
+            # Stub the publishes so the benchmark's events never reach real workers
+            for task, method in [
+                (flush_webhook_buffer_task, 'apply_async'),
+                (handle_user_webhook_event, 'delay'),
+                (process_user_webhooks_task, 'delay'),
+            ]:
+                stack.enter_context(mock.patch.object(task, method))
+            self._run(options)
+
+    def _run(self, options):
+        factory = APIRequestFactory()
+        view = GHLWebhookView.as_view()
+        payloads = [
+            {
+                'type': options['event_type'], 'locationId': self.LOCATION_ID, 'id': f'benchmark-user-{i}',
+                'email': f'user-{i}@benchmark.example.com', 'firstName': 'Bench', 'lastName': str(i),
+            }
+            for i in range(options['webhooks'])
+        ]
+
+        def inline_ingest(payload):
+            # The previous request path: one INSERT and one broker publish before acknowledging
+            WebhookLog.objects.create(data=payload)
+            if payload['type'] in USER_WEBHOOK_EVENTS:
+                handle_user_webhook_event.delay(payload, payload['type'])
+
+        def buffered_ingest(payload):
+            view(factory.post('/api/ghl/webhook/', payload, format='json'))
+
+        try:
+            for label, ingest in [('inline', inline_ingest), ('buffered', buffered_ingest)]:
+                latencies, seconds = self._burst(ingest, payloads, options['concurrency'])
+                self._report(label, latencies, seconds)
+
+            pending = len(get_webhook_buffer())
+            started = time.perf_counter()
+            written = flush_webhook_buffer()
+            seconds = time.perf_counter() - started
+            self.stdout.write(
+                f'writer  : {written} of {pending} buffered webhooks written in {seconds:.2f}s '
+                f'({written / seconds if seconds else 0:.0f} rows/s)'
+            )
+        finally:
+            deleted, _ = WebhookLog.objects.filter(data__locationId=self.LOCATION_ID).delete()
+            self.stdout.write(self.style.SUCCESS(f'Removed {deleted} benchmark WebhookLog rows'))
+
+    def _burst(self, ingest, payloads, concurrency):
+        def timed(payload):
+            started = time.perf_counter()
+            try:
+                ingest(payload)
+            finally:
+                close_old_connections()
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(timed, payloads))
+        return latencies, time.perf_counter() - started
+
+    def _report(self, label, latencies, seconds):
+        quantiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(
+            f'{label:<8}: {len(latencies) / seconds:7.0f} req/s, p50 {quantiles[49] * 1000:6.2f}ms, '
+            f'p95 {quantiles[94] * 1000:6.2f}ms, p99 {quantiles[98] * 1000:6.2f}ms, max {max(latencies) * 1000:6.2f}ms'
+        )
@@ -0,0 +1,58 @@
+# account/management/commands/compact_webhook_logs.py
+import time
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from account.models import WebhookLog, WebhookLogArchive
+from account.retention import compact_webhook_logs
+
+
+class Command(BaseCommand):
+    help = 'Compress, archive and expire old WebhookLog rows and report the table sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--compress-after-days', type=int, help='Default: GHL_WEBHOOK_COMPRESS_AFTER_DAYS (0 skips)')
+        parser.add_argument('--archive-after-days', type=int, help='Default: GHL_WEBHOOK_ARCHIVE_AFTER_DAYS (0 skips)')
+        parser.add_argument('--retention-days', type=int, help='Default: GHL_WEBHOOK_RETENTION_DAYS (0 skips)')
+        parser.add_argument('--chunk-size', type=int, help='Rows per transaction (default: GHL_WEBHOOK_COMPACT_CHUNK_SIZE)')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count the rows each stage would touch without changing them'
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        self._report_tables('Before')
+
+        started = time.perf_counter()
+        report = compact_webhook_logs(
+            compress_after_days=options['compress_after_days'],
+            archive_after_days=options['archive_after_days'],
+            retention_days=options['retention_days'],
+            chunk_size=options['chunk_size'],
+            dry_run=dry_run,
+        )
+        seconds = time.perf_counter() - started
+
+        if not dry_run:
+            self._report_tables('After')
+        self.stdout.write(self.style.SUCCESS(
+            f'{"[DRY RUN] " if dry_run else ""}{report["compressed"]} compressed, {report["archived"]} archived, '
+            f'{report["purged"]} purged in {seconds:.1f}s'
+        ))
+
+    def _report_tables(self, label):
+        logs = WebhookLog.objects.all()
+        compressed = logs.filter(data_compressed__isnull=False).count()
+        archive = WebhookLogArchive.objects.all()
+        oldest = min(
+            (value for value in [
+                logs.aggregate(oldest=Min('received_at'))['oldest'],
+                archive.aggregate(oldest=Min('received_at'))['oldest'],
+            ] if value),
+            default=None
+        )
+        self.stdout.write(
+            f'{label}: {logs.count()} webhook logs ({compressed} compressed), {archive.count()} archived, '
+            f'oldest {oldest:%Y-%m-%d}' if oldest else f'{label}: no webhook logs'
+        )
@@ -0,0 +1,57 @@
+# account/management/commands/reconcile_ghl_users.py
+from django.core.management.base import BaseCommand, CommandError
+from account.ghl_client import GHLAPIError
+from account.helpers import reconcile_removed_ghl_users
+from account.models import GHLAuthCredentials
+from account.services import iter_ghl_users
+from account.tokens import get_access_token
+
+
+class Command(BaseCommand):
+    help = 'Deactivate local users that GHL no longer returns for a location'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--location',
+            action='append',
+            help='GHL location id to reconcile (repeatable, default: every connected location)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report the users that would be deactivated without changing them'
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        verb = 'would be deactivated' if dry_run else 'deactivated'
+        location_ids = options['location'] or list(
+            GHLAuthCredentials.objects.values_list('location_id', flat=True)
+        )
+
+        total = 0
+        for location_id in location_ids:
+            access_token = get_access_token(location_id)
+            if not access_token:
+                raise CommandError(f'No credentials for location {location_id}')
+
+            try:
+                ghl_user_ids = {
+                    user_data.get('id')
+                    for page in iter_ghl_users(location_id, access_token)
+                    for user_data in page
+                }
+            except GHLAPIError as e:
+                self.stderr.write(f'Skipping {location_id}: {e}')
+                continue
+            if not ghl_user_ids:
+                self.stderr.write(f'Skipping {location_id}: GHL returned no users')
+                continue
+
+            removed = reconcile_removed_ghl_users(location_id, ghl_user_ids, dry_run=dry_run)
+            for user_id, email in removed:
+                self.stdout.write(f'  {location_id}: {user_id} <{email}>')
+            self.stdout.write(f'{location_id}: {len(removed)} users {verb} ({len(ghl_user_ids)} in GHL)')
+            total += len(removed)
+
+        self.stdout.write(self.style.SUCCESS(f'{"[DRY RUN] " if dry_run else ""}{total} users {verb}'))
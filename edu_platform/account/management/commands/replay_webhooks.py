@@ -0,0 +1,147 @@
+# account/management/commands/replay_webhooks.py
+import queue
+import threading
+import time
+import zlib
+from datetime import datetime, time as day_start
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_naive, make_aware
+from account.helpers import apply_user_webhooks
+from account.models import WebhookLog, WebhookLogArchive
+from account.webhooks import USER_WEBHOOK_EVENTS
+
+# Marks the end of the stream on each worker queue
+_DONE = object()
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay stored webhooks through the user webhook processor, --batch-size events at a time, '
+        'oldest first. Webhooks of the same user always go to the same worker, so each user sees '
+        'its events in the original order. '
+        'Reports replay throughput, so it doubles as a webhook processing benchmark.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Replay webhooks received at or after this date/time')
+        parser.add_argument('--until', help='Replay webhooks received before this date/time')
+        parser.add_argument('--location', help='Only webhooks of this GHL location id')
+        parser.add_argument('--event-type', action='append', help='Only these webhook types (repeatable)')
+        parser.add_argument('--include-archive', action='store_true', help='Also replay archived webhooks')
+        parser.add_argument('--workers', type=int, default=4, help='Parallel workers')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per database round trip')
+        parser.add_argument(
+            '--batch-size', type=int, default=1,
+            help='Events each worker applies at once with the bulk processor (1 replays one event at a time)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Stream and route the webhooks without processing them'
+        )
+
+    def handle(self, *args, **options):
+        since = self._parse_moment(options['since'], '--since')
+        until = self._parse_moment(options['until'], '--until')
+        location_id = options['location']
+        event_types = set(options['event_type'] or USER_WEBHOOK_EVENTS)
+        unsupported = event_types - USER_WEBHOOK_EVENTS
+        if unsupported:
+            raise CommandError(f'Only user webhooks can be replayed, not: {", ".join(sorted(unsupported))}')
+
+        dry_run = options['dry_run']
+        workers = max(1, options['workers'])
+        queues = [queue.Queue(maxsize=options['chunk_size']) for _ in range(workers)]
+        batch_size = max(1, options['batch_size'])
+        processed = [0] * workers
+        errors = [0] * workers
+
+        def apply(index, batch):
+            if not dry_run:
+                try:
+                    apply_user_webhooks(batch)
+                except Exception as e:
+                    errors[index] += len(batch)
+                    self.stderr.write(f'Replaying {len(batch)} webhooks failed: {e}')
+            processed[index] += len(batch)
+
+        def work(index):
+            batch = []
+            try:
+                while True:
+                    item = queues[index].get()
+                    if item is _DONE:
+                        break
+                    batch.append(item)
+                    if len(batch) >= batch_size:
+                        apply(index, batch)
+                        batch = []
+                if batch:
+                    apply(index, batch)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work, args=(index,), daemon=True) for index in range(workers)]
+        for thread in threads:
+            thread.start()
+
+        started = time.perf_counter()
+        streamed = skipped = 0
+        try:
+            for payload, received_at in self._stream(since, until, location_id, options):
+                streamed += 1
+                event_type = payload.get('type') if isinstance(payload, dict) else None
+                if event_type not in event_types or (location_id and payload.get('locationId') != location_id):
+                    skipped += 1
+                    continue
+                user_key = str(payload.get('id') or streamed)
+                queues[zlib.crc32(user_key.encode()) % workers].put((payload, event_type, received_at.isoformat()))
+        finally:
+            for worker_queue in queues:
+                worker_queue.put(_DONE)
+            for thread in threads:
+                thread.join()
+        seconds = time.perf_counter() - started
+
+        total = sum(processed)
+        self.stdout.write(
+            f'Streamed {streamed} webhooks, skipped {skipped} by type/location, '
+            f'{"routed" if dry_run else "replayed"} {total} ({sum(errors)} failed)'
+        )
+        self.stdout.write(f'Per worker: {", ".join(str(count) for count in processed)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{"[DRY RUN] " if dry_run else ""}{total} webhooks in {seconds:.2f}s '
+            f'({total / seconds if seconds else 0:.0f} webhooks/s with {workers} workers, batches of {batch_size})'
+        ))
+
+    def _stream(self, since, until, location_id, options):
+        """(payload, received_at) in received order: archived webhooks first (they are the oldest), then WebhookLog"""
+        models = [WebhookLogArchive, WebhookLog] if options['include_archive'] else [WebhookLog]
+        for model in models:
+            rows = model.objects.all()
+            if since:
+                rows = rows.filter(received_at__gte=since)
+            if until:
+                rows = rows.filter(received_at__lt=until)
+            if model is WebhookLog:
+                # Compressed rows can only be filtered once decoded
+                if location_id:
+                    rows = rows.filter(Q(data__locationId=location_id) | Q(data_compressed__isnull=False))
+                if options['event_type']:
+                    rows = rows.filter(Q(data__type__in=options['event_type']) | Q(data_compressed__isnull=False))
+            for row in rows.order_by('received_at', 'pk').iterator(chunk_size=options['chunk_size']):
+                yield row.payload, row.received_at
+
+    def _parse_moment(self, value, option):
+        if not value:
+            return None
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                raise CommandError(f'{option} must be a date (YYYY-MM-DD) or an ISO date/time')
+            moment = datetime.combine(day, day_start.min)
+        return make_aware(moment) if is_naive(moment) else moment
@@ -0,0 +1,218 @@
+import json
+import logging
+import re
+import threading
+from collections import defaultdict
+from django.conf import settings
+from .redis_client import get_redis, use_memory_backend
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+# Path segments that are part of the GHL route; anything else (ids) becomes {id}
+_ROUTE_WORDS = {
+    'oauth', 'token', 'locations', 'users', 'contacts', 'search', 'upsert', 'tags',
+    'opportunities', 'pipelines',
+}
+_SEPARATOR = '|'
+
+
+def endpoint_for(path):
+    """Collapse a request path into a low-cardinality route, e.g. /contacts/{id}/tags"""
+    path = re.sub(r'^https?://[^/]+', '', path or '').split('?', 1)[0]
+    segments = [
+        segment if segment in _ROUTE_WORDS else '{id}'
+        for segment in path.strip('/').split('/') if segment
+    ]
+    return '/' + '/'.join(segments) + ('/' if path.endswith('/') and segments else '')
+
+
+class InMemoryMetricsStore:
+    """
+    Process-local counters, used for local runs and tests
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = defaultdict(float)
+
+    def incr(self, amounts):
+        with self._lock:
+            for field, amount in amounts.items():
+                self._values[field] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class RedisMetricsStore:
+    """
+    Counters in one Redis hash so every worker process reports into the same totals
+    """
+    KEY = 'ghl:metrics'
+
+    def __init__(self, connection):
+        self.redis = connection
+
+    def incr(self, amounts):
+        pipe = self.redis.pipeline(transaction=False)
+        for field, amount in amounts.items():
+            pipe.hincrbyfloat(self.KEY, field, amount)
+        pipe.execute()
+
+    def snapshot(self):
+        return {field.decode(): float(value) for field, value in self.redis.hgetall(self.KEY).items()}
+
+    def reset(self):
+        self.redis.delete(self.KEY)
+
+
+_store = None
+
+
+def get_metrics_store():
+    global _store
+    if _store is None:
+        if use_memory_backend():
+            _store = InMemoryMetricsStore()
+        else:
+            _store = RedisMetricsStore(get_redis())
+    return _store
+
+
+def _field(metric, method, endpoint, label=''):
+    return _SEPARATOR.join((metric, method, endpoint, str(label)))
+
+
+def record_call(method, path, status, seconds, bytes_sent=0, bytes_received=0, location_id=None, attempt=0):
+    """
+    Record one HTTP attempt to GHL. ``status`` is the response code, or the
+    exception class name when no response came back.
+    """
+    if not settings.GHL_METRICS_ENABLED:
+        return
+    endpoint = endpoint_for(path)
+    bucket = next(bound for bound in LATENCY_BUCKETS if seconds <= bound)
+    amounts = {
+        _field('requests', method, endpoint, status): 1,
+        _field('latency_bucket', method, endpoint, bucket): 1,
+        _field('latency_sum', method, endpoint): seconds,
+        _field('bytes_sent', method, endpoint): bytes_sent,
+        _field('bytes_received', method, endpoint): bytes_received,
+    }
+    try:
+        get_metrics_store().incr(amounts)
+    except Exception as e:
+        # Metrics must never break a GHL call
+        logger.warning(f"Could not record GHL metrics: {e}")
+
+    logger.info(json.dumps({
+        'event': 'ghl_call',
+        'method': method,
+        'endpoint': endpoint,
+        'status': status,
+        'duration_ms': round(seconds * 1000, 1),
+        'bytes_sent': bytes_sent,
+        'bytes_received': bytes_received,
+        'location_id': location_id,
+        'attempt': attempt,
+    }))
+
+
+def record_retry(method, path, reason):
+    """Count a retry of a GHL call; ``reason`` is the status code or exception that caused it"""
+    if not settings.GHL_METRICS_ENABLED:
+        return
+    try:
+        get_metrics_store().incr({_field('retries', method, endpoint_for(path), reason): 1})
+    except Exception as e:
+        logger.warning(f"Could not record GHL metrics: {e}")
+
+
+def record_rate_limit_wait(seconds):
+    """Time spent waiting for the client-side rate limiter"""
+    if not settings.GHL_METRICS_ENABLED or seconds <= 0:
+        return
+    try:
+        get_metrics_store().incr({_field('ratelimit_wait', '', ''): seconds})
+    except Exception as e:
+        logger.warning(f"Could not record GHL metrics: {e}")
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+def _number(value):
+    """Sample value without losing precision: whole numbers as ints, the rest as repr(float)"""
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def render_prometheus(snapshot=None):
+    """Render the counters in the Prometheus text exposition format"""
+    snapshot = get_metrics_store().snapshot() if snapshot is None else snapshot
+    requests, buckets, sums, retries, sent, received = (defaultdict(float) for _ in range(6))
+    wait = 0.0
+    for field, value in snapshot.items():
+        metric, method, endpoint, label = field.split(_SEPARATOR, 3)
+        key = (method, endpoint)
+        if metric == 'requests':
+            requests[key + (label,)] += value
+        elif metric == 'latency_bucket':
+            buckets[key + (float(label),)] += value
+        elif metric == 'latency_sum':
+            sums[key] += value
+        elif metric == 'retries':
+            retries[key + (label,)] += value
+        elif metric == 'bytes_sent':
+            sent[key] += value
+        elif metric == 'bytes_received':
+            received[key] += value
+        elif metric == 'ratelimit_wait':
+            wait += value
+
+    lines = [
+        '# HELP ghl_requests_total GHL HTTP attempts by endpoint and status',
+        '# TYPE ghl_requests_total counter',
+    ]
+    for (method, endpoint, status), value in sorted(requests.items()):
+        lines.append(f'ghl_requests_total{_labels(method=method, endpoint=endpoint, status=status)} {_number(value)}')
+
+    lines += [
+        '# HELP ghl_request_duration_seconds GHL HTTP attempt latency',
+        '# TYPE ghl_request_duration_seconds histogram',
+    ]
+    for method, endpoint in sorted(sums):
+        cumulative = 0
+        for bound in LATENCY_BUCKETS:
+            cumulative += buckets.get((method, endpoint, bound), 0)
+            le = '+Inf' if bound == float('inf') else f'{bound:g}'
+            lines.append(
+                f'ghl_request_duration_seconds_bucket{_labels(method=method, endpoint=endpoint, le=le)} {_number(cumulative)}'
+            )
+        lines.append(f'ghl_request_duration_seconds_sum{_labels(method=method, endpoint=endpoint)} {_number(sums[(method, endpoint)])}')
+        lines.append(f'ghl_request_duration_seconds_count{_labels(method=method, endpoint=endpoint)} {_number(cumulative)}')
+
+    lines += ['# HELP ghl_retries_total GHL calls retried by reason', '# TYPE ghl_retries_total counter']
+    for (method, endpoint, reason), value in sorted(retries.items()):
+        lines.append(f'ghl_retries_total{_labels(method=method, endpoint=endpoint, reason=reason)} {_number(value)}')
+
+    lines += ['# HELP ghl_bytes_total Bytes sent to and received from GHL', '# TYPE ghl_bytes_total counter']
+    for direction, totals in (('sent', sent), ('received', received)):
+        for (method, endpoint), value in sorted(totals.items()):
+            lines.append(f'ghl_bytes_total{_labels(method=method, endpoint=endpoint, direction=direction)} {_number(value)}')
+
+    lines += [
+        '# HELP ghl_ratelimit_wait_seconds_total Time spent waiting for the client-side rate limiter',
+        '# TYPE ghl_ratelimit_wait_seconds_total counter',
+        f'ghl_ratelimit_wait_seconds_total {_number(wait)}',
+    ]
+    return '\n'.join(lines) + '\n'
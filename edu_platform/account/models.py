@@ -1,4 +1,10 @@
+import json
+import zlib
+from datetime import timedelta
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils.timezone import now
+from .tracking import TrackedFieldsMixin
 
 class GHLAuthCredentials(models.Model):
     user_id = models.CharField(max_length=255)
@@ -17,7 +23,12 @@ class GHLAuthCredentials(models.Model):
     def __str__(self):
         return f"{self.location_name} - {self.location_id}"
 
-class GHLUser(models.Model):
+    @property
+    def expires_at(self):
+        """When the access token expires; updated_at is bumped on every token save"""
+        return self.updated_at + timedelta(seconds=self.expires_in or 0)
+
+class GHLUser(TrackedFieldsMixin, models.Model):
     user_id = models.CharField(max_length=255, unique=True)
     location = models.ForeignKey(GHLAuthCredentials, on_delete=models.CASCADE, related_name='users')
     location_ghl_id = models.CharField(max_length=255, blank=True)  # ADD THIS FIELD
@@ -28,9 +39,13 @@ class GHLUser(models.Model):
     phone = models.CharField(max_length=20, blank=True)
     role = models.CharField(max_length=100, blank=True)
     status = models.CharField(max_length=50, default="active")
+    # account.webhooks.event_version of the last user webhook written to the row; older ones are skipped
+    webhook_version = models.FloatField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    tracked_fields = ('status',)
+
     class Meta:
         db_table = 'ghl_users'
     
@@ -63,9 +78,112 @@ class GHLLocation(models.Model):
         return f"{self.name} - {self.location_id}"
 
 
+class GHLSyncState(models.Model):
+    """Per-location watermark of the last incremental sync of a GHL resource (e.g. users)"""
+    location_id = models.CharField(max_length=255)
+    resource = models.CharField(max_length=50)
+    watermark = models.DateTimeField(null=True, blank=True)
+    last_full_sync_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'ghl_sync_states'
+        unique_together = ['location_id', 'resource']
+
+    def __str__(self):
+        return f"{self.resource} @ {self.location_id}: {self.watermark}"
+
+
+class GHLContactLink(models.Model):
+    """Known GHL contact id for an email in a location, so repeat pushes skip /contacts/search"""
+    location_id = models.CharField(max_length=255)
+    email = models.EmailField(max_length=255)
+    contact_id = models.CharField(max_length=255)
+    # Push state: hash of the last contact payload GHL accepted and the tags it confirmed
+    payload_hash = models.CharField(max_length=64, blank=True, default='')
+    tags = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'ghl_contact_links'
+        unique_together = ['location_id', 'email']
+
+    def __str__(self):
+        return f"{self.email} -> {self.contact_id} ({self.location_id})"
+
+
+class SyncRun(models.Model):
+    """One fan-out sync of many locations: per-location outcomes, row counts and duration"""
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('partial', 'Completed with failures'),
+        ('failed', 'Failed'),
+    ]
+
+    incremental = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    locations_total = models.PositiveIntegerField(default=0)
+    locations_synced = models.PositiveIntegerField(default=0)
+    locations_skipped = models.PositiveIntegerField(default=0)
+    locations_failed = models.PositiveIntegerField(default=0)
+    users_synced = models.PositiveIntegerField(default=0)
+    contacts_synced = models.PositiveIntegerField(default=0)
+    opportunities_synced = models.PositiveIntegerField(default=0)
+    # One entry per location as returned by account.sync.sync_location
+    results = models.JSONField(default=list, blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration_seconds = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'ghl_sync_runs'
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"Sync run {self.pk} ({self.status}): {self.locations_synced}/{self.locations_total} locations"
+
+
 class WebhookLog(models.Model):
-    received_at = models.DateTimeField(auto_now_add=True)
+    # Set by the buffered writer to when the webhook arrived, not when the row is written
+    received_at = models.DateTimeField(default=now, db_index=True)
     data = models.JSONField(null=True, blank=True)
+    # zlib-compressed JSON of ``data`` once compaction has compressed the row (``data`` is then null)
+    data_compressed = models.BinaryField(null=True, blank=True)
 
     def __str__(self):
         return f"Webhook {self.id} : {self.received_at}"
+
+    @property
+    def payload(self):
+        """The webhook body, whether it is stored plain or compressed"""
+        if self.data_compressed is not None:
+            return decompress_payload(self.data_compressed)
+        return self.data
+
+
+class WebhookLogArchive(models.Model):
+    """WebhookLog rows past GHL_WEBHOOK_ARCHIVE_AFTER_DAYS, compressed, until retention deletes them"""
+    webhook_id = models.BigIntegerField(unique=True)
+    received_at = models.DateTimeField(db_index=True)
+    data_compressed = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'ghl_webhook_log_archive'
+
+    def __str__(self):
+        return f"Archived webhook {self.webhook_id} : {self.received_at}"
+
+    @property
+    def payload(self):
+        return decompress_payload(self.data_compressed)
+
+
+def compress_payload(data):
+    return zlib.compress(json.dumps(data, separators=(',', ':'), cls=DjangoJSONEncoder).encode())
+
+
+def decompress_payload(blob):
+    return json.loads(zlib.decompress(bytes(blob)))
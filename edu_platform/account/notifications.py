@@ -0,0 +1,128 @@
+import threading
+import time
+import logging
+from django.conf import settings
+from .redis_client import get_redis, use_memory_backend
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryCoalescingStore:
+    """
+    Process-local stand-in for the Redis store, used for local runs and tests
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._claims = {}
+
+    def add(self, key, values):
+        with self._lock:
+            self._pending.setdefault(key, set()).update(values)
+
+    def claim(self, key, ttl):
+        """Return True if the caller is the first to claim a flush for ``key``"""
+        with self._lock:
+            expires_at = self._claims.get(key)
+            if expires_at and expires_at > time.monotonic():
+                return False
+            self._claims[key] = time.monotonic() + ttl
+            return True
+
+    def pop(self, key):
+        """Release the flush claim and return (and clear) everything collected for ``key``"""
+        with self._lock:
+            self._claims.pop(key, None)
+            return self._pending.pop(key, set())
+
+
+class RedisCoalescingStore:
+    """
+    Collects values in a Redis set per key so every worker process shares one window
+    """
+    PREFIX = 'ghl:notify'
+
+    def __init__(self, connection):
+        self.redis = connection
+
+    def add(self, key, values):
+        if values:
+            self.redis.sadd(f'{self.PREFIX}:pending:{key}', *values)
+
+    def claim(self, key, ttl):
+        return bool(self.redis.set(f'{self.PREFIX}:claim:{key}', 1, nx=True, ex=ttl))
+
+    def pop(self, key):
+        pending_key = f'{self.PREFIX}:pending:{key}'
+        pipe = self.redis.pipeline()
+        pipe.delete(f'{self.PREFIX}:claim:{key}')
+        pipe.smembers(pending_key)
+        pipe.delete(pending_key)
+        _, members, _ = pipe.execute()
+        return {member.decode() for member in members}
+
+
+_store = None
+
+
+def get_coalescing_store():
+    global _store
+    if _store is None:
+        if use_memory_backend():
+            _store = InMemoryCoalescingStore()
+        else:
+            _store = RedisCoalescingStore(get_redis())
+    return _store
+
+
+def queue_category_notification(location_id, user_pk, category_names, countdown=None):
+    """
+    Collect category assignments for a user and schedule a GHL notification.
+    Events are collected per location: the first event in a window schedules
+    one flush for the location, which notifies every collected user once.
+    ``countdown`` (e.g. a Retry-After) lengthens the window.
+    """
+    from .tasks import flush_category_notifications_task
+
+    window = max(settings.GHL_NOTIFICATION_WINDOW, int(countdown or 0))
+    store = get_coalescing_store()
+
+    store.add(location_id, {f'{user_pk}:{name}' for name in category_names})
+    # The claim outlives the window so a lost flush task can't block the location forever
+    if store.claim(location_id, window + 60):
+        flush_category_notifications_task.apply_async((location_id,), countdown=window)
+        logger.info(f"Scheduled GHL notifications for location {location_id} in {window}s")
+
+
+def pop_category_notifications(location_id):
+    """Return {user pk: category names} collected for a location since the last flush"""
+    names_by_user = {}
+    for value in get_coalescing_store().pop(location_id):
+        user_pk, name = value.split(':', 1)
+        names_by_user.setdefault(int(user_pk), set()).add(name)
+    return names_by_user
+
+
+def _contact_update_key(user_pk):
+    return f'contact-update:{user_pk}'
+
+
+def queue_contact_update(user_pk):
+    """
+    Schedule a GHL contact update for a user unless one is already scheduled.
+    The task reads the user when it runs, so every change made during the
+    window goes out in that single update.
+    """
+    from .tasks import update_user_contact_task
+
+    window = settings.GHL_CONTACT_UPDATE_WINDOW
+    if get_coalescing_store().claim(_contact_update_key(user_pk), window + 60):
+        update_user_contact_task.apply_async(kwargs={'user_id': user_pk}, countdown=window)
+        return True
+    return False
+
+
+def release_contact_update(user_pk):
+    """Let the next change of the user schedule a new contact update"""
+    get_coalescing_store().pop(_contact_update_key(user_pk))
@@ -0,0 +1,168 @@
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from django.conf import settings
+from .redis_client import get_redis, use_memory_backend
+
+
+class InMemoryTokenBucketStore:
+    """
+    Process-local token buckets, used for local runs and tests
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, key, rate, capacity):
+        """Take one token; return 0 on success or the seconds to wait before trying again"""
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            return wait
+
+
+class RedisTokenBucketStore:
+    """
+    Token buckets kept in Redis so every worker process draws from the same per-location budget
+    """
+    PREFIX = 'ghl:ratelimit'
+
+    # Refill and take atomically; Redis TIME keeps all workers on one clock
+    SCRIPT = """
+    local now_parts = redis.call('TIME')
+    local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+    local rate = tonumber(ARGV[1])
+    local capacity = tonumber(ARGV[2])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local updated_at = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+    local wait = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        wait = (1 - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+    return tostring(wait)
+    """
+
+    def __init__(self, connection):
+        self._script = connection.register_script(self.SCRIPT)
+
+    def take(self, key, rate, capacity):
+        return float(self._script(keys=[f'{self.PREFIX}:{key}'], args=[rate, capacity]))
+
+
+class TokenBucketRateLimiter:
+    """
+    Blocks callers until the bucket for their key (a GHL location id) has a token
+    """
+
+    def __init__(self, store, rate, capacity):
+        self.store = store
+        self.rate = rate
+        self.capacity = capacity
+
+    def acquire(self, key):
+        """Wait for a token; return the total seconds spent waiting"""
+        waited = 0.0
+        while True:
+            wait = self.store.take(key, self.rate, self.capacity)
+            if wait <= 0:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self, key):
+        """acquire() for asyncio callers: the store round trip and the sleep don't block the event loop"""
+        waited = 0.0
+        while True:
+            wait = await asyncio.to_thread(self.store.take, key, self.rate, self.capacity)
+            if wait <= 0:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter that honours Retry-After on 429/503 responses
+    """
+    RETRY_STATUSES = {429, 502, 503, 504}
+    IDEMPOTENT_METHODS = {'GET', 'PUT', 'DELETE', 'HEAD', 'OPTIONS'}
+
+    def __init__(self, max_retries, base_delay, max_delay):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, method, status_code, attempt):
+        if attempt >= self.max_retries or status_code not in self.RETRY_STATUSES:
+            return False
+        # 429 means the request was rejected before processing, so it is safe to resend any method
+        return status_code == 429 or method.upper() in self.IDEMPOTENT_METHODS
+
+    def should_retry_error(self, method, attempt):
+        """Connection errors and timeouts are only retried for idempotent methods"""
+        return attempt < self.max_retries and method.upper() in self.IDEMPOTENT_METHODS
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def delay(self, attempt, response=None):
+        retry_after = retry_after_seconds(response)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return self.backoff(attempt)
+
+
+def retry_after_seconds(response):
+    """Parse a Retry-After header given either as seconds or as an HTTP date"""
+    if response is None:
+        return None
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+_rate_limiter = None
+
+
+def get_rate_limiter():
+    global _rate_limiter
+    if _rate_limiter is None:
+        store = InMemoryTokenBucketStore() if use_memory_backend() else RedisTokenBucketStore(get_redis())
+        _rate_limiter = TokenBucketRateLimiter(
+            store,
+            rate=settings.GHL_RATE_LIMIT_PER_SECOND,
+            capacity=settings.GHL_RATE_LIMIT_BURST
+        )
+    return _rate_limiter
+
+
+def get_retry_policy():
+    return RetryPolicy(
+        max_retries=settings.GHL_MAX_RETRIES,
+        base_delay=settings.GHL_RETRY_BASE_DELAY,
+        max_delay=settings.GHL_RETRY_MAX_DELAY
+    )
@@ -0,0 +1,17 @@
+import redis
+from django.conf import settings
+
+_connection = None
+
+
+def get_redis():
+    """Return the process-wide Redis connection used for cross-worker GHL state"""
+    global _connection
+    if _connection is None:
+        _connection = redis.Redis.from_url(settings.REDIS_URL)
+    return _connection
+
+
+def use_memory_backend():
+    """True when GHL state should be kept in process memory instead of Redis (local runs, tests)"""
+    return settings.GHL_STATE_BACKEND == 'memory'
@@ -0,0 +1,112 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
+from .models import WebhookLog, WebhookLogArchive, compress_payload
+
+logger = logging.getLogger(__name__)
+
+
+def _chunks(queryset, chunk_size):
+    """Yield lists of primary keys, oldest first, re-querying after each chunk is handled"""
+    while True:
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return
+        yield pks
+        if len(pks) < chunk_size:
+            return
+
+
+def compress_webhook_logs(older_than, chunk_size=1000, dry_run=False, newer_than=None):
+    """Move ``data`` of WebhookLog rows received before ``older_than`` into ``data_compressed``"""
+    queryset = WebhookLog.objects.filter(received_at__lt=older_than, data_compressed__isnull=True)
+    if newer_than:
+        queryset = queryset.filter(received_at__gte=newer_than)
+    if dry_run:
+        return queryset.count()
+
+    compressed = 0
+    for pks in _chunks(queryset, chunk_size):
+        rows = list(WebhookLog.objects.filter(pk__in=pks).only('pk', 'data'))
+        for row in rows:
+            row.data_compressed = compress_payload(row.data)
+            row.data = None
+        WebhookLog.objects.bulk_update(rows, ['data', 'data_compressed'])
+        compressed += len(rows)
+    return compressed
+
+
+def archive_webhook_logs(older_than, chunk_size=1000, dry_run=False, newer_than=None):
+    """Move WebhookLog rows received before ``older_than`` into the compressed archive table"""
+    queryset = WebhookLog.objects.filter(received_at__lt=older_than)
+    if newer_than:
+        queryset = queryset.filter(received_at__gte=newer_than)
+    if dry_run:
+        return queryset.count()
+
+    archived = 0
+    for pks in _chunks(queryset, chunk_size):
+        rows = WebhookLog.objects.filter(pk__in=pks)
+        with transaction.atomic():
+            WebhookLogArchive.objects.bulk_create([
+                WebhookLogArchive(
+                    webhook_id=row.pk,
+                    received_at=row.received_at,
+                    data_compressed=row.data_compressed if row.data_compressed is not None else compress_payload(row.data),
+                )
+                for row in rows
+            ], ignore_conflicts=True)
+            WebhookLog.objects.filter(pk__in=pks).delete()
+        archived += len(pks)
+    return archived
+
+
+def purge_webhook_logs(older_than, chunk_size=1000, dry_run=False):
+    """Delete webhooks received before ``older_than``, archived or not"""
+    deleted = 0
+    for model in (WebhookLogArchive, WebhookLog):
+        queryset = model.objects.filter(received_at__lt=older_than)
+        if dry_run:
+            deleted += queryset.count()
+            continue
+        for pks in _chunks(queryset, chunk_size):
+            deleted += model.objects.filter(pk__in=pks).delete()[0]
+    return deleted
+
+
+def compact_webhook_logs(compress_after_days=None, archive_after_days=None, retention_days=None,
+                         chunk_size=None, dry_run=False):
+    """
+    Run the WebhookLog lifecycle: compress rows older than ``compress_after_days``,
+    move rows older than ``archive_after_days`` to the archive table and delete
+    rows older than ``retention_days`` from both tables. Work is done in chunks of
+    ``chunk_size`` rows, one short transaction each. A stage with no age (0) is skipped.
+    Returns the number of rows per stage.
+    """
+    compress_after_days = settings.GHL_WEBHOOK_COMPRESS_AFTER_DAYS if compress_after_days is None else compress_after_days
+    archive_after_days = settings.GHL_WEBHOOK_ARCHIVE_AFTER_DAYS if archive_after_days is None else archive_after_days
+    retention_days = settings.GHL_WEBHOOK_RETENTION_DAYS if retention_days is None else retention_days
+    chunk_size = chunk_size or settings.GHL_WEBHOOK_COMPACT_CHUNK_SIZE
+    current = now()
+
+    purge_before = current - timedelta(days=retention_days) if retention_days else None
+    archive_before = current - timedelta(days=archive_after_days) if archive_after_days else None
+
+    report = {'compressed': 0, 'archived': 0, 'purged': 0}
+    # Oldest stage first, each starting where the previous one ends, so no row is handled twice
+    if purge_before:
+        report['purged'] = purge_webhook_logs(purge_before, chunk_size, dry_run)
+    if archive_before:
+        report['archived'] = archive_webhook_logs(archive_before, chunk_size, dry_run, newer_than=purge_before)
+    if compress_after_days:
+        report['compressed'] = compress_webhook_logs(
+            current - timedelta(days=compress_after_days), chunk_size, dry_run, newer_than=archive_before or purge_before
+        )
+
+    logger.info(
+        f"{'[DRY RUN] ' if dry_run else ''}WebhookLog compaction: {report['compressed']} compressed, "
+        f"{report['archived']} archived, {report['purged']} purged"
+    )
+    return report
@@ -1,16 +1,12 @@
 import requests
 from django.conf import settings
+from .ghl_client import get_ghl_client, GHLAPIError, GHLRateLimitError
 
 def get_location_name(location_id, access_token):
-    url = f"https://services.leadconnectorhq.com/locations/{location_id}"
-    headers = {
-        "Accept": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Version": "2021-07-28"
-    }
+    path = f"/locations/{location_id}"
 
     try:
-        response = requests.get(url, headers=headers)
+        response = get_ghl_client().get(path, access_token, location_id)
         response.raise_for_status()
         
         data = response.json()
@@ -21,245 +17,92 @@ def get_location_name(location_id, access_token):
         print(f"Error fetching location: {e}")
         return None, "UTC"
 
-def get_ghl_users(location_id, access_token):
-    """Get all users for a location"""
-    url = "https://services.leadconnectorhq.com/users/"  # Correct endpoint
-    headers = {
-        "Accept": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Version": "2021-07-28"
-    }
+def get_ghl_users(location_id, access_token, skip=None, limit=None):
+    """Get the users for a location (one page when ``limit`` is given)"""
+    path = "/users/"  # Correct endpoint
     
     # Add locationId as query parameter
     params = {
         "locationId": location_id
     }
+    if limit:
+        params.update({"skip": skip or 0, "limit": limit})
     
     try:
-        response = requests.get(url, headers=headers, params=params)
+        response = get_ghl_client().get(path, access_token, location_id, params=params)
         if response.status_code == 200:
             return response.json()
         else:
             print(f"Error fetching users: {response.status_code} - {response.text}")
             return {"error": response.status_code, "message": response.text}
+    except GHLRateLimitError:
+        raise
     except Exception as e:
         print(f"Exception fetching users: {e}")
         return {"error": "exception", "message": str(e)}
 
-def get_ghl_user(user_id, access_token):
+def iter_ghl_users(location_id, access_token, page_size=100):
+    """
+    Yield the users of a location page by page.
+    GET /users/?locationId= ignores the paging parameters and returns everything,
+    so paging stops after a short page, a page with no new user ids, or a response
+    without a total or next-page marker. Raises GHLAPIError if a page fails, so a
+    caller never mistakes a partial listing for the full one.
+    """
+    seen = set()
+    skip = 0
+    while True:
+        data = get_ghl_users(location_id, access_token, skip=skip, limit=page_size)
+        if not isinstance(data, dict) or 'users' not in data:
+            raise GHLAPIError(f"Fetching users at skip={skip} failed: {data}")
+        page = data['users']
+        users = [user for user in page if user.get('id') not in seen]
+        seen.update(user.get('id') for user in users)
+        if users:
+            yield users
+
+        meta = data.get('meta') or {}
+        total = data.get('total', data.get('count', meta.get('total')))
+        has_next = meta.get('nextPage') or meta.get('nextPageUrl')
+        if len(page) < page_size or not users:
+            return
+        if total is not None and len(seen) >= int(total):
+            return
+        if total is None and not has_next:
+            return
+        skip += page_size
+
+def get_ghl_user(user_id, access_token, location_id=None):
     """Get specific user details"""
-    url = f"https://services.leadconnectorhq.com/users/{user_id}"
-    headers = {
-        "Accept": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Version": "2021-07-28"
-    }
+    path = f"/users/{user_id}"
     
     try:
-        response = requests.get(url, headers=headers)
+        response = get_ghl_client().get(path, access_token, location_id)
         if response.status_code == 200:
             return response.json()
         else:
             return {"error": response.status_code, "message": response.text}
+    except GHLRateLimitError:
+        raise
     except Exception as e:
         return {"error": "exception", "message": str(e)}
 
 
-def create_ghl_contact(email, first_name, last_name, phone, location_id, access_token, tags=None):
+def get_ghl_contact(contact_id, access_token, location_id=None):
     """
-    Create or update a contact in GHL with all available information
+    Get a single contact from GHL
     """
-    url = "https://services.leadconnectorhq.com/contacts/"
-    headers = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Version": "2021-07-28"
-    }
-    
-    # Build contact data with all available information
-    contact_data = {
-        "email": email,
-        "firstName": first_name or "",
-        "lastName": last_name or "",
-        "locationId": location_id
-    }
-    
-    # Add phone number if available
-    if phone:
-        contact_data["phone"] = phone
-    
-    if tags:
-        contact_data["tags"] = tags
+    path = f"/contacts/{contact_id}"
     
     try:
-        response = requests.post(url, json=contact_data, headers=headers)
-        
-        if response.status_code in [200, 201]:
-            print(f"✅ Contact created/updated for {email}")
-            return response.json()
-        else:
-            print(f"❌ Error creating contact: {response.status_code} - {response.text}")
-            return None
-            
-    except Exception as e:
-        print(f"❌ Exception creating contact: {e}")
-        return None
-
-def update_ghl_contact(contact_id, email, first_name, last_name, phone, location_id, access_token):
-    """
-    Update existing contact in GHL with latest information
-    NOTE: Do NOT include locationId when updating existing contacts
-    """
-    url = f"https://services.leadconnectorhq.com/contacts/{contact_id}"
-    headers = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Version": "2021-07-28"
-    }
-    
-    # Build contact data - DO NOT include locationId for updates
-    contact_data = {
-        "email": email,
-        "firstName": first_name or "",
-        "lastName": last_name or ""
-    }
-    
-    # Add phone number if available
-    if phone:
-        contact_data["phone"] = phone
-    
-    try:
-        print(f"🔄 Updating contact {contact_id} with data: {contact_data}")
-        response = requests.put(url, json=contact_data, headers=headers)
-        
+        response = get_ghl_client().get(path, access_token, location_id)
         if response.status_code == 200:
-            print(f"✅ Contact updated successfully for: {email}")
             return response.json()
         else:
-            print(f"❌ Error updating contact: {response.status_code} - {response.text}")
+            print(f"❌ Error fetching contact {contact_id}: {response.status_code} - {response.text}")
             return None
-            
+    except GHLRateLimitError:
+        raise
     except Exception as e:
-        print(f"❌ Exception updating contact: {e}")
+        print(f"❌ Exception fetching contact {contact_id}: {e}")
         return None
-
-def add_tag_to_contact(contact_id, tag_name, location_id, access_token):
-    """
-    Add a specific tag to a contact - HANDLES EXISTING TAGS AS SUCCESS
-    """
-    url = f"https://services.leadconnectorhq.com/contacts/{contact_id}/tags"
-    headers = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Version": "2021-07-28"
-    }
-    
-    tag_data = {
-        "tags": [tag_name]
-    }
-    
-    try:
-        print(f"🏷️ Adding tag '{tag_name}' to contact {contact_id}")
-        response = requests.post(url, json=tag_data, headers=headers)
-        
-        if response.status_code in [200, 201]:
-            result = response.json()
-            print(f"📨 Tag API response: {result}")
-            
-            # SUCCESS CASES:
-            # 1. Tags were actually added (tagsAdded contains our tag)
-            # 2. No tags were added because they already exist (tagsAdded is empty)
-            # BOTH ARE SUCCESS FOR OUR USE CASE!
-            
-            tags_added = result.get('tagsAdded', [])
-            
-            if tag_name in tags_added:
-                print(f"✅ Tag '{tag_name}' was added to contact {contact_id}")
-                return True
-            else:
-                # Empty tagsAdded means the tag already exists - THIS IS SUCCESS!
-                print(f"✅ Tag '{tag_name}' already exists on contact {contact_id}")
-                return True
-        else:
-            print(f"❌ Error adding tag: {response.status_code} - {response.text}")
-            return False
-            
-    except Exception as e:
-        print(f"❌ Exception adding tag: {e}")
-        return False
-
-def find_contact_by_email(email, location_id, access_token):
-    """
-    Find contact by email in GHL - USING SEARCH ENDPOINT
-    """
-    url = "https://services.leadconnectorhq.com/contacts/search"
-    headers = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Version": "2021-07-28"
-    }
-    
-    # Correct search data format
-    search_data = {
-        "locationId": location_id,
-        "query": email,  # Just the email string
-        "pageLimit": 10  # As a number
-    }
-    
-    try:
-        print(f"🔍 Searching for contact with email: {email}")
-        response = requests.post(url, json=search_data, headers=headers)
-        
-        if response.status_code == 200:
-            data = response.json()
-            contacts = data.get('contacts', [])
-            if contacts:
-                contact_id = contacts[0].get('id')
-                print(f"✅ Found existing contact: {contact_id} for {email}")
-                return contacts[0]
-            else:
-                print(f"ℹ️ No existing contact found for {email}")
-                return None
-        else:
-            print(f"❌ Error searching contact: {response.status_code} - {response.text}")
-            return None
-            
-    except Exception as e:
-        print(f"❌ Exception searching contact: {e}")
-        return None
-    
-
-def contact_has_tag(contact_id, tag_name, location_id, access_token):
-    """
-    Check if a contact already has a specific tag
-    """
-    url = f"https://services.leadconnectorhq.com/contacts/{contact_id}"
-    headers = {
-        "Accept": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Version": "2021-07-28"
-    }
-    
-    try:
-        response = requests.get(url, headers=headers)
-        
-        if response.status_code == 200:
-            contact_data = response.json()
-            tags = contact_data.get('tags', [])
-            if tag_name in tags:
-                print(f"✅ Contact already has tag '{tag_name}'")
-                return True
-            else:
-                print(f"ℹ️ Contact does not have tag '{tag_name}' yet")
-                return False
-        else:
-            print(f"❌ Error checking contact tags: {response.status_code} - {response.text}")
-            return False
-            
-    except Exception as e:
-        print(f"❌ Exception checking contact tags: {e}")
-        return False
\ No newline at end of file
@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+import redis
+from django.conf import settings
+from django.utils.timezone import now
+from .helpers import sync_ghl_users
+from .models import SyncRun
+from .redis_client import get_redis, use_memory_backend
+from .tokens import get_access_token
+
+logger = logging.getLogger(__name__)
+
+_memory_held = set()
+_memory_held_guard = threading.Lock()
+
+
+@contextmanager
+def location_sync_lock(location_id):
+    """
+    Keep two syncs of the same location from overlapping across workers.
+    Never waits: yields False when another sync of the location is running.
+    """
+    if use_memory_backend():
+        with _memory_held_guard:
+            acquired = location_id not in _memory_held
+            _memory_held.add(location_id)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                with _memory_held_guard:
+                    _memory_held.discard(location_id)
+    else:
+        # The timeout only frees the lock of a worker that died mid-sync
+        lock = get_redis().lock(f'ghl:sync:{location_id}', timeout=settings.GHL_SYNC_LOCK_TIMEOUT)
+        acquired = lock.acquire(blocking=False)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                try:
+                    lock.release()
+                except redis.exceptions.LockError:
+                    pass
+
+
+def sync_location(location_id, incremental=False, include_data=True):
+    """
+    Sync users (and contacts/opportunities with ``include_data``) of one location
+    under its sync lock. Returns a summary dict; status is synced, skipped or failed.
+    """
+    from data_management.helpers import sync_ghl_contacts_and_opportunities
+
+    result = location_result(location_id)
+    started = time.perf_counter()
+    with location_sync_lock(location_id) as acquired:
+        if not acquired:
+            logger.info(f"Sync of location {location_id} already running, skipping")
+            result['status'] = 'skipped'
+            return result
+        try:
+            access_token = get_access_token(location_id)
+            if not access_token:
+                raise ValueError(f"No credentials for location {location_id}")
+            result['users'] = sync_ghl_users(location_id, access_token, incremental=incremental, raise_errors=True)
+            if include_data:
+                counts = sync_ghl_contacts_and_opportunities(location_id, access_token)
+                result['contacts'] = counts['contacts']
+                result['opportunities'] = counts['opportunities']
+        except Exception as e:
+            logger.exception(f"Sync of location {location_id} failed: {e}")
+            result['status'] = 'failed'
+            result['error'] = str(e)
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def location_result(location_id, status='synced', error=None):
+    """Empty per-location summary as stored in SyncRun.results"""
+    return {
+        'location_id': location_id, 'status': status, 'users': 0, 'contacts': 0, 'opportunities': 0,
+        'seconds': 0.0, 'error': error,
+    }
+
+
+def split_into_lanes(location_ids, lanes):
+    """Deal locations round-robin into at most ``lanes`` non-empty lists"""
+    lanes = max(1, min(lanes, len(location_ids)))
+    return [location_ids[i::lanes] for i in range(lanes)]
+
+
+def finish_sync_run(run_id, results):
+    """Store the per-location results and totals of a run and close it"""
+    run = SyncRun.objects.get(pk=run_id)
+    by_status = {'synced': 0, 'skipped': 0, 'failed': 0}
+    for result in results:
+        by_status[result['status']] += 1
+
+    run.results = sorted(results, key=lambda result: result['location_id'])
+    run.locations_synced = by_status['synced']
+    run.locations_skipped = by_status['skipped']
+    run.locations_failed = by_status['failed']
+    run.users_synced = sum(result['users'] for result in results)
+    run.contacts_synced = sum(result['contacts'] for result in results)
+    run.opportunities_synced = sum(result['opportunities'] for result in results)
+    run.status = 'partial' if by_status['failed'] else 'completed'
+    run.finished_at = now()
+    run.duration_seconds = (run.finished_at - run.started_at).total_seconds()
+    run.save()
+
+    logger.info(
+        f"Sync run {run.pk} {run.status} in {run.duration_seconds:.1f}s: {run.locations_synced} synced, "
+        f"{run.locations_skipped} skipped, {run.locations_failed} failed of {run.locations_total} locations; "
+        f"{run.users_synced} users, {run.contacts_synced} contacts, {run.opportunities_synced} opportunities"
+    )
+    return run
+
+
+def fail_sync_run(run_id, error):
+    """
+    Close a run whose lanes did not all report back (a lane task crashed or timed out).
+    The per-location results are unknown, so every location counts as failed.
+    """
+    run = SyncRun.objects.filter(pk=run_id, status='running').first()
+    if not run:
+        return None
+    run.status = 'failed'
+    run.locations_failed = run.locations_total
+    run.finished_at = now()
+    run.duration_seconds = (run.finished_at - run.started_at).total_seconds()
+    run.save()
+
+    logger.error(f"Sync run {run.pk} failed after {run.duration_seconds:.1f}s: {error}")
+    return run
@@ -0,0 +1,148 @@
+import threading
+import time
+import uuid
+import logging
+from django.conf import settings
+from django.utils.timezone import now
+from .redis_client import get_redis, use_memory_backend
+
+logger = logging.getLogger(__name__)
+
+# Progress counters of a job; everything else is stored as text
+COUNTERS = ('users_fetched', 'users_upserted', 'assignments_created')
+FINISHED = ('completed', 'failed', 'skipped')
+
+
+def _new_job(job_id, location_id):
+    job = {
+        'job_id': job_id, 'location_id': location_id, 'status': 'queued', 'error': '',
+        'queued_at': now().isoformat(), 'started_at': '', 'finished_at': '',
+    }
+    job.update({counter: 0 for counter in COUNTERS})
+    return job
+
+
+class InMemorySyncJobStore:
+    """
+    Process-local stand-in for the Redis store, used for local runs and tests
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._active = {}
+
+    def create(self, location_id, ttl):
+        """Return (job id, created); an unfinished job of the location is reused"""
+        with self._lock:
+            job_id, expires_at = self._active.get(location_id, (None, 0))
+            if job_id and expires_at > time.monotonic():
+                return job_id, False
+            job_id = uuid.uuid4().hex
+            self._active[location_id] = (job_id, time.monotonic() + ttl)
+            self._jobs[job_id] = _new_job(job_id, location_id)
+            return job_id, True
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def finish(self, job_id, status, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return
+            job.update(fields, status=status, finished_at=now().isoformat())
+            if self._active.get(job['location_id'], (None,))[0] == job_id:
+                del self._active[job['location_id']]
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+
+class RedisSyncJobStore:
+    """
+    One Redis hash per job plus a pointer from each location to its unfinished job,
+    so every web and worker process sees the same jobs
+    """
+    PREFIX = 'ghl:sync-job'
+
+    def __init__(self, connection):
+        self.redis = connection
+
+    def _job_key(self, job_id):
+        return f'{self.PREFIX}:{job_id}'
+
+    def _active_key(self, location_id):
+        return f'{self.PREFIX}:location:{location_id}'
+
+    def create(self, location_id, ttl):
+        job_id = uuid.uuid4().hex
+        while not self.redis.set(self._active_key(location_id), job_id, nx=True, ex=ttl):
+            existing = self.redis.get(self._active_key(location_id))
+            if existing:
+                return existing.decode(), False
+            # The pointer expired between SET and GET, try again
+        pipe = self.redis.pipeline()
+        pipe.hset(self._job_key(job_id), mapping=_new_job(job_id, location_id))
+        pipe.expire(self._job_key(job_id), settings.GHL_SYNC_JOB_RETENTION)
+        pipe.execute()
+        return job_id, True
+
+    def update(self, job_id, **fields):
+        self.redis.hset(self._job_key(job_id), mapping=fields)
+
+    def finish(self, job_id, status, **fields):
+        self.redis.hset(self._job_key(job_id), mapping=dict(fields, status=status, finished_at=now().isoformat()))
+        location_id = self.redis.hget(self._job_key(job_id), 'location_id')
+        if location_id:
+            active_key = self._active_key(location_id.decode())
+            if self.redis.get(active_key) == job_id.encode():
+                self.redis.delete(active_key)
+
+    def get(self, job_id):
+        raw = self.redis.hgetall(self._job_key(job_id))
+        if not raw:
+            return None
+        job = {field.decode(): value.decode() for field, value in raw.items()}
+        for counter in COUNTERS:
+            job[counter] = int(job.get(counter) or 0)
+        return job
+
+
+_store = None
+
+
+def get_sync_job_store():
+    global _store
+    if _store is None:
+        if use_memory_backend():
+            _store = InMemorySyncJobStore()
+        else:
+            _store = RedisSyncJobStore(get_redis())
+    return _store
+
+
+def start_user_sync_job(location_id, incremental=False):
+    """
+    Queue a user sync of a location and return (job id, created).
+    While a job of the location is queued or running its id is returned instead.
+    """
+    from .tasks import manual_refresh_users_task
+
+    store = get_sync_job_store()
+    job_id, created = store.create(location_id, settings.GHL_SYNC_JOB_DEDUP_TTL)
+    if created:
+        try:
+            manual_refresh_users_task.delay(location_id, job_id=job_id, incremental=incremental)
+        except Exception as e:
+            store.finish(job_id, 'failed', error=f'Could not queue the sync: {e}')
+            raise
+    return job_id, created
+
+
+def get_sync_job(job_id):
+    return get_sync_job_store().get(job_id)
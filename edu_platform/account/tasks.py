@@ -1,65 +1,55 @@
-import requests
-from celery import shared_task
-from account.models import GHLAuthCredentials
+from celery import chord, shared_task
 from django.conf import settings
+from django.db import InterfaceError, OperationalError
+from django.utils.timezone import now
+from account.models import GHLAuthCredentials, GHLUser, SyncRun
 import logging
-from account.services import find_contact_by_email, update_ghl_contact, create_ghl_contact, find_contact_by_email, add_tag_to_contact, update_ghl_contact
-from account.helpers import handle_user_webhook, sync_ghl_users
+from account.ghl_async import ContactJob, push_contacts_sync
+from account.helpers import apply_user_webhooks, sync_ghl_users
+from account.notifications import queue_category_notification, pop_category_notifications, release_contact_update
+from account.retention import compact_webhook_logs
+from account.sync import (
+    fail_sync_run, finish_sync_run, location_result, location_sync_lock, split_into_lanes, sync_location
+)
+from account.sync_jobs import get_sync_job_store
+from account.tokens import get_access_token, refresh_due_tokens
+from account.webhooks import claim_user_events, flush_webhook_buffer, mark_events_delivered, release_user_events
 
 logger = logging.getLogger(__name__)
 
+CATEGORY_ADDED_TAG = "category added"
+
 @shared_task
 def make_api_for_ghl():
     """
-    Task to refresh GHL access tokens using refresh token
+    Task to refresh GHL access tokens that expire within GHL_TOKEN_REFRESH_MARGIN,
+    several locations in parallel
     """
-    logger.info("Refreshing GHL tokens...")
+    logger.info("Refreshing due GHL tokens...")
 
     try:
-        credentials_list = GHLAuthCredentials.objects.all()
-
-        for credentials in credentials_list:
-            if not credentials.refresh_token:
-                continue
-
-            response = requests.post(
-                'https://services.leadconnectorhq.com/oauth/token',
-                data={
-                    'grant_type': 'refresh_token',
-                    'client_id': settings.GHL_CLIENT_ID,
-                    'client_secret': settings.GHL_CLIENT_SECRET,
-                    'refresh_token': credentials.refresh_token
-                }
-            )
-
-            if response.status_code == 200:
-                new_tokens = response.json()
-                logger.info(f"Tokens refreshed for location: {credentials.location_id}")
-
-                GHLAuthCredentials.objects.filter(location_id=credentials.location_id).update(
-                    access_token=new_tokens.get("access_token"),
-                    refresh_token=new_tokens.get("refresh_token"),
-                    expires_in=new_tokens.get("expires_in"),
-                    scope=new_tokens.get("scope"),
-                    user_type=new_tokens.get("userType"),
-                    company_id=new_tokens.get("companyId"),
-                    user_id=new_tokens.get("userId"),
-                )
-            else:
-                logger.error(f"Failed to refresh tokens for location {credentials.location_id}: {response.status_code}")
-
+        results = refresh_due_tokens()
+        refreshed = sum(1 for ok in results.values() if ok)
+        logger.info(f"Refreshed tokens for {refreshed} of {len(results)} due locations")
+        return refreshed
     except Exception as e:
         logger.exception(f"Error in token refresh task: {e}")
+        return 0
 
 
 @shared_task
-def sync_ghl_users_task(location_id, access_token):
+def sync_ghl_users_task(location_id, access_token=None, incremental=False):
     """
-    Task to sync users during onboarding
+    Task to sync users during onboarding, or only the changed users with ``incremental``.
+    The token is looked up when the task runs unless one is passed.
     """
-    logger.info(f"Starting user sync for location: {location_id}")
+    logger.info(f"Starting {'incremental ' if incremental else ''}user sync for location: {location_id}")
     try:
-        users_synced = sync_ghl_users(location_id, access_token)
+        with location_sync_lock(location_id) as acquired:
+            if not acquired:
+                logger.info(f"Sync of location {location_id} already running, skipping")
+                return 0
+            users_synced = sync_ghl_users(location_id, access_token or get_access_token(location_id), incremental=incremental)
         logger.info(f"Successfully synced {users_synced} users for location: {location_id}")
         return users_synced
     except Exception as e:
@@ -67,145 +57,291 @@ def sync_ghl_users_task(location_id, access_token):
         return 0
 
 
-@shared_task
-def manual_refresh_users_task(location_id):
+@shared_task(bind=True, max_retries=10)
+def manual_refresh_users_task(self, location_id, job_id=None, incremental=False):
     """
-    Task for manual user refresh from frontend
+    Task for manual user refresh from frontend. With ``job_id`` the progress and
+    outcome are written to the sync job the frontend polls. Waits for a sync of
+    the same location that is already running instead of overlapping it.
     """
+    jobs = get_sync_job_store()
+    
+    def report_progress(users_fetched, users_upserted, assignments_created):
+        if job_id:
+            jobs.update(job_id, users_fetched=users_fetched, users_upserted=users_upserted,
+                        assignments_created=assignments_created)
+    
     logger.info(f"Manual refresh started for location: {location_id}")
+    with location_sync_lock(location_id) as acquired:
+        if acquired:
+            try:
+                access_token = get_access_token(location_id)
+                if not access_token:
+                    raise GHLAuthCredentials.DoesNotExist(f"No credentials for location {location_id}")
+                
+                if job_id:
+                    jobs.update(job_id, status='running', started_at=now().isoformat())
+                users_synced = sync_ghl_users(location_id, access_token, incremental=incremental,
+                                              progress=report_progress, raise_errors=True)
+                if job_id:
+                    jobs.finish(job_id, 'completed')
+                logger.info(f"Manual refresh completed: {users_synced} users synced")
+                return users_synced
+            except Exception as e:
+                logger.exception(f"Error in manual refresh for location {location_id}: {e}")
+                if job_id:
+                    jobs.finish(job_id, 'failed', error=str(e))
+                return 0
+    
+    if self.request.retries < self.max_retries:
+        logger.info(f"Sync of location {location_id} already running, retrying manual refresh later")
+        raise self.retry(countdown=settings.GHL_SYNC_JOB_RETRY_DELAY)
+    logger.warning(f"Sync of location {location_id} still running, giving up manual refresh")
+    if job_id:
+        jobs.finish(job_id, 'skipped', error='Another sync of this location kept running')
+    return 0
+
+
+@shared_task
+def sync_all_locations_task(incremental=True, include_data=True, location_ids=None):
+    """
+    Task to sync every connected location (or ``location_ids``) as one SyncRun.
+    Locations are dealt into GHL_SYNC_CONCURRENCY lanes that run in parallel, each
+    syncing its locations one after another; a chord callback closes the run, or
+    its error callback if a lane task itself failed.
+    """
+    if location_ids is None:
+        location_ids = list(GHLAuthCredentials.objects.order_by('location_id').values_list('location_id', flat=True))
+    run = SyncRun.objects.create(incremental=incremental, locations_total=len(location_ids))
+    if not location_ids:
+        finish_sync_run(run.pk, [])
+        return run.pk
+    
+    lanes = split_into_lanes(location_ids, settings.GHL_SYNC_CONCURRENCY)
+    chord(
+        sync_locations_task.s(lane, incremental=incremental, include_data=include_data) for lane in lanes
+    )(finish_sync_run_task.s(run.pk).on_error(fail_sync_run_task.s(run.pk)))
+    logger.info(f"Sync run {run.pk} started for {len(location_ids)} locations in {len(lanes)} lanes")
+    return run.pk
+
+
+@shared_task
+def sync_locations_task(location_ids, incremental=True, include_data=True):
+    """
+    Task to sync one lane of a SyncRun: the given locations, one after another.
+    Locations already being synced elsewhere are reported as skipped; a location
+    that raises (e.g. Redis down while taking its lock) is reported as failed so
+    the rest of the lane still runs.
+    """
+    results = []
+    for location_id in location_ids:
+        try:
+            results.append(sync_location(location_id, incremental=incremental, include_data=include_data))
+        except Exception as e:
+            logger.exception(f"Sync of location {location_id} failed: {e}")
+            results.append(location_result(location_id, status='failed', error=str(e)))
+    return results
+
+
+@shared_task
+def finish_sync_run_task(lane_results, run_id):
+    """
+    Chord callback: record the aggregated results of all lanes on the SyncRun
+    """
+    results = [result for lane in lane_results for result in lane]
+    return finish_sync_run(run_id, results).status
+
+
+@shared_task
+def fail_sync_run_task(request, exc, traceback, run_id):
+    """
+    Chord error callback: close the SyncRun when a lane task or the chord callback failed,
+    so the run does not stay 'running' forever
+    """
+    run = fail_sync_run(run_id, exc)
+    return run.status if run else None
+
+
+@shared_task(bind=True, max_retries=10)
+def flush_webhook_buffer_task(self):
+    """
+    Background writer for buffered webhooks: bulk-inserts WebhookLog rows and
+    queues the user events. Scheduled by the first webhook of each flush window.
+    Retried while the database is unreachable (the unwritten webhooks were requeued),
+    and rescheduled if another flush is running so nothing waits for the next webhook.
+    """
     try:
-        credentials = GHLAuthCredentials.objects.get(location_id=location_id)
-        
-        users_synced = sync_ghl_users(location_id, credentials.access_token)
-        logger.info(f"Manual refresh completed: {users_synced} users synced")
-        return users_synced
-    except Exception as e:
-        logger.exception(f"Error in manual refresh for location {location_id}: {e}")
-        return 0
+        written = flush_webhook_buffer()
+    except (OperationalError, InterfaceError) as e:
+        logger.warning(f"Database unavailable while flushing webhooks, retrying: {e}")
+        raise self.retry(exc=e, countdown=min(300, 10 * 2 ** self.request.retries))
+    if written is None:
+        self.apply_async(countdown=settings.GHL_WEBHOOK_FLUSH_INTERVAL)
+    elif written:
+        logger.info(f"Wrote {written} buffered webhooks")
+    return written
 
 
 @shared_task
-def handle_user_webhook_event(data, event_type):
+def compact_webhook_logs_task():
     """
-    Process user webhook events asynchronously
+    Task to compress, archive and expire old WebhookLog rows in chunks
     """
     try:
-        
-        handle_user_webhook(data, event_type)
-        logger.info(f"Webhook {event_type} processed successfully")
+        return compact_webhook_logs()
     except Exception as e:
-        logger.exception(f"Error handling user webhook event {event_type}: {e}")
+        logger.exception(f"Error compacting webhook logs: {e}")
+        return None
 
 
 @shared_task
-def notify_category_assignment_task(user_email, user_first_name, user_last_name, user_phone, location_id, access_token, category_name, is_new_assignment=True):
+def handle_user_webhook_event(data, event_type, received_at=None):
+    """
+    Process one user webhook event asynchronously. Takes the same path as the
+    buffered events, so a failed event is released and retried, not marked as delivered.
+    """
+    process_user_webhooks_task.delay([(data, event_type, received_at)])
+
+
+@shared_task(bind=True, max_retries=3)
+def process_user_webhooks_task(self, events):
     """
-    Task to create/update contact in GHL with all user information and add/update "category added" tag
+    Process a group of user webhook events, given as (data, event_type, received_at), in bulk.
+    Stale and duplicate events are dropped in one state-store round trip first.
+    Deliveries are only marked as processed once the events are applied; on failure
+    the claims are released and the group is retried.
     """
+    verdicts = claim_user_events(events)
+    accepted = [event for event, verdict in zip(events, verdicts) if verdict == 'apply']
+    if len(accepted) < len(events):
+        logger.info(f"Skipping {len(events) - len(accepted)} stale or duplicate webhooks of {len(events)}")
     try:
-        from account.services import create_ghl_contact, find_contact_by_email, add_tag_to_contact, update_ghl_contact
-        
-        TAG_NAME = "category added"
-        
-        print(f"🔍 Looking for existing contact for: {user_email}")
-        
-        # First, try to find existing contact
-        existing_contact = find_contact_by_email(user_email, location_id, access_token)
-        
-        if existing_contact:
-            # Contact exists - UPDATE it with latest information
-            contact_id = existing_contact.get('id')
-            print(f"✅ Found existing contact with ID: {contact_id}")
-            print(f"🔄 Updating existing contact {contact_id}...")
-            
-            # Update contact with current user information
-            updated_contact = update_ghl_contact(
-                contact_id=contact_id,
-                email=user_email,
-                first_name=user_first_name,
-                last_name=user_last_name,
-                phone=user_phone,
-                location_id=location_id,
-                access_token=access_token
-            )
-            
-            if updated_contact:
-                print(f"✅ Contact updated successfully, ensuring tag exists...")
-                
-                # Simply add the tag - the API will handle if it already exists
-                success = add_tag_to_contact(contact_id, TAG_NAME, location_id, access_token)
-                if success:
-                    print(f"✅ Contact updated and tag ensured: {user_email}")
-                    return True
-                else:
-                    print(f"⚠️ Contact updated but tag operation failed: {user_email}")
-                    return True  # Still return True since contact was updated
-            else:
-                print(f"❌ Failed to update contact: {user_email}")
-                return False
-                
-        else:
-            # Create new contact with all information and tag
-            print(f"📝 No existing contact found, creating new one...")
-            contact_data = create_ghl_contact(
-                email=user_email,
-                first_name=user_first_name,
-                last_name=user_last_name,
-                phone=user_phone,
-                location_id=location_id,
-                access_token=access_token,
-                tags=[TAG_NAME]
-            )
-            
-            if contact_data:
-                print(f"✅ New contact created with all details and tag '{TAG_NAME}': {user_email}")
-                return True
-            else:
-                print(f"❌ Failed to create contact: {user_email}")
-                return False
-                
+        result = apply_user_webhooks(accepted)
     except Exception as e:
-        print(f"❌ Error in notify_category_assignment_task: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
+        release_user_events(events, verdicts)
+        logger.exception(f"Error processing {len(accepted)} user webhooks, retrying: {e}")
+        raise self.retry(exc=e, countdown=30 * (self.request.retries + 1))
+    mark_events_delivered(events)
+    return result
 
 
 @shared_task
-def update_user_contact_task(user_email, user_first_name, user_last_name, user_phone, location_id, access_token):
+def notify_category_assignments_task(assignment_pairs):
     """
-    Task to update existing contact in GHL with latest user information
+    Task to queue the GHL category notification for a batch of (user pk, category id) assignments.
+    Assignments are grouped per user and handed to the coalescing notifier.
+    Pairs whose assignment no longer exists (e.g. rolled back in a savepoint) are dropped.
     """
-    try:
-        
-        
-        # Find existing contact
-        existing_contact = find_contact_by_email(user_email, location_id, access_token)
-        
-        if existing_contact:
-            contact_id = existing_contact.get('id')
-            
-            # Update contact with current user information
-            updated_contact = update_ghl_contact(
-                contact_id=contact_id,
-                email=user_email,
-                first_name=user_first_name,
-                last_name=user_last_name,
-                phone=user_phone,
-                location_id=location_id,
-                access_token=access_token
-            )
-            
-            if updated_contact:
-                print(f"✅ Contact information updated for: {user_email}")
-                return True
-            else:
-                print(f"❌ Failed to update contact information for: {user_email}")
-                return False
+    from roleplay.models import Category, UserCategoryAssignment
+    
+    existing_pairs = set(
+        UserCategoryAssignment.objects.filter(
+            user_id__in={user_pk for user_pk, _ in assignment_pairs},
+            category_id__in={category_id for _, category_id in assignment_pairs}
+        ).values_list('user_id', 'category_id')
+    )
+    assignment_pairs = [tuple(pair) for pair in assignment_pairs if tuple(pair) in existing_pairs]
+    
+    users = GHLUser.objects.in_bulk({user_pk for user_pk, _ in assignment_pairs})
+    categories = Category.objects.in_bulk({category_id for _, category_id in assignment_pairs})
+    
+    category_names_by_user = {}
+    for user_pk, category_id in assignment_pairs:
+        user = users.get(user_pk)
+        category = categories.get(category_id)
+        if not user or not category or user.status != 'active':
+            continue
+        category_names_by_user.setdefault(user, set()).add(category.name)
+    
+    for user, category_names in category_names_by_user.items():
+        queue_category_notification(user.location_ghl_id, user.pk, category_names)
+    
+    logger.info(f"Queued notifications for {len(category_names_by_user)} users from {len(assignment_pairs)} assignments")
+    return len(category_names_by_user)
+
+
+@shared_task
+def flush_category_notifications_task(location_id):
+    """
+    Task to notify GHL once per user for all categories assigned in a location during the coalescing window.
+    Users are loaded in one query and their contacts are pushed concurrently.
+    """
+    names_by_user = pop_category_notifications(location_id)
+    if not names_by_user:
+        return 0
+    
+    access_token = get_access_token(location_id)
+    if not access_token:
+        logger.warning(f"Skipping notifications, location credentials not found for {location_id}")
+        return 0
+    
+    users = [
+        user for user in GHLUser.objects.filter(pk__in=names_by_user.keys())
+        if user.status == 'active'
+    ]
+    jobs = [
+        ContactJob(
+            email=user.email,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            phone=user.phone,
+            location_id=location_id,
+            access_token=access_token,
+            tags=[CATEGORY_ADDED_TAG]
+        )
+        for user in users
+    ]
+    results = push_contacts_sync(jobs)
+    
+    notified = 0
+    for user, result in zip(users, results):
+        if result.success:
+            notified += 1
+        elif result.rate_limited:
+            # Put the categories back so a later window picks them up
+            queue_category_notification(location_id, user.pk, names_by_user[user.pk], countdown=result.retry_after)
         else:
-            print(f"⚠️ No existing contact found to update: {user_email}")
-            return False
-            
-    except Exception as e:
-        print(f"❌ Error in update_user_contact_task: {e}")
-        return False
\ No newline at end of file
+            logger.warning(f"GHL notification failed for {user.email}: {result.error}")
+    
+    logger.info(f"Notified {notified} of {len(jobs)} users in location {location_id}")
+    return notified
+
+
+@shared_task(bind=True, max_retries=5)
+def update_user_contact_task(self, user_id, force=False):
+    """
+    Task to update existing contact in GHL with latest user information.
+    Takes the user id only, so a retried task sends the data and token current at that time.
+    Skipped when GHL already has the same information unless ``force`` is set.
+    """
+    # Changes from now on schedule a new update; this one sends what is stored now
+    release_contact_update(user_id)
+    user = GHLUser.objects.filter(pk=user_id).first()
+    if not user:
+        logger.warning(f"Skipping contact update, user {user_id} no longer exists")
+        return False
+    access_token = get_access_token(user.location_ghl_id)
+    if not access_token:
+        logger.warning(f"Skipping contact update, location credentials not found for {user.location_ghl_id}")
+        return False
+    
+    job = ContactJob(
+        email=user.email,
+        first_name=user.first_name,
+        last_name=user.last_name,
+        phone=user.phone,
+        location_id=user.location_ghl_id,
+        access_token=access_token,
+        create_if_missing=False,
+        force=force
+    )
+    result = push_contacts_sync([job])[0]
+    
+    if result.rate_limited:
+        logger.warning(f"GHL rate limited contact update for {user.email}, retrying: {result.error}")
+        raise self.retry(countdown=result.retry_after or 60)
+    if result.success:
+        print(f"✅ Contact information updated for: {user.email}")
+    else:
+        print(f"⚠️ Contact not updated for {user.email}: {result.error}")
+    return result.success
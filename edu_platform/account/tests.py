@@ -1,3 +1,881 @@
-from django.test import TestCase
+import asyncio
+import io
+from datetime import timedelta
+from unittest import mock
+from celery.exceptions import Retry
+from django.conf import settings
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from account import helpers, notifications, ratelimit, services, tokens, webhooks
+from account.contact_links import (
+    attach_contact_ids, forget_contacts, get_contact_ids, record_contact_results, remember_contacts
+)
+from account.ghl_async import ContactJob, ContactResult, contact_payload_hash, push_contact
+from account.ghl_client import GHLAPIError, ReplacedTokens
+from account.helpers import (
+    StaleWebhookWrite, apply_user_webhooks, reconcile_removed_ghl_users, sync_ghl_users, upsert_ghl_users
+)
+from account.models import GHLAuthCredentials, GHLContactLink, GHLUser, SyncRun, WebhookLog, WebhookLogArchive
+from account.notifications import (
+    pop_category_notifications, queue_category_notification, queue_contact_update, release_contact_update
+)
+from account.ratelimit import InMemoryTokenBucketStore, RetryPolicy, TokenBucketRateLimiter
+from account.retention import archive_webhook_logs, compact_webhook_logs, compress_webhook_logs, purge_webhook_logs
+from account.services import iter_ghl_users
+from account.sync import location_result
+from account.tasks import (
+    fail_sync_run_task, finish_sync_run_task, flush_category_notifications_task, flush_webhook_buffer_task,
+    notify_category_assignments_task, process_user_webhooks_task, sync_all_locations_task, sync_locations_task,
+    update_user_contact_task
+)
+from account.tokens import refresh_location_token
+from account.webhooks import (
+    buffer_webhook, claim_user_events, coalesce_user_events, event_version, flush_webhook_buffer,
+    mark_events_delivered, release_user_events
+)
+from roleplay.models import Category, UserCategoryAssignment
 
-# Create your tests here.
+
+@override_settings(GHL_STATE_BACKEND='memory')
+class MemoryStateTestCase(TestCase):
+    """Runs every test against fresh process-local stores instead of Redis"""
+
+    def setUp(self):
+        notifications._store = None
+        webhooks._buffer = None
+        webhooks._state_store = None
+        ratelimit._rate_limiter = None
+
+
+@override_settings(GHL_NOTIFICATION_WINDOW=10, GHL_CONTACT_UPDATE_WINDOW=5)
+class CategoryNotificationCoalescingTests(MemoryStateTestCase):
+
+    def test_one_flush_per_location_and_window(self):
+        with mock.patch.object(flush_category_notifications_task, 'apply_async') as apply_async:
+            queue_category_notification('loc-1', 1, ['Sales'])
+            queue_category_notification('loc-1', 1, ['Support'])
+            queue_category_notification('loc-1', 2, ['Sales'])
+            queue_category_notification('loc-2', 3, ['Sales'])
+
+        self.assertEqual(apply_async.call_count, 2)
+        apply_async.assert_any_call(('loc-1',), countdown=10)
+        self.assertEqual(pop_category_notifications('loc-1'), {1: {'Sales', 'Support'}, 2: {'Sales'}})
+        self.assertEqual(pop_category_notifications('loc-1'), {})
+
+    def test_retry_after_lengthens_the_window(self):
+        with mock.patch.object(flush_category_notifications_task, 'apply_async') as apply_async:
+            queue_category_notification('loc-1', 1, ['Sales'], countdown=30)
+        apply_async.assert_called_once_with(('loc-1',), countdown=30)
+
+    def test_pop_opens_a_new_window(self):
+        with mock.patch.object(flush_category_notifications_task, 'apply_async') as apply_async:
+            queue_category_notification('loc-1', 1, ['Sales'])
+            pop_category_notifications('loc-1')
+            queue_category_notification('loc-1', 1, ['Support'])
+        self.assertEqual(apply_async.call_count, 2)
+        self.assertEqual(pop_category_notifications('loc-1'), {1: {'Support'}})
+
+    def test_contact_updates_coalesce_until_released(self):
+        with mock.patch.object(update_user_contact_task, 'apply_async') as apply_async:
+            self.assertTrue(queue_contact_update(7))
+            self.assertFalse(queue_contact_update(7))
+            release_contact_update(7)
+            self.assertTrue(queue_contact_update(7))
+        self.assertEqual(apply_async.call_count, 2)
+        apply_async.assert_called_with(kwargs={'user_id': 7}, countdown=5)
+
+
+class TrackedFieldsTests(TestCase):
+
+    def setUp(self):
+        location = GHLAuthCredentials.objects.create(
+            user_id='owner', access_token='token', refresh_token='refresh', expires_in=3600, location_id='loc-1'
+        )
+        self.user = GHLUser.objects.create(
+            user_id='u1', location=location, location_ghl_id='loc-1', name='Jane Doe',
+            email='u1@example.com', status='inactive'
+        )
+        self.category = Category.objects.create(name='Onboarding', is_default=True)
+
+    def _activate(self, user):
+        user.status = 'active'
+        user.save()
+        return UserCategoryAssignment.objects.filter(user=self.user).count()
+
+    def test_loaded_values_are_compared_without_a_query(self):
+        user = GHLUser.objects.get(pk=self.user.pk)
+        user.status = 'active'
+        with self.assertNumQueries(0):
+            self.assertEqual(user.previous_value('status'), 'inactive')
+            self.assertTrue(user.field_changed('status'))
+
+    def test_activation_assigns_default_categories(self):
+        self.assertEqual(self._activate(GHLUser.objects.get(pk=self.user.pk)), 1)
+
+    def test_activation_of_a_deferred_load_assigns_default_categories(self):
+        self.assertEqual(self._activate(GHLUser.objects.only('id', 'user_id').get(pk=self.user.pk)), 1)
+
+    def test_saving_an_unchanged_status_assigns_nothing(self):
+        user = GHLUser.objects.get(pk=self.user.pk)
+        user.name = 'Jane Roe'
+        user.save()
+        self.assertFalse(UserCategoryAssignment.objects.exists())
+
+    def test_snapshot_follows_saves_and_refreshes(self):
+        user = GHLUser.objects.get(pk=self.user.pk)
+        user.status = 'active'
+        user.save()
+        self.assertFalse(user.field_changed('status'))
+
+        GHLUser.objects.filter(pk=user.pk).update(status='inactive')
+        user.refresh_from_db(fields=['name'])
+        self.assertEqual(user.previous_value('status'), 'active')
+        user.refresh_from_db()
+        self.assertEqual((user.status, user.previous_value('status')), ('inactive', 'inactive'))
+
+    def test_category_made_default_through_a_deferred_load_is_assigned(self):
+        GHLUser.objects.filter(pk=self.user.pk).update(status='active')
+        category = Category.objects.create(name='Advanced')
+        UserCategoryAssignment.objects.all().delete()
+
+        category = Category.objects.only('id', 'name').get(pk=category.pk)
+        category.is_default = True
+        category.save()
+
+        self.assertEqual(list(UserCategoryAssignment.objects.values_list('category', flat=True)), [category.pk])
+
+
+class TokenBucketTests(TestCase):
+
+    def setUp(self):
+        self.clock = 100.0
+        patcher = mock.patch('account.ratelimit.time.monotonic', side_effect=lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_wait_for_refill(self):
+        store = InMemoryTokenBucketStore()
+        self.assertEqual([store.take('loc', 2, 3) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(store.take('loc', 2, 3), 0.5)
+
+        self.clock += 0.5
+        self.assertEqual(store.take('loc', 2, 3), 0)
+
+    def test_refill_is_capped_at_capacity(self):
+        store = InMemoryTokenBucketStore()
+        store.take('loc', 10, 2)
+        self.clock += 60
+        self.assertEqual([store.take('loc', 10, 2) for _ in range(2)], [0, 0])
+        self.assertGreater(store.take('loc', 10, 2), 0)
+
+    def test_buckets_are_per_key(self):
+        store = InMemoryTokenBucketStore()
+        store.take('loc-1', 1, 1)
+        self.assertGreater(store.take('loc-1', 1, 1), 0)
+        self.assertEqual(store.take('loc-2', 1, 1), 0)
+
+    def test_acquire_sleeps_until_a_token_is_available(self):
+        def sleep(seconds):
+            self.clock += seconds
+
+        limiter = TokenBucketRateLimiter(InMemoryTokenBucketStore(), rate=4, capacity=1)
+        with mock.patch('account.ratelimit.time.sleep', side_effect=sleep) as slept:
+            self.assertEqual(limiter.acquire('loc'), 0)
+            self.assertAlmostEqual(limiter.acquire('loc'), 0.25)
+        slept.assert_called_once()
+
+
+class RetryPolicyTests(TestCase):
+
+    def setUp(self):
+        self.policy = RetryPolicy(max_retries=2, base_delay=1, max_delay=30)
+
+    def _response(self, retry_after=None):
+        return mock.Mock(headers={'Retry-After': retry_after} if retry_after else {})
+
+    def test_rate_limits_are_retried_for_every_method(self):
+        self.assertTrue(self.policy.should_retry('POST', 429, 0))
+        self.assertFalse(self.policy.should_retry('POST', 503, 0))
+        self.assertTrue(self.policy.should_retry('GET', 503, 1))
+        self.assertFalse(self.policy.should_retry('GET', 503, 2))
+        self.assertFalse(self.policy.should_retry('GET', 400, 0))
+
+    def test_retry_after_is_honoured_and_capped(self):
+        self.assertEqual(self.policy.delay(0, self._response('7')), 7)
+        self.assertEqual(self.policy.delay(0, self._response('120')), 30)
+        self.assertLessEqual(self.policy.delay(3, self._response()), 8)
+
+
+class ContactLinkTests(TestCase):
+
+    def test_links_are_keyed_by_normalized_email(self):
+        remember_contacts('loc-1', {' Jane@Example.com ': 'c1', '': 'c2', 'no-id@example.com': None})
+
+        self.assertEqual(get_contact_ids('loc-1', ['jane@example.com']), {'jane@example.com': 'c1'})
+        self.assertEqual(GHLContactLink.objects.count(), 1)
+        self.assertEqual(get_contact_ids('loc-2', ['jane@example.com']), {})
+
+    def test_repointed_links_lose_their_push_state(self):
+        GHLContactLink.objects.create(
+            location_id='loc-1', email='jane@example.com', contact_id='c1', payload_hash='h', tags=['vip']
+        )
+        remember_contacts('loc-1', {'jane@example.com': 'c1'})
+        self.assertEqual(GHLContactLink.objects.get().payload_hash, 'h')
+
+        remember_contacts('loc-1', {'jane@example.com': 'c2'})
+        link = GHLContactLink.objects.get()
+        self.assertEqual((link.contact_id, link.payload_hash, link.tags), ('c2', '', []))
+
+    def test_jobs_get_the_stored_contact_id(self):
+        GHLContactLink.objects.create(
+            location_id='loc-1', email='jane@example.com', contact_id='c1', payload_hash='h', tags=['vip']
+        )
+        linked = ContactJob('Jane@example.com', 'Jane', 'Doe', '', 'loc-1', 'token')
+        other_location = ContactJob('jane@example.com', 'Jane', 'Doe', '', 'loc-2', 'token')
+        attach_contact_ids([linked, other_location])
+
+        self.assertEqual((linked.contact_id, linked.pushed_hash, linked.confirmed_tags), ('c1', 'h', {'vip'}))
+        self.assertIsNone(other_location.contact_id)
+
+    def test_forget_contacts(self):
+        remember_contacts('loc-1', {'jane@example.com': 'c1'})
+        forget_contacts('loc-1', ['JANE@example.com'])
+        self.assertFalse(GHLContactLink.objects.exists())
+
+
+class ContactPushStateTests(TestCase):
+
+    def _job(self, **fields):
+        return ContactJob('jane@example.com', 'Jane', 'Doe', '', 'loc-1', 'token', tags=['category added'], **fields)
+
+    def _link(self):
+        return GHLContactLink.objects.get(location_id='loc-1', email='jane@example.com')
+
+    def test_results_store_hash_and_confirmed_tags(self):
+        job = self._job()
+        record_contact_results([ContactResult(job=job, success=True, contact_id='c1', payload_hash='h1',
+                                              tags_confirmed=['category added'])])
+        link = self._link()
+        self.assertEqual((link.contact_id, link.payload_hash, link.tags), ('c1', 'h1', ['category added']))
+
+    def test_tags_are_kept_while_the_contact_stays_the_same(self):
+        job = self._job(contact_id='c1', pushed_hash='h1', confirmed_tags={'vip'})
+        record_contact_results([ContactResult(job=job, success=True, contact_id='c1', payload_hash='h2')])
+        self.assertEqual((self._link().payload_hash, self._link().tags), ('h2', ['vip']))
+
+    def test_stale_links_are_dropped(self):
+        GHLContactLink.objects.create(location_id='loc-1', email='jane@example.com', contact_id='gone')
+        job = self._job(contact_id='gone')
+        record_contact_results([ContactResult(job=job, stale_link=True, error='contact not found')])
+        self.assertFalse(GHLContactLink.objects.exists())
+
+    def test_the_last_result_per_email_wins(self):
+        record_contact_results([
+            ContactResult(job=self._job(), success=True, contact_id='c1', payload_hash='h1'),
+            ContactResult(job=self._job(), success=True, contact_id='c2', payload_hash='h2'),
+        ])
+        self.assertEqual(self._link().contact_id, 'c2')
+
+    def test_unchanged_contacts_are_not_pushed(self):
+        fields = {'email': 'jane@example.com', 'firstName': 'Jane', 'lastName': 'Doe'}
+        job = self._job(contact_id='c1', pushed_hash=contact_payload_hash(fields), confirmed_tags={'category added'})
+        client = mock.Mock(put=mock.AsyncMock(), post=mock.AsyncMock())
+
+        result = asyncio.run(push_contact(client, job))
+
+        self.assertTrue(result.success)
+        client.put.assert_not_called()
+        client.post.assert_not_called()
+
+    def test_changed_contacts_are_updated_and_only_missing_tags_added(self):
+        job = self._job(contact_id='c1', pushed_hash='old', confirmed_tags={'category added'})
+        client = mock.Mock(put=mock.AsyncMock(return_value=mock.Mock(status_code=200)), post=mock.AsyncMock())
+
+        result = asyncio.run(push_contact(client, job))
+
+        self.assertTrue(result.success)
+        client.put.assert_called_once()
+        client.post.assert_not_called()
+        self.assertNotEqual(result.payload_hash, 'old')
+
+
+class TokenRefreshTests(MemoryStateTestCase):
+
+    def setUp(self):
+        super().setUp()
+        tokens._memory_locks.clear()
+        tokens._token_cache.clear()
+        self.credentials = GHLAuthCredentials.objects.create(
+            user_id='owner', access_token='old-access', refresh_token='old-refresh', expires_in=60, location_id='loc-1'
+        )
+        patcher = mock.patch.object(tokens, 'get_ghl_client')
+        self.client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def _grant(self, *args, **kwargs):
+        # The single-use refresh token is only ever sent while the location's lock is held
+        self.assertTrue(tokens._memory_locks['loc-1'].locked())
+        return mock.Mock(status_code=200, json=lambda: {
+            'access_token': 'new-access', 'refresh_token': 'new-refresh', 'expires_in': 86400,
+            'userType': 'Location', 'userId': 'owner'
+        })
+
+    def test_due_token_is_refreshed_under_the_lock(self):
+        self.client.post.side_effect = self._grant
+
+        self.assertEqual(refresh_location_token('loc-1'), 'new-access')
+
+        self.credentials.refresh_from_db()
+        self.assertEqual((self.credentials.refresh_token, self.credentials.expires_in), ('new-refresh', 86400))
+        self.assertEqual(self.client.post.call_args.kwargs['data']['refresh_token'], 'old-refresh')
+        self.assertFalse(tokens._memory_locks['loc-1'].locked())
+
+    def test_token_already_replaced_by_another_worker_is_not_refreshed_again(self):
+        GHLAuthCredentials.objects.filter(pk=self.credentials.pk).update(access_token='newer-access')
+
+        self.assertEqual(refresh_location_token('loc-1', stale_token='old-access'), 'newer-access')
+        self.client.post.assert_not_called()
+
+    def test_token_not_due_is_left_alone(self):
+        GHLAuthCredentials.objects.filter(pk=self.credentials.pk).update(expires_in=86400)
+
+        self.assertEqual(refresh_location_token('loc-1'), 'old-access')
+        self.client.post.assert_not_called()
+
+    @override_settings(GHL_TOKEN_REFRESH_LOCK_WAIT=0.01)
+    def test_gives_up_while_another_refresh_holds_the_lock(self):
+        with tokens.refresh_lock('loc-1') as acquired:
+            self.assertTrue(acquired)
+            self.assertIsNone(refresh_location_token('loc-1'))
+        self.client.post.assert_not_called()
+
+    def test_failed_refresh_keeps_the_stored_tokens(self):
+        self.client.post.return_value = mock.Mock(status_code=400)
+
+        self.assertIsNone(refresh_location_token('loc-1'))
+        self.credentials.refresh_from_db()
+        self.assertEqual(self.credentials.refresh_token, 'old-refresh')
+
+    @override_settings(GHL_STATE_BACKEND='redis')
+    def test_redis_lock_outlives_the_slowest_refresh_call(self):
+        slowest_call = (
+            (settings.GHL_MAX_RETRIES + 1) * (settings.GHL_HTTP_CONNECT_TIMEOUT + settings.GHL_HTTP_READ_TIMEOUT)
+            + settings.GHL_MAX_RETRIES * settings.GHL_RETRY_MAX_DELAY
+        )
+        with mock.patch.object(tokens, 'get_redis') as get_redis:
+            with tokens.refresh_lock('loc-1'):
+                pass
+        kwargs = get_redis.return_value.lock.call_args.kwargs
+        self.assertGreater(kwargs['timeout'], slowest_call)
+        self.assertEqual(kwargs['blocking_timeout'], settings.GHL_TOKEN_REFRESH_LOCK_WAIT)
+
+    def test_replaced_tokens_are_bounded(self):
+        replaced = ReplacedTokens(size=2)
+        for index in range(3):
+            replaced[f'old-{index}'] = f'new-{index}'
+        self.assertEqual(len(replaced), 2)
+        self.assertIsNone(replaced.get('old-0'))
+        self.assertEqual(replaced.get('old-2'), 'new-2')
+
+
+class UpsertGHLUsersTests(MemoryStateTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.location = GHLAuthCredentials.objects.create(
+            user_id='owner', access_token='token', refresh_token='refresh', expires_in=3600, location_id='loc-1'
+        )
+        self.default_category = Category.objects.create(name='Onboarding', is_default=True)
+        self.other_category = Category.objects.create(name='Advanced')
+        patcher = mock.patch.object(notify_category_assignments_task, 'delay')
+        self.notify = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _user(self, user_id, **fields):
+        return {'id': user_id, 'name': 'Jane Doe', 'email': f'{user_id}@example.com', 'status': 'active', **fields}
+
+    def test_new_users_are_created_with_every_category(self):
+        result = upsert_ghl_users(self.location, [self._user('u1'), self._user('u2'), {'name': 'no id'}])
+
+        self.assertEqual(result, {'synced': 2, 'created': 2, 'updated': 0, 'assignments_created': 4})
+        user = GHLUser.objects.get(user_id='u1')
+        self.assertEqual((user.location_id, user.location_ghl_id), (self.location.pk, 'loc-1'))
+        self.assertEqual(UserCategoryAssignment.objects.filter(user=user).count(), 2)
+
+    def test_only_changed_users_are_written(self):
+        upsert_ghl_users(self.location, [self._user('u1'), self._user('u2')])
+        result = upsert_ghl_users(self.location, [self._user('u1', phone='555'), self._user('u2')])
+
+        self.assertEqual(result['updated'], 1)
+        self.assertEqual(GHLUser.objects.get(user_id='u1').phone, '555')
+
+    def test_reactivated_users_get_the_default_categories(self):
+        upsert_ghl_users(self.location, [self._user('u1', status='inactive')])
+        UserCategoryAssignment.objects.all().delete()
+
+        result = upsert_ghl_users(self.location, [self._user('u1')])
+
+        self.assertEqual(result['updated'], 1)
+        self.assertEqual(
+            list(UserCategoryAssignment.objects.values_list('category__name', flat=True)), ['Onboarding']
+        )
+
+
+class IterGHLUsersTests(TestCase):
+
+    def _pages(self, *responses):
+        patcher = mock.patch.object(services, 'get_ghl_users', side_effect=list(responses))
+        get_ghl_users = patcher.start()
+        self.addCleanup(patcher.stop)
+        return get_ghl_users
+
+    def _users(self, *user_ids):
+        return [{'id': user_id} for user_id in user_ids]
+
+    def _ids(self, pages):
+        return [[user['id'] for user in page] for page in pages]
+
+    def test_pages_until_the_total_is_reached(self):
+        get_ghl_users = self._pages(
+            {'users': self._users('u1', 'u2'), 'total': 3}, {'users': self._users('u3', 'u4'), 'total': 3}
+        )
+
+        self.assertEqual(self._ids(iter_ghl_users('loc-1', 'token', page_size=2)), [['u1', 'u2'], ['u3', 'u4']])
+        self.assertEqual([call.kwargs['skip'] for call in get_ghl_users.call_args_list], [0, 2])
+
+    def test_stops_after_a_short_page(self):
+        get_ghl_users = self._pages({'users': self._users('u1'), 'meta': {'nextPage': 2}})
+
+        self.assertEqual(self._ids(iter_ghl_users('loc-1', 'token', page_size=2)), [['u1']])
+        self.assertEqual(get_ghl_users.call_count, 1)
+
+    def test_stops_when_the_api_ignores_paging(self):
+        # Every request returns the same full listing: the repeated page yields nothing new
+        everything = {'users': self._users('u1', 'u2'), 'meta': {'nextPage': 2}}
+        get_ghl_users = self._pages(everything, everything)
+
+        self.assertEqual(self._ids(iter_ghl_users('loc-1', 'token', page_size=2)), [['u1', 'u2']])
+        self.assertEqual(get_ghl_users.call_count, 2)
+
+    def test_stops_without_a_total_or_next_page(self):
+        get_ghl_users = self._pages({'users': self._users('u1', 'u2')})
+
+        self.assertEqual(self._ids(iter_ghl_users('loc-1', 'token', page_size=2)), [['u1', 'u2']])
+        self.assertEqual(get_ghl_users.call_count, 1)
+
+    def test_failed_page_raises(self):
+        self._pages({'users': self._users('u1', 'u2'), 'total': 4}, {'error': 500, 'message': 'boom'})
+
+        pages = iter_ghl_users('loc-1', 'token', page_size=2)
+        self.assertEqual(self._ids([next(pages)]), [['u1', 'u2']])
+        with self.assertRaises(GHLAPIError):
+            next(pages)
+
+
+class ReconcileRemovedGHLUsersTests(TestCase):
+
+    def setUp(self):
+        locations = {
+            location_id: GHLAuthCredentials.objects.create(
+                user_id='owner', access_token='token', refresh_token='refresh', expires_in=3600, location_id=location_id
+            )
+            for location_id in ('loc-1', 'loc-2')
+        }
+        for user_id, location_id, status in [
+            ('u1', 'loc-1', 'active'), ('u2', 'loc-1', 'active'), ('u3', 'loc-1', 'inactive'), ('u4', 'loc-2', 'active')
+        ]:
+            GHLUser.objects.create(
+                user_id=user_id, location=locations[location_id], location_ghl_id=location_id,
+                name='Jane Doe', email=f'{user_id}@example.com', status=status
+            )
+
+    def _statuses(self):
+        return dict(GHLUser.objects.values_list('user_id', 'status'))
+
+    def test_active_users_missing_from_the_listing_are_deactivated(self):
+        removed = reconcile_removed_ghl_users('loc-1', {'u1', 'u9'})
+
+        self.assertEqual(removed, [('u2', 'u2@example.com')])
+        self.assertEqual(self._statuses(), {'u1': 'active', 'u2': 'inactive', 'u3': 'inactive', 'u4': 'active'})
+
+    def test_dry_run_reports_without_writing(self):
+        self.assertEqual(reconcile_removed_ghl_users('loc-1', set(), dry_run=True), [
+            ('u1', 'u1@example.com'), ('u2', 'u2@example.com')
+        ])
+        self.assertEqual(self._statuses()['u1'], 'active')
+
+    def _sync(self, pages, **kwargs):
+        with mock.patch.object(helpers, 'iter_ghl_users', return_value=iter(pages)), \
+                mock.patch.object(helpers, 'upsert_ghl_users', return_value={
+                    'synced': 0, 'created': 0, 'updated': 0, 'assignments_created': 0
+                }):
+            sync_ghl_users('loc-1', 'token', **kwargs)
+
+    def test_full_sync_reconciles(self):
+        self._sync([[{'id': 'u1'}]])
+        self.assertEqual(self._statuses()['u2'], 'inactive')
+
+    def test_incremental_and_empty_syncs_do_not_reconcile(self):
+        self._sync([[{'id': 'u1'}]], incremental=True)
+        self._sync([])
+        self.assertEqual(self._statuses()['u2'], 'active')
+
+
+class SyncRunTests(MemoryStateTestCase):
+
+    def test_failed_lane_closes_the_run(self):
+        with mock.patch('account.tasks.chord') as chord:
+            run_id = sync_all_locations_task(location_ids=['loc-1', 'loc-2'])
+        callback = chord.return_value.call_args.args[0]
+        errback = callback.options['link_error'][0]
+        self.assertEqual(SyncRun.objects.get(pk=run_id).status, 'running')
+
+        # Celery calls a chord's error callback with the failed request, the exception and the traceback
+        errback.type(None, RuntimeError('lane crashed'), None, *errback.args)
+
+        run = SyncRun.objects.get(pk=run_id)
+        self.assertEqual((run.status, run.locations_failed), ('failed', 2))
+        self.assertIsNotNone(run.finished_at)
+
+    def test_error_callback_leaves_a_closed_run_alone(self):
+        run = SyncRun.objects.create(locations_total=1)
+        finish_sync_run_task([[location_result('loc-1')]], run.pk)
+
+        self.assertIsNone(fail_sync_run_task(None, RuntimeError('late'), None, run.pk))
+        self.assertEqual(SyncRun.objects.get(pk=run.pk).status, 'completed')
+
+    def test_location_that_raises_fails_without_stopping_the_lane(self):
+        def sync(location_id, **kwargs):
+            if location_id == 'loc-1':
+                raise ConnectionError('redis down')
+            return location_result(location_id)
+
+        with mock.patch('account.tasks.sync_location', side_effect=sync):
+            results = sync_locations_task(['loc-1', 'loc-2'])
+
+        self.assertEqual(
+            [(result['location_id'], result['status'], result['error']) for result in results],
+            [('loc-1', 'failed', 'redis down'), ('loc-2', 'synced', None)]
+        )
+
+
+class ReplayWebhooksTests(TestCase):
+
+    def test_failed_events_are_counted_one_at_a_time(self):
+        WebhookLog.objects.create(data={'type': 'UserUpdate', 'locationId': 'loc-1', 'id': 'u1'})
+        out = io.StringIO()
+
+        with mock.patch(
+            'account.management.commands.replay_webhooks.apply_user_webhooks', side_effect=OperationalError('gone')
+        ):
+            call_command('replay_webhooks', workers=1, stdout=out, stderr=io.StringIO())
+
+        self.assertIn('replayed 1 (1 failed)', out.getvalue())
+
+
+class WebhookBufferTests(MemoryStateTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for patcher in [
+            mock.patch.object(flush_webhook_buffer_task, 'apply_async'),
+            mock.patch.object(process_user_webhooks_task, 'delay'),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for user_id in ('u1', 'u2'):
+            buffer_webhook({'type': 'UserUpdate', 'locationId': 'loc-1', 'id': user_id})
+        self.buffer = webhooks.get_webhook_buffer()
+
+    def test_entries_of_an_interrupted_flush_are_written_by_the_next(self):
+        # A flush that died after draining: its entries sit in the processing list
+        self.buffer.drain(10)
+        self.assertEqual(len(self.buffer), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(flush_webhook_buffer(), 2)
+
+        self.assertEqual(WebhookLog.objects.count(), 2)
+        self.assertEqual(self.buffer._processing, [])
+
+    def test_entries_stay_in_processing_until_the_rows_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            flush_webhook_buffer()
+            self.assertEqual(len(self.buffer._processing), 2)
+
+        callbacks[0]()
+        self.assertEqual(self.buffer._processing, [])
+
+    def test_unreachable_database_requeues_the_batch(self):
+        with mock.patch.object(WebhookLog.objects, 'bulk_create', side_effect=OperationalError('gone')):
+            with self.assertRaises(OperationalError):
+                flush_webhook_buffer()
+
+        self.assertEqual((len(self.buffer), self.buffer._processing), (2, []))
+
+    def test_flush_task_retries_while_the_database_is_unreachable(self):
+        with mock.patch('account.tasks.flush_webhook_buffer', side_effect=OperationalError('gone')), \
+                mock.patch.object(flush_webhook_buffer_task, 'retry', side_effect=Retry) as retry:
+            with self.assertRaises(Retry):
+                flush_webhook_buffer_task()
+        self.assertIsInstance(retry.call_args.kwargs['exc'], OperationalError)
+
+    def test_flush_task_is_rescheduled_while_another_flush_runs(self):
+        flush_webhook_buffer_task.apply_async.reset_mock()
+        with webhooks.flush_lock():
+            self.assertIsNone(flush_webhook_buffer_task())
+
+        flush_webhook_buffer_task.apply_async.assert_called_once_with(countdown=settings.GHL_WEBHOOK_FLUSH_INTERVAL)
+        self.assertEqual(len(self.buffer), 2)
+
+
+def _webhook(user_id, delivery, updated, **fields):
+    data = {'type': 'UserUpdated', 'id': user_id, 'webhookId': delivery, 'dateUpdated': updated, **fields}
+    return {'data': data, 'received_at': '2026-01-01T00:00:00+00:00'}
+
+
+class WebhookDedupTests(MemoryStateTestCase):
+
+    def test_coalesce_keeps_the_latest_event_per_user_in_arrival_order(self):
+        events = coalesce_user_events([
+            _webhook('u1', 'w1', '2026-01-01T10:00:00Z', name='First'),
+            _webhook('u2', 'w2', '2026-01-01T10:00:00Z', name='Other'),
+            _webhook('u1', 'w3', '2026-01-01T12:00:00Z', name='Newest'),
+            _webhook('u1', 'w4', '2026-01-01T11:00:00Z', name='Late'),
+        ])
+        self.assertEqual([(data['id'], data['name']) for data, _, _ in events], [('u2', 'Other'), ('u1', 'Newest')])
+
+    def test_coalesce_skips_unhandled_types_and_non_dict_payloads(self):
+        events = coalesce_user_events([
+            {'data': {'type': 'ContactCreate', 'id': 'c1'}, 'received_at': None},
+            {'data': ['not', 'a', 'dict'], 'received_at': None},
+            _webhook('u1', 'w1', '2026-01-01T10:00:00Z'),
+        ])
+        self.assertEqual([data['id'] for data, _, _ in events], ['u1'])
+
+    def test_deliveries_are_dropped_only_once_marked(self):
+        webhook = _webhook('u1', 'w1', '2026-01-01T10:00:00Z')
+        events = coalesce_user_events([webhook])
+        self.assertEqual(len(coalesce_user_events([webhook])), 1)
+
+        mark_events_delivered(events)
+        self.assertEqual(coalesce_user_events([webhook]), [])
+
+    def test_claims_reject_older_and_repeated_events(self):
+        newer = _webhook('u1', 'w2', '2026-01-01T12:00:00Z', name='New')['data']
+        older = _webhook('u1', 'w1', '2026-01-01T10:00:00Z', name='Old')['data']
+        redelivered = dict(newer, webhookId='w3')
+
+        self.assertEqual(claim_user_events([(newer, 'UserUpdated', None)]), ['apply'])
+        self.assertEqual(
+            claim_user_events([(older, 'UserUpdated', None), (redelivered, 'UserUpdated', None)]),
+            ['stale', 'duplicate']
+        )
+
+    def test_events_without_user_id_are_always_applied(self):
+        data = {'type': 'UserUpdated', 'webhookId': 'w1'}
+        self.assertEqual(claim_user_events([(data, 'UserUpdated', None), (data, 'UserUpdated', None)]), ['apply', 'apply'])
+
+    def test_released_claims_can_be_applied_again(self):
+        event = (_webhook('u1', 'w1', '2026-01-01T10:00:00Z')['data'], 'UserUpdated', None)
+        verdicts = claim_user_events([event])
+        release_user_events([event], verdicts)
+        self.assertEqual(claim_user_events([event]), ['apply'])
+
+    def test_release_keeps_a_newer_claim(self):
+        older = (_webhook('u1', 'w1', '2026-01-01T10:00:00Z', name='Old')['data'], 'UserUpdated', None)
+        newer = (_webhook('u1', 'w2', '2026-01-01T12:00:00Z', name='New')['data'], 'UserUpdated', None)
+        verdicts = claim_user_events([older])
+        claim_user_events([newer])
+        release_user_events([older], verdicts)
+        self.assertEqual(claim_user_events([older]), ['stale'])
+
+
+
+class WebhookOrderingTests(MemoryStateTestCase):
+
+    def setUp(self):
+        super().setUp()
+        GHLAuthCredentials.objects.create(
+            user_id='owner', access_token='token', refresh_token='refresh', expires_in=3600, location_id='loc-1'
+        )
+        patcher = mock.patch.object(helpers, 'queue_contact_update', return_value=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _event(self, updated, first_name, event_type='UserUpdate'):
+        data = {'type': event_type, 'id': 'u1', 'locationId': 'loc-1', 'dateUpdated': updated, 'firstName': first_name}
+        return data, event_type, None
+
+    def test_older_event_applied_after_a_newer_one_is_skipped(self):
+        # Both claimed before either was written, then written in the wrong order
+        apply_user_webhooks([self._event('2026-01-01T12:00:00Z', 'New')])
+        result = apply_user_webhooks([self._event('2026-01-01T10:00:00Z', 'Old')])
+
+        self.assertEqual(result['stale'], 1)
+        self.assertEqual(GHLUser.objects.get(user_id='u1').first_name, 'New')
+
+    def test_newer_event_is_written_over_an_older_one(self):
+        apply_user_webhooks([self._event('2026-01-01T10:00:00Z', 'Old')])
+        apply_user_webhooks([self._event('2026-01-01T12:00:00Z', 'New')])
+
+        user = GHLUser.objects.get(user_id='u1')
+        self.assertEqual(user.first_name, 'New')
+        self.assertEqual(user.webhook_version, event_version({'dateUpdated': '2026-01-01T12:00:00Z'}))
+
+    def test_stale_delete_keeps_the_user(self):
+        apply_user_webhooks([self._event('2026-01-01T12:00:00Z', 'New')])
+        apply_user_webhooks([self._event('2026-01-01T10:00:00Z', 'Old', event_type='UserDelete')])
+
+        self.assertTrue(GHLUser.objects.filter(user_id='u1').exists())
+
+    def test_new_user_written_concurrently_by_a_newer_event_rolls_the_batch_back(self):
+        upsert = helpers.upsert_ghl_users
+
+        def upsert_after_concurrent_writer(location, users_data):
+            result = upsert(location, users_data)
+            GHLUser.objects.filter(user_id='u1').update(webhook_version=event_version({'dateUpdated': '2026-01-02'}))
+            return result
+
+        with mock.patch.object(helpers, 'upsert_ghl_users', side_effect=upsert_after_concurrent_writer):
+            with self.assertRaises(StaleWebhookWrite):
+                apply_user_webhooks([self._event('2026-01-01T10:00:00Z', 'Old')])
+        self.assertFalse(GHLUser.objects.filter(user_id='u1').exists())
+
+
+class WebhookRetentionTests(TestCase):
+
+    def setUp(self):
+        current = now()
+        self.rows = {
+            age: WebhookLog.objects.create(received_at=current - timedelta(days=age), data={'type': 'UserUpdate', 'age': age})
+            for age in (1, 10, 40, 400)
+        }
+
+    def _ages(self, model):
+        return sorted(row.payload['age'] for row in model.objects.all())
+
+    def test_archive_moves_old_rows_compressed_and_in_chunks(self):
+        self.assertEqual(archive_webhook_logs(now() - timedelta(days=30), chunk_size=1), 2)
+
+        self.assertEqual(self._ages(WebhookLog), [1, 10])
+        self.assertEqual(self._ages(WebhookLogArchive), [40, 400])
+        archived = WebhookLogArchive.objects.get(webhook_id=self.rows[40].pk)
+        self.assertEqual(archived.received_at, self.rows[40].received_at)
+
+    def test_archive_keeps_already_compressed_payloads(self):
+        compress_webhook_logs(now() - timedelta(days=30))
+        archive_webhook_logs(now() - timedelta(days=30))
+
+        self.assertEqual(self._ages(WebhookLogArchive), [40, 400])
+
+    def test_purge_deletes_from_both_tables(self):
+        archive_webhook_logs(now() - timedelta(days=300))
+
+        self.assertEqual(purge_webhook_logs(now() - timedelta(days=30), chunk_size=1), 2)
+        self.assertEqual(self._ages(WebhookLog), [1, 10])
+        self.assertFalse(WebhookLogArchive.objects.exists())
+
+    def test_dry_run_counts_without_writing(self):
+        self.assertEqual(purge_webhook_logs(now() - timedelta(days=30), dry_run=True), 2)
+        self.assertEqual(archive_webhook_logs(now() - timedelta(days=30), dry_run=True), 2)
+        self.assertEqual(WebhookLog.objects.count(), 4)
+
+    def test_compaction_runs_each_stage_on_its_own_age_band(self):
+        report = compact_webhook_logs(compress_after_days=7, archive_after_days=30, retention_days=365)
+
+        self.assertEqual(report, {'compressed': 1, 'archived': 1, 'purged': 1})
+        self.assertEqual(self._ages(WebhookLog), [1, 10])
+        self.assertIsNone(WebhookLog.objects.get(pk=self.rows[10].pk).data)
+        self.assertEqual(self._ages(WebhookLogArchive), [40])
+
+
+class ApplyUserWebhooksTests(MemoryStateTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.location = GHLAuthCredentials.objects.create(
+            user_id='owner', access_token='token', refresh_token='refresh', expires_in=3600, location_id='loc-1'
+        )
+        Category.objects.create(name='Onboarding')
+        for patcher in [
+            mock.patch.object(helpers, 'queue_contact_update', return_value=True),
+            mock.patch.object(notify_category_assignments_task, 'delay'),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _event(self, user_id, event_type='UserUpdate', location_id='loc-1', updated='2026-01-01T10:00:00Z', **fields):
+        data = {'type': event_type, 'id': user_id, 'locationId': location_id, 'dateUpdated': updated,
+                'email': f'{user_id}@example.com', **fields}
+        return data, event_type, None
+
+    def test_batch_creates_updates_and_deletes(self):
+        GHLUser.objects.create(user_id='u2', location=self.location, location_ghl_id='loc-1', name='Two', email='u2@example.com')
+        GHLUser.objects.create(user_id='u3', location=self.location, location_ghl_id='loc-1', name='Three', email='u3@example.com')
+
+        result = apply_user_webhooks([
+            self._event('u1', 'UserCreate', firstName='One'),
+            self._event('u2', firstName='Two', lastName='Changed'),
+            self._event('u3', 'UserDelete'),
+            self._event('u4', location_id='unknown'),
+            ({'type': 'UserUpdate', 'locationId': 'loc-1'}, 'UserUpdate', None),
+        ])
+
+        self.assertEqual(
+            {key: result[key] for key in ('events', 'created', 'updated', 'deleted', 'contact_updates', 'invalid')},
+            {'events': 5, 'created': 1, 'updated': 1, 'deleted': 1, 'contact_updates': 1, 'invalid': 1}
+        )
+        self.assertEqual(sorted(GHLUser.objects.values_list('user_id', flat=True)), ['u1', 'u2'])
+        self.assertEqual(GHLUser.objects.get(user_id='u2').name, 'Two Changed')
+        self.assertEqual(UserCategoryAssignment.objects.filter(user__user_id='u1').count(), 1)
+
+    def test_newest_event_of_a_user_wins_whatever_the_order(self):
+        apply_user_webhooks([
+            self._event('u1', updated='2026-01-01T12:00:00Z', firstName='Newest'),
+            self._event('u1', updated='2026-01-01T10:00:00Z', firstName='Older'),
+        ])
+        self.assertEqual(GHLUser.objects.get(user_id='u1').first_name, 'Newest')
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        def queries(count, offset):
+            events = [self._event(f'u{offset + index}') for index in range(count)]
+            with CaptureQueriesContext(connection) as context:
+                apply_user_webhooks(events)
+            return len(context.captured_queries)
+
+        self.assertEqual(queries(2, 0), queries(20, 100))
+
+
+class ProcessUserWebhooksTaskTests(MemoryStateTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.events = [(_webhook('u1', 'w1', '2026-01-01T10:00:00Z')['data'], 'UserUpdated', None)]
+
+    def test_deliveries_are_marked_after_the_events_are_applied(self):
+        with mock.patch('account.tasks.apply_user_webhooks', return_value={}) as apply:
+            process_user_webhooks_task(self.events)
+
+        apply.assert_called_once_with(self.events)
+        self.assertEqual(coalesce_user_events([_webhook('u1', 'w1', '2026-01-01T10:00:00Z')]), [])
+
+    def test_failed_group_is_released_and_retried(self):
+        with mock.patch('account.tasks.apply_user_webhooks', side_effect=OperationalError('gone')), \
+                mock.patch.object(process_user_webhooks_task, 'retry', side_effect=Retry):
+            with self.assertRaises(Retry):
+                process_user_webhooks_task(self.events)
+
+        # Neither marked as delivered nor kept as claimed: the retry applies it again
+        self.assertEqual(len(coalesce_user_events([_webhook('u1', 'w1', '2026-01-01T10:00:00Z')])), 1)
+        self.assertEqual(claim_user_events(self.events), ['apply'])
+
+    def test_stale_events_are_not_applied(self):
+        claim_user_events([(_webhook('u1', 'w0', '2026-01-01T12:00:00Z')['data'], 'UserUpdated', None)])
+
+        with mock.patch('account.tasks.apply_user_webhooks', return_value={}) as apply:
+            process_user_webhooks_task(self.events)
+        apply.assert_called_once_with([])
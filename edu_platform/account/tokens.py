@@ -0,0 +1,173 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+import redis
+from django.conf import settings
+from django.db import connection
+from django.utils.timezone import now
+from .ghl_client import get_ghl_client
+from .models import GHLAuthCredentials
+from .redis_client import get_redis, use_memory_backend
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATH = "/oauth/token"
+
+_memory_locks = {}
+_memory_locks_guard = threading.Lock()
+
+
+@contextmanager
+def refresh_lock(location_id):
+    """
+    Serialise token refreshes for a location across workers. GHL refresh tokens
+    are single use, so two concurrent refreshes would invalidate each other.
+    Yields False if the lock could not be taken within GHL_TOKEN_REFRESH_LOCK_WAIT.
+    The lock expires after GHL_TOKEN_REFRESH_LOCK_TIMEOUT (longer than any refresh call)
+    so a dead worker can't hold it forever.
+    """
+    wait = settings.GHL_TOKEN_REFRESH_LOCK_WAIT
+    if use_memory_backend():
+        with _memory_locks_guard:
+            lock = _memory_locks.setdefault(location_id, threading.Lock())
+        acquired = lock.acquire(timeout=wait)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+    else:
+        lock = get_redis().lock(
+            f'ghl:token-refresh:{location_id}',
+            timeout=settings.GHL_TOKEN_REFRESH_LOCK_TIMEOUT,
+            blocking_timeout=wait
+        )
+        acquired = lock.acquire()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                try:
+                    lock.release()
+                except redis.exceptions.LockError:
+                    # Expired while refreshing; another worker may hold it now
+                    pass
+
+
+_token_cache = {}
+_token_cache_lock = threading.Lock()
+
+
+def get_access_token(location_id):
+    """
+    Current access token of a location (None if it is not connected), cached
+    per process for GHL_TOKEN_CACHE_TTL seconds but never past the token's expiry
+    """
+    with _token_cache_lock:
+        cached = _token_cache.get(location_id)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    credentials = GHLAuthCredentials.objects.filter(location_id=location_id).only(
+        'access_token', 'expires_in', 'updated_at'
+    ).first()
+    if not credentials:
+        return None
+    ttl = min(settings.GHL_TOKEN_CACHE_TTL, (credentials.expires_at - now()).total_seconds())
+    if ttl > 0:
+        with _token_cache_lock:
+            _token_cache[location_id] = (credentials.access_token, time.monotonic() + ttl)
+    return credentials.access_token
+
+
+def invalidate_access_token(location_id):
+    with _token_cache_lock:
+        _token_cache.pop(location_id, None)
+
+
+def token_is_due(credentials, margin=None):
+    margin = settings.GHL_TOKEN_REFRESH_MARGIN if margin is None else margin
+    return credentials.expires_at - timedelta(seconds=margin) <= now()
+
+
+def refresh_location_token(location_id, stale_token=None, margin=None):
+    """
+    Refresh the access token of a location and return the current one (None on failure).
+
+    With ``stale_token`` (a token GHL just rejected) the refresh is skipped if another
+    worker already replaced it; otherwise it is skipped while the token is not due yet.
+    """
+    with refresh_lock(location_id) as acquired:
+        if not acquired:
+            logger.warning(f"Timed out waiting for the token refresh lock of location {location_id}")
+            return None
+
+        # Re-read under the lock: the previous holder (maybe another process) may have refreshed already
+        invalidate_access_token(location_id)
+        credentials = GHLAuthCredentials.objects.filter(location_id=location_id).first()
+        if not credentials or not credentials.refresh_token:
+            return None
+        if stale_token is not None and credentials.access_token != stale_token:
+            return credentials.access_token
+        if stale_token is None and not token_is_due(credentials, margin):
+            return credentials.access_token
+
+        response = get_ghl_client().post(
+            TOKEN_PATH,
+            location_id=location_id,
+            data={
+                'grant_type': 'refresh_token',
+                'client_id': settings.GHL_CLIENT_ID,
+                'client_secret': settings.GHL_CLIENT_SECRET,
+                'refresh_token': credentials.refresh_token
+            }
+        )
+        if response.status_code != 200:
+            logger.error(f"Failed to refresh tokens for location {location_id}: {response.status_code}")
+            return None
+
+        new_tokens = response.json()
+        # update() skips auto_now, and expires_at is computed from updated_at
+        GHLAuthCredentials.objects.filter(location_id=location_id).update(
+            access_token=new_tokens.get("access_token"),
+            refresh_token=new_tokens.get("refresh_token"),
+            expires_in=new_tokens.get("expires_in"),
+            scope=new_tokens.get("scope"),
+            user_type=new_tokens.get("userType"),
+            company_id=new_tokens.get("companyId"),
+            user_id=new_tokens.get("userId"),
+            updated_at=now(),
+        )
+        invalidate_access_token(location_id)
+        logger.info(f"Tokens refreshed for location: {location_id}")
+        return new_tokens.get("access_token")
+
+
+def _refresh_in_thread(location_id):
+    try:
+        return location_id, refresh_location_token(location_id) is not None
+    except Exception as e:
+        logger.exception(f"Error refreshing tokens for location {location_id}: {e}")
+        return location_id, False
+    finally:
+        # Each pool thread gets its own connection; don't leak it
+        connection.close()
+
+
+def refresh_due_tokens(margin=None, max_workers=None):
+    """Refresh, in parallel, every location whose token expires within ``margin`` seconds"""
+    due = [
+        credentials.location_id
+        for credentials in GHLAuthCredentials.objects.exclude(refresh_token='').only(
+            'location_id', 'expires_in', 'updated_at'
+        )
+        if token_is_due(credentials, margin)
+    ]
+    if not due:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=max_workers or settings.GHL_TOKEN_REFRESH_WORKERS) as pool:
+        return dict(pool.map(_refresh_in_thread, due))
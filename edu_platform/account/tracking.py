@@ -0,0 +1,68 @@
+class TrackedFieldsMixin:
+    """
+    Remembers the values of ``tracked_fields`` as loaded from the database so
+    saves and signals can detect transitions without re-reading the row.
+
+    The snapshot is refreshed after every save and refresh_from_db, so
+    post_save receivers still see the values the row had before the save.
+    """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_tracked_fields()
+        return instance
+
+    def _snapshot_tracked_fields(self, fields=None):
+        # Deferred fields are left out; previous_value() reads them on demand
+        loaded_values = getattr(self, '_loaded_values', {}) if fields is not None else {}
+        loaded_values.update({
+            name: getattr(self, name) for name in self.tracked_fields
+            if name in self.__dict__ and (fields is None or name in fields)
+        })
+        self._loaded_values = loaded_values
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        # Only the reloaded fields match the database now; other tracked fields keep their snapshot
+        self._snapshot_tracked_fields(fields=set(fields) if fields is not None else None)
+
+    def previous_value(self, name):
+        """Value of ``name`` before the pending save (None for new rows)"""
+        if self._is_new():
+            return None
+        if name not in getattr(self, '_loaded_values', {}):
+            self._load_previous_values()
+        return self._loaded_values.get(name)
+
+    def _load_previous_values(self):
+        """
+        Read the tracked fields missing from the snapshot (instance built by hand,
+        or loaded with only()/defer()) from the database. Must run before the
+        row is written, or the database already holds the new values.
+        """
+        loaded_values = getattr(self, '_loaded_values', {})
+        missing = [name for name in self.tracked_fields if name not in loaded_values]
+        if missing and self.pk is not None:
+            row = type(self)._default_manager.filter(pk=self.pk).values(*missing).first() or {}
+            loaded_values.update({name: row.get(name) for name in missing})
+        self._loaded_values = loaded_values
+
+    def field_changed(self, name):
+        """True if ``name`` differs from the loaded value (always True for new rows)"""
+        return self._is_new() or self.previous_value(name) != getattr(self, name)
+
+    def _is_new(self):
+        # _state.adding is already False when post_save fires, so remember it for the duration of save()
+        return getattr(self, '_saving_new', self._state.adding)
+
+    def save(self, *args, **kwargs):
+        self._saving_new = self._state.adding
+        if not self._saving_new:
+            self._load_previous_values()
+        try:
+            super().save(*args, **kwargs)
+        finally:
+            del self._saving_new
+        self._snapshot_tracked_fields()
@@ -2,7 +2,7 @@ from django.urls import path
 from .views import (
     GHLAuthConnectView, GHLCallbackView, GHLTokensView, 
     GHLWebhookView, ManualRefreshUsersView, GetUsersView, AssignCategoriesToAllUsersView,
-    ListLocationsWithUsersView
+    ListLocationsWithUsersView, GHLMetricsView, SyncJobStatusView
 )
 
 urlpatterns = [
@@ -11,7 +11,9 @@ urlpatterns = [
     path('tokens/', GHLTokensView.as_view(), name='ghl-auth-tokens'),
     path('webhook/', GHLWebhookView.as_view(), name='ghl-webhook'),
     path('refresh-users/', ManualRefreshUsersView.as_view(), name='ghl-refresh-users'),
+    path('sync-jobs/<str:job_id>/', SyncJobStatusView.as_view(), name='ghl-sync-job-status'),
     path('get-users/', GetUsersView.as_view(), name='ghl-get-users'),
     path('assign-categories-to-all/', AssignCategoriesToAllUsersView.as_view(), name='assign-categories-to-all'),
     path('locations-with-users/', ListLocationsWithUsersView.as_view(), name='locations-with-users'),
+    path('metrics/', GHLMetricsView.as_view(), name='ghl-metrics'),
 ]
\ No newline at end of file
@@ -2,21 +2,27 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.shortcuts import redirect
+from django.http import HttpResponse
+from django.urls import reverse
 from decouple import config
 import requests
-from .models import GHLAuthCredentials, WebhookLog, GHLUser
-from .tasks import sync_ghl_users_task, manual_refresh_users_task, handle_user_webhook_event
+from .models import GHLAuthCredentials, GHLUser
+from .tasks import sync_ghl_users_task, manual_refresh_users_task
 from .services import get_location_name
+from .ghl_client import get_ghl_client
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from .serializers import GHLUserSerializer, LocationWithUsersSerializer
 from roleplay.models import UserCategoryAssignment
 from .helpers import assign_all_categories_to_users
+from .metrics import render_prometheus
+from .sync_jobs import start_user_sync_job, get_sync_job
+from .webhooks import buffer_webhook
 
 GHL_CLIENT_ID = config("GHL_CLIENT_ID")
 GHL_CLIENT_SECRET = config("GHL_CLIENT_SECRET")
 GHL_REDIRECTED_URI = config("GHL_REDIRECTED_URI")
-TOKEN_URL = "https://services.leadconnectorhq.com/oauth/token"
+TOKEN_PATH = "/oauth/token"
 
 class GHLAuthConnectView(APIView):
     def get(self, request):
@@ -60,7 +66,7 @@ class GHLTokensView(APIView):
             "code": authorization_code,
         }
 
-        response = requests.post(TOKEN_URL, data=data)
+        response = get_ghl_client().post(TOKEN_PATH, data=data)
 
         try:
             response_data = response.json()
@@ -93,12 +99,8 @@ class GHLTokensView(APIView):
                 }
             )
 
-            # Sync users
-            from .helpers import sync_ghl_users
-            users_synced = sync_ghl_users(
-                response_data.get("locationId"),
-                response_data.get("access_token")
-            )
+            # Sync users in the background; the frontend polls the job
+            sync_job_id, _ = start_user_sync_job(response_data.get("locationId"))
 
             # AUTO-ASSIGN ALL CATEGORIES TO ALL USERS
             # assignment_result = assign_all_categories_to_users(response_data.get("locationId"))
@@ -107,7 +109,8 @@ class GHLTokensView(APIView):
                 "message": "Authentication successful",
                 "location_id": response_data.get("locationId"),
                 "location_name": location_name,
-                "users_synced": users_synced,
+                "sync_job_id": sync_job_id,
+                "sync_status_url": reverse('ghl-sync-job-status', args=[sync_job_id]),
                 "categories_auto_assigned": True,  # Add this flag
                 "token_stored": True
             })
@@ -130,23 +133,32 @@ class ManualRefreshUsersView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        try:
-            credentials = GHLAuthCredentials.objects.get(location_id=location_id)
-            # FIX: Use direct function call instead of Celery task
-            from .helpers import sync_ghl_users
-            users_synced = sync_ghl_users(location_id, credentials.access_token)
-            
-            return Response({
-                "message": "User refresh completed",
-                "users_synced": users_synced,
-                "location_id": location_id
-            })
-            
-        except GHLAuthCredentials.DoesNotExist:
+        if not GHLAuthCredentials.objects.filter(location_id=location_id).exists():
             return Response(
                 {"error": "Location not found"}, 
                 status=status.HTTP_404_NOT_FOUND
             )
+        
+        # A refresh already queued or running for the location is reused
+        job_id, created = start_user_sync_job(location_id)
+        return Response({
+            "message": "User refresh queued" if created else "User refresh already in progress",
+            "job_id": job_id,
+            "status_url": reverse('ghl-sync-job-status', args=[job_id]),
+            "location_id": location_id
+        }, status=status.HTTP_202_ACCEPTED)
+
+class SyncJobStatusView(APIView):
+    """Status and progress of a user sync job started by a manual refresh or the OAuth connect"""
+    def get(self, request, job_id):
+        job = get_sync_job(job_id)
+        if not job:
+            return Response(
+                {"error": "Sync job not found"}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(job)
+
 class GetUsersView(APIView):
     """API to get all users for a location"""
     def get(self, request):
@@ -189,24 +201,13 @@ class GetUsersView(APIView):
 
 @method_decorator(csrf_exempt, name='dispatch')
 class GHLWebhookView(APIView):
+    """
+    Acknowledge GHL webhooks as fast as possible: the payload only goes into the
+    webhook buffer; logging and processing happen in flush_webhook_buffer_task
+    """
     def post(self, request):
         try:
-            data = request.data
-            print("Webhook data:", data)
-            
-            # Log webhook
-            WebhookLog.objects.create(data=data)
-            
-            event_type = data.get("type")
-            
-            # FIX: Use direct function call instead of Celery task
-            if event_type in ["UserCreated", "UserUpdated", "UserDeleted", "UserCreate", "UserUpdate", "UserDelete"]:
-                from .tasks import handle_user_webhook_event
-                handle_user_webhook_event.delay(data, event_type)
-                print(f"✅ Webhook {event_type} queued for processing")
-            else:
-                print(f"⚠️ Unhandled webhook type: {event_type}")
-            
+            buffer_webhook(request.data)
             return Response({"message": "Webhook received"}, status=status.HTTP_200_OK)
             
         except Exception as e:
@@ -267,4 +268,9 @@ class ListLocationsWithUsersView(APIView):
     def get(self, request):
         locations = GHLAuthCredentials.objects.prefetch_related('users').all()
         serializer = LocationWithUsersSerializer(locations, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+class GHLMetricsView(APIView):
+    """Outbound GHL call metrics (latency histograms, status codes, retries, bytes) in Prometheus text format"""
+    def get(self, request):
+        return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,513 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import redis
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import InterfaceError, OperationalError, transaction
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+from .models import WebhookLog
+from .redis_client import get_redis, use_memory_backend
+
+logger = logging.getLogger(__name__)
+
+USER_WEBHOOK_EVENTS = {"UserCreated", "UserUpdated", "UserDeleted", "UserCreate", "UserUpdate", "UserDelete"}
+
+
+class InMemoryWebhookBuffer:
+    """
+    Process-local stand-in for the Redis buffer, used for local runs and tests
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = deque()
+        self._processing = []
+        self._dead_letters = []
+        self._claim_expires_at = 0
+
+    def push(self, entry, claim_ttl):
+        """Append an entry; return True if the caller should schedule a flush"""
+        with self._lock:
+            self._entries.append(entry)
+            if self._claim_expires_at > time.monotonic():
+                return False
+            self._claim_expires_at = time.monotonic() + claim_ttl
+            return True
+
+    def release(self):
+        with self._lock:
+            self._claim_expires_at = 0
+
+    def drain(self, limit):
+        """Move up to ``limit`` entries to the processing list and return them"""
+        with self._lock:
+            entries = [self._entries.popleft() for _ in range(min(limit, len(self._entries)))]
+            self._processing.extend(entries)
+            return entries
+
+    def ack(self, entries):
+        """Drop drained entries from the processing list once they are written"""
+        with self._lock:
+            self._forget(entries)
+
+    def requeue(self, entries):
+        """Put drained entries back at the front of the buffer"""
+        with self._lock:
+            self._forget(entries)
+            self._entries.extendleft(reversed(entries))
+
+    def recover(self):
+        """Requeue the entries a flush drained but never acknowledged; returns how many"""
+        with self._lock:
+            recovered = len(self._processing)
+            self._entries.extendleft(reversed(self._processing))
+            self._processing = []
+            return recovered
+
+    def dead_letter(self, entries):
+        """Move drained entries that can't be written aside for inspection"""
+        with self._lock:
+            self._forget(entries)
+            self._dead_letters.extend(entries)
+
+    def _forget(self, entries):
+        for entry in entries:
+            self._processing.remove(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisWebhookBuffer:
+    """
+    Webhooks waiting to be written, as a Redis list shared by every web and worker process.
+    A push is one round trip: the append and the flush claim go in one pipeline.
+    Drained entries are moved (LMOVE) to a processing list and only removed from it once
+    written, so a flush that dies mid-batch loses nothing.
+    """
+    KEY = 'ghl:webhooks:buffer'
+    PROCESSING_KEY = 'ghl:webhooks:processing'
+    CLAIM_KEY = 'ghl:webhooks:flush-claim'
+    DEAD_LETTER_KEY = 'ghl:webhooks:dead-letter'
+
+    def __init__(self, connection):
+        self.redis = connection
+
+    def push(self, entry, claim_ttl):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.rpush(self.KEY, entry)
+        pipe.set(self.CLAIM_KEY, 1, nx=True, ex=claim_ttl)
+        _, claimed = pipe.execute()
+        return bool(claimed)
+
+    def release(self):
+        self.redis.delete(self.CLAIM_KEY)
+
+    def drain(self, limit):
+        pipe = self.redis.pipeline(transaction=False)
+        for _ in range(limit):
+            pipe.lmove(self.KEY, self.PROCESSING_KEY, 'LEFT', 'RIGHT')
+        return [entry.decode() for entry in pipe.execute() if entry is not None]
+
+    def ack(self, entries):
+        if entries:
+            pipe = self.redis.pipeline(transaction=False)
+            self._forget(pipe, entries)
+            pipe.execute()
+
+    def requeue(self, entries):
+        if entries:
+            pipe = self.redis.pipeline()
+            pipe.lpush(self.KEY, *reversed(entries))
+            self._forget(pipe, entries)
+            pipe.execute()
+
+    def recover(self):
+        recovered = 0
+        # Last to first, each onto the front of the buffer, keeps the arrival order
+        while self.redis.lmove(self.PROCESSING_KEY, self.KEY, 'RIGHT', 'LEFT') is not None:
+            recovered += 1
+        return recovered
+
+    def dead_letter(self, entries):
+        if entries:
+            pipe = self.redis.pipeline()
+            pipe.rpush(self.DEAD_LETTER_KEY, *entries)
+            self._forget(pipe, entries)
+            pipe.execute()
+
+    def _forget(self, pipe, entries):
+        for entry in entries:
+            pipe.lrem(self.PROCESSING_KEY, 1, entry)
+
+    def __len__(self):
+        return self.redis.llen(self.KEY)
+
+
+class InMemoryWebhookStateStore:
+    """
+    Process-local stand-in for the Redis state store, used for local runs and tests
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._deliveries = {}
+        self._users = {}
+
+    def seen_deliveries(self, delivery_ids):
+        """For each delivery id, True if it was processed within the ttl it was marked with"""
+        with self._lock:
+            current = time.monotonic()
+            return [self._deliveries.get(delivery_id, 0) > current for delivery_id in delivery_ids]
+
+    def mark_deliveries(self, delivery_ids, ttl):
+        """Remember delivery ids as processed for ``ttl`` seconds"""
+        with self._lock:
+            expires_at = time.monotonic() + ttl
+            for delivery_id in delivery_ids:
+                self._deliveries[delivery_id] = expires_at
+
+    def claim_user_version(self, user_id, version, payload_hash, ttl):
+        """
+        Record ``version`` as the user's latest applied event. Returns 'apply',
+        'stale' (a newer event was applied) or 'duplicate' (same content as the last one).
+        """
+        with self._lock:
+            applied_version, applied_hash = self._users.get(user_id, (None, None))
+            if applied_version is not None and applied_version > version:
+                return 'stale'
+            if applied_hash == payload_hash:
+                return 'duplicate'
+            self._users[user_id] = (version, payload_hash)
+            return 'apply'
+
+    def claim_user_versions(self, claims, ttl):
+        """claim_user_version for many (user_id, version, payload_hash) at once"""
+        return [self.claim_user_version(*claim, ttl) for claim in claims]
+
+    def release_user_versions(self, claims):
+        """Undo claims whose event could not be applied, unless a newer event claimed the user since"""
+        with self._lock:
+            for user_id, version, payload_hash in claims:
+                if self._users.get(user_id) == (version, payload_hash):
+                    del self._users[user_id]
+
+
+class RedisWebhookStateStore:
+    """
+    Seen delivery ids and the latest applied event per GHL user, shared by all workers
+    """
+    PREFIX = 'ghl:webhooks'
+
+    # Compare and set in one step so two workers can't both apply out of order
+    CLAIM_SCRIPT = """
+    local applied = redis.call('HMGET', KEYS[1], 'version', 'hash')
+    if applied[1] and tonumber(applied[1]) > tonumber(ARGV[1]) then return 'stale' end
+    if applied[2] == ARGV[2] then return 'duplicate' end
+    redis.call('HSET', KEYS[1], 'version', ARGV[1], 'hash', ARGV[2])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return 'apply'
+    """
+
+    RELEASE_SCRIPT = """
+    local applied = redis.call('HMGET', KEYS[1], 'version', 'hash')
+    if applied[1] == ARGV[1] and applied[2] == ARGV[2] then redis.call('DEL', KEYS[1]) end
+    """
+
+    def __init__(self, connection):
+        self.redis = connection
+        self._claim = connection.register_script(self.CLAIM_SCRIPT)
+        self._release = connection.register_script(self.RELEASE_SCRIPT)
+
+    def seen_deliveries(self, delivery_ids):
+        return [bool(seen) for seen in self.redis.mget([f'{self.PREFIX}:delivery:{delivery_id}' for delivery_id in delivery_ids])]
+
+    def mark_deliveries(self, delivery_ids, ttl):
+        pipe = self.redis.pipeline(transaction=False)
+        for delivery_id in delivery_ids:
+            pipe.set(f'{self.PREFIX}:delivery:{delivery_id}', 1, ex=ttl)
+        pipe.execute()
+
+    def claim_user_version(self, user_id, version, payload_hash, ttl):
+        return self.claim_user_versions([(user_id, version, payload_hash)], ttl)[0]
+
+    def claim_user_versions(self, claims, ttl):
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id, version, payload_hash in claims:
+            self._claim(keys=[f'{self.PREFIX}:user:{user_id}'], args=[repr(version), payload_hash, ttl], client=pipe)
+        return [verdict.decode() if isinstance(verdict, bytes) else verdict for verdict in pipe.execute()]
+
+    def release_user_versions(self, claims):
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id, version, payload_hash in claims:
+            self._release(keys=[f'{self.PREFIX}:user:{user_id}'], args=[repr(version), payload_hash], client=pipe)
+        pipe.execute()
+
+
+_buffer = None
+_state_store = None
+_memory_flush_lock = threading.Lock()
+
+
+def get_webhook_buffer():
+    global _buffer
+    if _buffer is None:
+        if use_memory_backend():
+            _buffer = InMemoryWebhookBuffer()
+        else:
+            _buffer = RedisWebhookBuffer(get_redis())
+    return _buffer
+
+
+@contextmanager
+def flush_lock():
+    """
+    Let one flush drain the buffer at a time, so everything in the processing list
+    belongs to the running flush or to one that died. Never waits: yields a callable
+    that renews the lock (call it before each batch), or None if another flush holds it.
+    """
+    if use_memory_backend():
+        acquired = _memory_flush_lock.acquire(blocking=False)
+        try:
+            yield (lambda: None) if acquired else None
+        finally:
+            if acquired:
+                _memory_flush_lock.release()
+    else:
+        lock = get_redis().lock('ghl:webhooks:flush-lock', timeout=settings.GHL_WEBHOOK_FLUSH_LOCK_TIMEOUT)
+        acquired = lock.acquire(blocking=False)
+        try:
+            yield lock.reacquire if acquired else None
+        finally:
+            if acquired:
+                try:
+                    lock.release()
+                except redis.exceptions.LockError:
+                    pass
+
+
+def get_webhook_state_store():
+    global _state_store
+    if _state_store is None:
+        if use_memory_backend():
+            _state_store = InMemoryWebhookStateStore()
+        else:
+            _state_store = RedisWebhookStateStore(get_redis())
+    return _state_store
+
+
+# Fields that identify a delivery rather than describe the user
+_DELIVERY_FIELDS = ('webhookId', 'deliveryId', 'timestamp')
+
+
+def delivery_id(data):
+    return data.get('webhookId') or data.get('deliveryId')
+
+
+def payload_hash(data):
+    content = {key: value for key, value in data.items() if key not in _DELIVERY_FIELDS}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, cls=DjangoJSONEncoder).encode()).hexdigest()
+
+
+def event_version(data, received_at=None):
+    """
+    Ordering key of a user event: when GHL changed the user if the payload says,
+    otherwise when the webhook arrived
+    """
+    for field in ('dateUpdated', 'updatedAt', 'timestamp'):
+        value = data.get(field)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            # Epoch seconds or milliseconds
+            return value / 1000 if value > 1e11 else float(value)
+        parsed = parse_datetime(value) if isinstance(value, str) else None
+        if parsed:
+            return parsed.timestamp()
+    parsed = parse_datetime(received_at) if received_at else None
+    return parsed.timestamp() if parsed else time.time()
+
+
+def _user_claim(data, received_at):
+    return data['id'], event_version(data, received_at), payload_hash(data)
+
+
+def claim_user_event(data, received_at=None):
+    """
+    Decide whether a user event should be applied: 'apply', or 'stale' when a
+    newer event of the user was already applied, or 'duplicate' when the last
+    applied event had the same content
+    """
+    return claim_user_events([(data, None, received_at)])[0]
+
+
+def claim_user_events(events):
+    """claim_user_event for a batch of (data, event_type, received_at), in one round trip"""
+    verdicts = ['apply'] * len(events)
+    # Events without a user id have nothing to order by; apply_user_webhooks rejects them
+    claimable = [index for index, (data, _, _) in enumerate(events) if data.get('id')]
+    claims = [_user_claim(events[index][0], events[index][2]) for index in claimable]
+    if claims:
+        for index, verdict in zip(claimable, get_webhook_state_store().claim_user_versions(claims, settings.GHL_WEBHOOK_DEDUP_TTL)):
+            verdicts[index] = verdict
+    return verdicts
+
+
+def release_user_events(events, verdicts):
+    """
+    Give back the claims of events that were not applied after all, so a retry
+    or a redelivery of them is applied instead of being skipped as a duplicate
+    """
+    claims = [
+        _user_claim(data, received_at)
+        for (data, _, received_at), verdict in zip(events, verdicts)
+        if verdict == 'apply' and data.get('id')
+    ]
+    if claims:
+        get_webhook_state_store().release_user_versions(claims)
+
+
+def mark_events_delivered(events):
+    """Remember the delivery ids of processed events so redeliveries of them are dropped"""
+    delivery_ids = [delivery_id(data) for data, _, _ in events if delivery_id(data)]
+    if delivery_ids:
+        get_webhook_state_store().mark_deliveries(delivery_ids, settings.GHL_WEBHOOK_DEDUP_TTL)
+
+
+def coalesce_user_events(webhooks):
+    """
+    Drop redeliveries of webhooks already processed and keep only the latest event
+    per GHL user. Returns (data, event_type, received_at) tuples in arrival order.
+    Nothing is recorded here: deliveries are marked once their events are applied.
+    """
+    webhooks = [webhook for webhook in webhooks if isinstance(webhook['data'], dict)]
+    delivery_ids = [delivery_id(webhook['data']) for webhook in webhooks]
+    known = [delivery for delivery in delivery_ids if delivery]
+    seen = iter(get_webhook_state_store().seen_deliveries(known) if known else [])
+
+    latest = {}
+    for position, (webhook, delivery) in enumerate(zip(webhooks, delivery_ids)):
+        if delivery and next(seen):
+            continue
+        data = webhook['data']
+        event_type = data.get("type")
+        if event_type not in USER_WEBHOOK_EVENTS:
+            logger.info(f"Unhandled webhook type: {event_type}")
+            continue
+        # Events without a user id can't be coalesced; apply_user_webhooks rejects them
+        key = data.get('id') or f'position:{position}'
+        version = (event_version(data, webhook['received_at']), position)
+        if key not in latest or version >= latest[key][0]:
+            latest[key] = (version, (data, event_type, webhook['received_at']))
+    return [event for _, event in sorted(latest.values(), key=lambda item: item[0][1])]
+
+
+def buffer_webhook(data):
+    """
+    Append a received webhook to the buffer; the first webhook of a window
+    schedules the background writer to run GHL_WEBHOOK_FLUSH_INTERVAL later
+    """
+    from .tasks import flush_webhook_buffer_task
+
+    entry = json.dumps({'received_at': now().isoformat(), 'data': data}, cls=DjangoJSONEncoder)
+    interval = settings.GHL_WEBHOOK_FLUSH_INTERVAL
+    # The claim outlives the window so a lost flush task can't stall the buffer forever
+    if get_webhook_buffer().push(entry, interval + 60):
+        flush_webhook_buffer_task.apply_async(countdown=interval)
+
+
+def _webhook_log(webhook):
+    return WebhookLog(received_at=parse_datetime(webhook['received_at']), data=webhook['data'])
+
+
+def _ack_on_commit(buffer, entries):
+    if entries:
+        transaction.on_commit(lambda: buffer.ack(entries))
+
+
+def _write_webhook_logs(buffer, entries, batch_size):
+    """
+    Write drained entries to WebhookLog and return the webhooks written.
+    One bulk_create normally; if that fails the entries are written one by one and
+    the ones that still fail (e.g. a payload the database rejects) go to the
+    dead-letter list instead of blocking the buffer. If the database is unreachable
+    the entries not written yet are requeued and the error is raised.
+    Written entries leave the processing list only once their rows are committed.
+    """
+    try:
+        webhooks = [json.loads(entry) for entry in entries]
+        WebhookLog.objects.bulk_create([_webhook_log(webhook) for webhook in webhooks], batch_size=batch_size)
+        _ack_on_commit(buffer, entries)
+        return webhooks
+    except (OperationalError, InterfaceError):
+        buffer.requeue(entries)
+        raise
+    except Exception as e:
+        logger.warning(f"Writing {len(entries)} webhooks at once failed ({e}), writing them one by one")
+
+    written = []
+    written_entries = []
+    failed = []
+    for position, entry in enumerate(entries):
+        try:
+            webhook = json.loads(entry)
+            with transaction.atomic():
+                _webhook_log(webhook).save()
+        except (OperationalError, InterfaceError):
+            buffer.requeue(entries[position:])
+            buffer.dead_letter(failed)
+            _ack_on_commit(buffer, written_entries)
+            raise
+        except Exception as e:
+            logger.error(f"Moving unwritable webhook to the dead-letter list ({e}): {entry[:500]}")
+            failed.append(entry)
+            continue
+        written.append(webhook)
+        written_entries.append(entry)
+    buffer.dead_letter(failed)
+    _ack_on_commit(buffer, written_entries)
+    return written
+
+
+def flush_webhook_buffer(batch_size=None):
+    """
+    Write buffered webhooks to WebhookLog with one bulk_create per batch and queue
+    the user events for processing: redeliveries are dropped, each user's events
+    in a batch collapse into its latest, and the rest is handed to the batch
+    processor in groups of GHL_WEBHOOK_PROCESS_BATCH. Entries a dead flush left in the
+    processing list are requeued first. Returns the number of webhooks written, or
+    None if another flush is running.
+    """
+    from .tasks import process_user_webhooks_task
+
+    batch_size = batch_size or settings.GHL_WEBHOOK_FLUSH_BATCH
+    buffer = get_webhook_buffer()
+    # Release first: webhooks arriving from now on schedule the next flush
+    buffer.release()
+
+    with flush_lock() as renew_lock:
+        if renew_lock is None:
+            return None
+        recovered = buffer.recover()
+        if recovered:
+            logger.warning(f"Requeued {recovered} webhooks an interrupted flush left unwritten")
+
+        written = 0
+        while True:
+            renew_lock()
+            entries = buffer.drain(batch_size)
+            if not entries:
+                return written
+            webhooks = _write_webhook_logs(buffer, entries, batch_size)
+            written += len(webhooks)
+
+            events = coalesce_user_events(webhooks)
+            group_size = settings.GHL_WEBHOOK_PROCESS_BATCH
+            for start in range(0, len(events), group_size):
+                process_user_webhooks_task.delay(events[start:start + group_size])
+            if len(events) < len(webhooks):
+                logger.info(f"Queued {len(events)} user events for {len(webhooks)} webhooks")
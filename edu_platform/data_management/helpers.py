@@ -1,9 +1,10 @@
-import requests
 from django.utils.dateparse import parse_datetime
 from django.utils.timezone import make_aware, now, is_naive
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 import logging
+from account.ghl_client import get_ghl_client, GHLAPIError, GHLRateLimitError
+from account.ghl_async import fetch_all_pages_sync
 from .models import Contact, Opportunity, Pipeline, PipelineStage
 import pytz
 
@@ -11,114 +12,60 @@ logger = logging.getLogger('data_management.helpers')
 
 def sync_ghl_contacts_and_opportunities(location_id: str, access_token: str):
     """
-    Sync contacts and opportunities from GHL for a specific location
+    Sync contacts and opportunities from GHL for a specific location.
+    Returns the number of contacts and opportunities synced.
     """
     try:
         logger.info(f"Starting sync for location: {location_id}")
         
         # Sync contacts
-        contacts = get_all_ghl_contacts(access_token)
+        contacts = get_all_ghl_contacts(access_token, location_id)
         if contacts:
             for contact_data in contacts:
                 create_or_update_contact(contact_data)
             logger.info(f"Synced {len(contacts)} contacts for location {location_id}")
         
         # Sync opportunities
-        opportunities = get_all_ghl_opportunities(access_token)
+        opportunities = get_all_ghl_opportunities(access_token, location_id)
         if opportunities:
             for opportunity_data in opportunities:
-                create_or_update_opportunity_from_sync(opportunity_data, access_token)
+                create_or_update_opportunity_from_sync(opportunity_data, access_token, location_id)
             logger.info(f"Synced {len(opportunities)} opportunities for location {location_id}")
             
         logger.info(f"Completed sync for location: {location_id}")
+        return {'contacts': len(contacts), 'opportunities': len(opportunities)}
         
     except Exception as e:
         logger.error(f"Error syncing data for location {location_id}: {e}")
         raise
 
-def get_all_ghl_contacts(access_token: str) -> List[Dict]:
+def get_all_ghl_contacts(access_token: str, location_id: Optional[str] = None) -> List[Dict]:
     """
-    Get all contacts from GHL API
+    Get all contacts from GHL API (pages after the first are fetched concurrently)
     """
-    url = "https://services.leadconnectorhq.com/contacts/"
-    headers = {
-        "Accept": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Version": "2021-07-28"
-    }
-    
-    all_contacts = []
-    limit = 100
-    offset = 0
+    params = {"locationId": location_id} if location_id else None
     
     try:
-        while True:
-            params = {"limit": limit, "offset": offset}
-            response = requests.get(url, headers=headers, params=params)
-            
-            if response.status_code != 200:
-                logger.error(f"Failed to fetch contacts: {response.status_code} - {response.text}")
-                break
-                
-            data = response.json()
-            contacts = data.get("contacts", [])
-            
-            if not contacts:
-                break
-                
-            all_contacts.extend(contacts)
-            offset += limit
-            
-            # Break if we've gotten all contacts
-            if len(contacts) < limit:
-                break
-                
+        return fetch_all_pages_sync("/contacts/", access_token, location_id, "contacts", page_size=100, params=params)
+    except (GHLRateLimitError, GHLAPIError):
+        raise
     except Exception as e:
         logger.error(f"Error fetching contacts: {e}")
-        
-    return all_contacts
+        return []
 
-def get_all_ghl_opportunities(access_token: str) -> List[Dict]:
+def get_all_ghl_opportunities(access_token: str, location_id: Optional[str] = None) -> List[Dict]:
     """
-    Get all opportunities from GHL API
+    Get all opportunities from GHL API (pages after the first are fetched concurrently)
     """
-    url = "https://services.leadconnectorhq.com/opportunities/"
-    headers = {
-        "Accept": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Version": "2021-07-28"
-    }
-    
-    all_opportunities = []
-    limit = 100
-    offset = 0
+    params = {"locationId": location_id} if location_id else None
     
     try:
-        while True:
-            params = {"limit": limit, "offset": offset}
-            response = requests.get(url, headers=headers, params=params)
-            
-            if response.status_code != 200:
-                logger.error(f"Failed to fetch opportunities: {response.status_code} - {response.text}")
-                break
-                
-            data = response.json()
-            opportunities = data.get("opportunities", [])
-            
-            if not opportunities:
-                break
-                
-            all_opportunities.extend(opportunities)
-            offset += limit
-            
-            # Break if we've gotten all opportunities
-            if len(opportunities) < limit:
-                break
-                
+        return fetch_all_pages_sync("/opportunities/", access_token, location_id, "opportunities", page_size=100, params=params)
+    except (GHLRateLimitError, GHLAPIError):
+        raise
     except Exception as e:
         logger.error(f"Error fetching opportunities: {e}")
-        
-    return all_opportunities
+        return []
 
 def create_or_update_contact(contact_data: Dict[str, Any]) -> Optional[Contact]:
     """
@@ -170,7 +117,7 @@ def create_or_update_contact(contact_data: Dict[str, Any]) -> Optional[Contact]:
         logger.error(f"Error creating/updating contact {contact_id}: {e}")
         return None
 
-def create_or_update_opportunity_from_sync(opportunity_data: Dict[str, Any], access_token: str) -> Optional[Opportunity]:
+def create_or_update_opportunity_from_sync(opportunity_data: Dict[str, Any], access_token: str, location_id: Optional[str] = None) -> Optional[Opportunity]:
     """
     Create or update opportunity during sync (handles pipeline/stage creation)
     """
@@ -197,7 +144,7 @@ def create_or_update_opportunity_from_sync(opportunity_data: Dict[str, Any], acc
             
             # Update pipeline name if we have access token
             if access_token and not pipeline.name.startswith("Pipeline "):
-                pipeline_info = get_ghl_pipeline(pipeline_id, access_token)
+                pipeline_info = get_ghl_pipeline(pipeline_id, access_token, location_id)
                 if pipeline_info and pipeline_info.get("name"):
                     pipeline.name = pipeline_info["name"]
                     pipeline.save()
@@ -220,7 +167,7 @@ def create_or_update_opportunity_from_sync(opportunity_data: Dict[str, Any], acc
             if not contact:
                 # If contact doesn't exist, fetch it from GHL
                 from account.services import get_ghl_contact
-                contact_data = get_ghl_contact(contact_id, access_token)
+                contact_data = get_ghl_contact(contact_id, access_token, location_id)
                 if contact_data and contact_data.get("contact"):
                     contact = create_or_update_contact(contact_data["contact"])
         
@@ -260,23 +207,20 @@ def create_or_update_opportunity_from_sync(opportunity_data: Dict[str, Any], acc
         logger.info(f"Opportunity {opportunity_id} {action} successfully")
         return opportunity
         
+    except GHLRateLimitError:
+        raise
     except Exception as e:
         logger.error(f"Error creating/updating opportunity {opportunity_id}: {e}")
         return None
 
-def get_ghl_pipeline(pipeline_id: str, access_token: str) -> Optional[Dict]:
+def get_ghl_pipeline(pipeline_id: str, access_token: str, location_id: Optional[str] = None) -> Optional[Dict]:
     """
     Get pipeline details from GHL
     """
-    url = f"https://services.leadconnectorhq.com/pipelines/{pipeline_id}"
-    headers = {
-        "Accept": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Version": "2021-07-28"
-    }
+    path = f"/pipelines/{pipeline_id}"
     
     try:
-        response = requests.get(url, headers=headers)
+        response = get_ghl_client().get(path, access_token, location_id)
         if response.status_code == 200:
             return response.json()
     except Exception as e:
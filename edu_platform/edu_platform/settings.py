@@ -179,6 +179,10 @@ REST_FRAMEWORK = {
 CELERY_BROKER_URL = config("CELERY_BROKER_URL", default="redis://localhost:6379/0")
 CELERY_RESULT_BACKEND = config("CELERY_RESULT_BACKEND", default="redis://localhost:6379/0")
 
+# Shared GHL worker state (notification coalescing, rate limits): "redis" or "memory" for local runs/tests
+REDIS_URL = config("REDIS_URL", default=CELERY_BROKER_URL)
+GHL_STATE_BACKEND = config("GHL_STATE_BACKEND", default="redis")
+
 # Serialization and Timezone
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
@@ -192,7 +196,21 @@ CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 CELERY_BEAT_SCHEDULE = {
     'refresh-ghl-tokens': {
         'task': 'account.tasks.make_api_for_ghl',
-        'schedule': crontab(hour='*/6'),  # Every 6 hours
+        'schedule': crontab(minute='*/10'),  # Only tokens close to expiry are refreshed
+    },
+    'sync-ghl-locations': {
+        'task': 'account.tasks.sync_all_locations_task',
+        'schedule': crontab(minute=15),  # Hourly, users changed since the last run only
+        'kwargs': {'incremental': True, 'include_data': False},
+    },
+    'sync-ghl-locations-full': {
+        'task': 'account.tasks.sync_all_locations_task',
+        'schedule': crontab(hour=3, minute=45),  # Nightly full sync, also deactivates removed users
+        'kwargs': {'incremental': False},
+    },
+    'compact-webhook-logs': {
+        'task': 'account.tasks.compact_webhook_logs_task',
+        'schedule': crontab(hour=4, minute=30),
     },
 }
 
@@ -201,8 +219,66 @@ GHL_CLIENT_ID = config("GHL_CLIENT_ID")
 GHL_CLIENT_SECRET = config("GHL_CLIENT_SECRET")
 GHL_REDIRECTED_URI = config("GHL_REDIRECTED_URI")
 GHL_SCOPE = config("GHL_SCOPE", default="contacts.readonly contacts.write opportunities.readonly opportunities.write locations.readonly")
-GHL_BASE_URL = "https://services.leadconnectorhq.com"
+GHL_BASE_URL = config("GHL_BASE_URL", default="https://services.leadconnectorhq.com")
 GHL_AUTH_URL = "https://marketplace.leadconnectorhq.com/oauth/chooselocation"
+GHL_NOTIFICATION_WINDOW = config("GHL_NOTIFICATION_WINDOW", default=10, cast=int)  # seconds
+
+# GHL HTTP client (shared keep-alive session per process)
+GHL_HTTP_CONNECT_TIMEOUT = config("GHL_HTTP_CONNECT_TIMEOUT", default=5, cast=float)  # seconds
+GHL_HTTP_READ_TIMEOUT = config("GHL_HTTP_READ_TIMEOUT", default=30, cast=float)  # seconds
+GHL_HTTP_POOL_CONNECTIONS = config("GHL_HTTP_POOL_CONNECTIONS", default=4, cast=int)
+GHL_HTTP_POOL_MAXSIZE = config("GHL_HTTP_POOL_MAXSIZE", default=20, cast=int)
+GHL_ASYNC_MAX_CONNECTIONS = config("GHL_ASYNC_MAX_CONNECTIONS", default=50, cast=int)
+GHL_ASYNC_CONCURRENCY_PER_LOCATION = config("GHL_ASYNC_CONCURRENCY_PER_LOCATION", default=10, cast=int)
+
+# GHL rate limiting (per location, shared by all workers) and retries
+# GHL allows 100 requests / 10s per location; a full burst plus 10s of refill must stay within that
+GHL_RATE_LIMIT_PER_SECOND = config("GHL_RATE_LIMIT_PER_SECOND", default=5, cast=float)
+GHL_RATE_LIMIT_BURST = config("GHL_RATE_LIMIT_BURST", default=50, cast=int)
+GHL_MAX_RETRIES = config("GHL_MAX_RETRIES", default=4, cast=int)
+GHL_RETRY_BASE_DELAY = config("GHL_RETRY_BASE_DELAY", default=1, cast=float)  # seconds
+GHL_RETRY_MAX_DELAY = config("GHL_RETRY_MAX_DELAY", default=30, cast=float)  # seconds
+
+# GHL token refresh: tokens expiring within the margin are refreshed by the beat task
+GHL_TOKEN_REFRESH_MARGIN = config("GHL_TOKEN_REFRESH_MARGIN", default=3600, cast=int)  # seconds
+GHL_TOKEN_REFRESH_WORKERS = config("GHL_TOKEN_REFRESH_WORKERS", default=8, cast=int)
+# The refresh lock must outlive the slowest refresh call: every 429 retry with its Retry-After wait plus the
+# HTTP timeouts of each attempt, and a minute for the rate limiter. Waiters give up after the wait instead.
+GHL_TOKEN_REFRESH_LOCK_TIMEOUT = config(
+    "GHL_TOKEN_REFRESH_LOCK_TIMEOUT",
+    default=int((GHL_MAX_RETRIES + 1) * (GHL_HTTP_CONNECT_TIMEOUT + GHL_HTTP_READ_TIMEOUT + GHL_RETRY_MAX_DELAY)) + 60,
+    cast=int
+)  # seconds
+GHL_TOKEN_REFRESH_LOCK_WAIT = config("GHL_TOKEN_REFRESH_LOCK_WAIT", default=60, cast=int)  # seconds
+GHL_TOKEN_CACHE_TTL = config("GHL_TOKEN_CACHE_TTL", default=300, cast=int)  # seconds, per worker process
+
+# Scheduled multi-location sync: locations run in this many parallel lanes, one sync per location at a time
+GHL_SYNC_CONCURRENCY = config("GHL_SYNC_CONCURRENCY", default=4, cast=int)
+GHL_SYNC_LOCK_TIMEOUT = config("GHL_SYNC_LOCK_TIMEOUT", default=3600, cast=int)  # seconds, frees the lock of a dead worker
+
+# On-demand user sync jobs (manual refresh, OAuth connect) polled by the frontend
+GHL_SYNC_JOB_DEDUP_TTL = config("GHL_SYNC_JOB_DEDUP_TTL", default=3600, cast=int)  # seconds a queued/running job is reused
+GHL_SYNC_JOB_RETENTION = config("GHL_SYNC_JOB_RETENTION", default=86400, cast=int)  # seconds job status stays queryable
+GHL_SYNC_JOB_RETRY_DELAY = config("GHL_SYNC_JOB_RETRY_DELAY", default=30, cast=int)  # seconds, while another sync runs
+
+# Webhook ingestion: payloads are buffered and written to WebhookLog in bulk by a background task
+GHL_WEBHOOK_FLUSH_INTERVAL = config("GHL_WEBHOOK_FLUSH_INTERVAL", default=2, cast=int)  # seconds
+GHL_WEBHOOK_FLUSH_BATCH = config("GHL_WEBHOOK_FLUSH_BATCH", default=500, cast=int)
+# Renewed before every batch, so it only has to outlive writing one batch; frees the lock of a dead worker
+GHL_WEBHOOK_FLUSH_LOCK_TIMEOUT = config("GHL_WEBHOOK_FLUSH_LOCK_TIMEOUT", default=300, cast=int)  # seconds
+GHL_WEBHOOK_PROCESS_BATCH = config("GHL_WEBHOOK_PROCESS_BATCH", default=200, cast=int)  # user events per processing task
+GHL_WEBHOOK_DEDUP_TTL = config("GHL_WEBHOOK_DEDUP_TTL", default=86400, cast=int)  # seconds delivery ids and user versions are kept
+GHL_CONTACT_UPDATE_WINDOW = config("GHL_CONTACT_UPDATE_WINDOW", default=10, cast=int)  # seconds, one contact update per user
+
+# WebhookLog lifecycle (compact_webhook_logs_task / compact_webhook_logs command); 0 turns a stage off
+GHL_WEBHOOK_COMPRESS_AFTER_DAYS = config("GHL_WEBHOOK_COMPRESS_AFTER_DAYS", default=7, cast=int)
+GHL_WEBHOOK_ARCHIVE_AFTER_DAYS = config("GHL_WEBHOOK_ARCHIVE_AFTER_DAYS", default=30, cast=int)
+GHL_WEBHOOK_RETENTION_DAYS = config("GHL_WEBHOOK_RETENTION_DAYS", default=365, cast=int)
+GHL_WEBHOOK_COMPACT_CHUNK_SIZE = config("GHL_WEBHOOK_COMPACT_CHUNK_SIZE", default=1000, cast=int)
+
+# GHL call metrics (served at api/ghl/metrics/) and one JSON log line per call on the account.metrics logger
+GHL_METRICS_ENABLED = config("GHL_METRICS_ENABLED", default=True, cast=bool)
+GHL_METRICS_LOG_LEVEL = config("GHL_METRICS_LOG_LEVEL", default="INFO")
 
 # Logging Configuration
 LOGGING = {
@@ -247,6 +323,11 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'account.metrics': {
+            'handlers': ['ghl_file'],
+            'level': GHL_METRICS_LOG_LEVEL,
+            'propagate': False,
+        },
         'data_management': {
             'handlers': ['console', 'ghl_file'],
             'level': 'INFO',
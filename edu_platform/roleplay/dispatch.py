@@ -0,0 +1,68 @@
+import threading
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+# Number of (user, category) pairs carried by one notification task
+NOTIFICATION_BATCH_SIZE = 500
+
+_local = threading.local()
+
+
+class _AssignmentBuffer:
+    """
+    Assignment events collected during one transaction, flushed by its on_commit hook
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def flush(self):
+        from account.tasks import notify_category_assignments_task
+
+        events, self.events = self.events, []
+        for start in range(0, len(events), NOTIFICATION_BATCH_SIZE):
+            notify_category_assignments_task.delay(events[start:start + NOTIFICATION_BATCH_SIZE])
+
+
+def _current_buffer(using):
+    """
+    Return the buffer for the transaction currently open on ``using``.
+    A buffer whose flush hook is no longer pending (already committed, or
+    discarded by a rollback) is replaced by a fresh one.
+    """
+    connection = transaction.get_connection(using)
+    buffers = getattr(_local, 'buffers', None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+
+    buffer = buffers.get(using)
+    if buffer is None or not any(hook[1] == buffer.flush for hook in connection.run_on_commit):
+        buffer = buffers[using] = _AssignmentBuffer()
+        transaction.on_commit(buffer.flush, using=using)
+    return buffer
+
+
+def queue_assignment_events(pairs, using=DEFAULT_DB_ALIAS):
+    """
+    Queue GHL notifications for (user pk, category id) pairs.
+    Inside a transaction the pairs are buffered and sent as one batched enqueue
+    when it commits; in autocommit mode they are sent straight away.
+    """
+    pairs = [(user_pk, category_id) for user_pk, category_id in pairs]
+    if not pairs:
+        return
+
+    if not transaction.get_connection(using).in_atomic_block:
+        buffer = _AssignmentBuffer()
+        buffer.events.extend(pairs)
+        buffer.flush()
+        return
+
+    _current_buffer(using).events.extend(pairs)
+
+
+def queue_assignments(assignments, using=DEFAULT_DB_ALIAS):
+    """Queue GHL notifications for UserCategoryAssignment instances (saved or bulk created)"""
+    queue_assignment_events(
+        ((assignment.user_id, assignment.category_id) for assignment in assignments),
+        using=using
+    )
@@ -0,0 +1,116 @@
+from django.db import IntegrityError, transaction
+from account.models import GHLUser
+from .models import Category, UserCategoryAssignment
+from .dispatch import queue_assignments
+
+
+def _chunked(iterable, size):
+    """Yield lists of at most ``size`` items from ``iterable``"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _insert_assignments(assignments, batch_size):
+    """
+    Insert assignments and return the ones this call actually created.
+    Normally one bulk_create; if a concurrent writer inserted some of the
+    pairs first, the batch is retried row by row and the taken pairs dropped.
+    """
+    try:
+        with transaction.atomic():
+            UserCategoryAssignment.objects.bulk_create(assignments, batch_size=batch_size)
+        return assignments
+    except IntegrityError:
+        pass
+
+    inserted = []
+    for assignment in assignments:
+        # The failed batch may have left a pk behind; bulk_create also skips the post_save notifier
+        assignment.pk = None
+        try:
+            with transaction.atomic():
+                UserCategoryAssignment.objects.bulk_create([assignment])
+            inserted.append(assignment)
+        except IntegrityError:
+            continue
+    return inserted
+
+
+def bulk_assign_categories(users, categories, batch_size=1000, dry_run=False, progress=None):
+    """
+    Assign every category in ``categories`` to every user in ``users``.
+
+    Users are walked in batches; for each batch the existing assignments are
+    loaded with one query, the missing (user, category) pairs are computed in
+    memory and inserted with a single bulk_create. Only rows this call inserted
+    are counted and notified. ``progress`` (if given) is called with
+    (users_processed, assignments_created) after every batch; in a dry run the
+    count is the number of missing pairs.
+    """
+    categories = list(categories)
+    category_ids = [category.id for category in categories]
+
+    users_processed = 0
+    assignments_created = 0
+    created_assignments = []
+
+    for user_batch in _chunked(users.order_by('pk').iterator(chunk_size=batch_size), batch_size):
+        users_processed += len(user_batch)
+
+        if category_ids:
+            existing_pairs = set(
+                UserCategoryAssignment.objects.filter(
+                    user_id__in=[user.pk for user in user_batch],
+                    category_id__in=category_ids
+                ).values_list('user_id', 'category_id')
+            )
+
+            missing = [
+                UserCategoryAssignment(user=user, category=category)
+                for user in user_batch
+                for category in categories
+                if (user.pk, category.id) not in existing_pairs
+            ]
+
+            if missing and not dry_run:
+                missing = _insert_assignments(missing, batch_size)
+                created_assignments.extend(missing)
+
+            assignments_created += len(missing)
+
+        if progress:
+            progress(users_processed, assignments_created)
+
+    # bulk_create skips post_save, so hand the new assignments to the dispatch layer directly
+    queue_assignments(created_assignments)
+
+    return {
+        'users_count': users_processed,
+        'categories_count': len(categories),
+        'assignments_created': assignments_created,
+    }
+
+
+def assign_default_categories(location_id=None, batch_size=1000, dry_run=False, progress=None):
+    """
+    Assign all default categories to all active users, optionally limited to one location
+    """
+    default_categories = Category.objects.filter(is_default=True)
+    active_users = GHLUser.objects.filter(status='active')
+    if location_id:
+        active_users = active_users.filter(location_ghl_id=location_id)
+
+    return bulk_assign_categories(
+        active_users,
+        default_categories,
+        batch_size=batch_size,
+        dry_run=dry_run,
+        progress=progress
+    )
+
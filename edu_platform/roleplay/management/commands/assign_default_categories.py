@@ -1,34 +1,47 @@
 # roleplay/management/commands/assign_default_categories.py
 from django.core.management.base import BaseCommand
-from account.models import GHLUser
-from roleplay.models import Category, UserCategoryAssignment
+from roleplay.helpers import assign_default_categories
 
 class Command(BaseCommand):
     help = 'Assign default categories to all existing active users'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of users processed (and assignments inserted) per batch'
+        )
+        parser.add_argument(
+            '--location',
+            help='Only assign to active users of this GHL location id'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report the missing assignments without creating them'
+        )
+
     def handle(self, *args, **options):
-        default_categories = Category.objects.filter(is_default=True)
-        active_users = GHLUser.objects.filter(status='active')
-        
-        assignments_created = 0
-        users_processed = 0
-        
-        for user in active_users:
-            users_processed += 1
-            for category in default_categories:
-                # Check if assignment already exists
-                if not UserCategoryAssignment.objects.filter(user=user, category=category).exists():
-                    UserCategoryAssignment.objects.create(user=user, category=category)
-                    assignments_created += 1
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f'Assigned category "{category.name}" to user "{user.name}"'
-                        )
-                    )
-        
+        dry_run = options['dry_run']
+        verb = 'would be created' if dry_run else 'created'
+
+        def report_progress(users_processed, assignments_created):
+            self.stdout.write(
+                f'Processed {users_processed} users, {assignments_created} assignments {verb}'
+            )
+
+        result = assign_default_categories(
+            location_id=options['location'],
+            batch_size=options['batch_size'],
+            dry_run=dry_run,
+            progress=report_progress
+        )
+
         self.stdout.write(
             self.style.SUCCESS(
-                f'Successfully assigned {assignments_created} default category assignments '
-                f'to {users_processed} active users from {default_categories.count()} default categories'
+                f'{"[DRY RUN] " if dry_run else ""}'
+                f'{result["assignments_created"]} default category assignments {verb} '
+                f'for {result["users_count"]} active users from {result["categories_count"]} default categories'
             )
-        )
\ No newline at end of file
+        )
@@ -1,44 +1,28 @@
 from django.db import models
 from account.models import GHLUser
+from account.tracking import TrackedFieldsMixin
 
 
-class Category(models.Model):
+class Category(TrackedFieldsMixin, models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
     is_default = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    tracked_fields = ('is_default',)
+
     def __str__(self):
         return self.name
     
-    def save(self, *args, **kwargs):
-        # Check if is_default is being changed to True
-        is_new_default = False
-        if self.pk:  # Existing instance
-            old_instance = Category.objects.get(pk=self.pk)
-            if not old_instance.is_default and self.is_default:
-                is_new_default = True
-        else:  # New instance
-            if self.is_default:
-                is_new_default = True
-        
-        # Save the category first
-        super().save(*args, **kwargs)
-        
-        # If this category is now default, assign it to all active users
-        if is_new_default:
-            self.assign_to_all_active_users()
+    def became_default(self):
+        """True if this save turns the category into a default one (uses the loaded snapshot, no extra query)"""
+        return self.is_default and self.field_changed('is_default')
 
     def assign_to_all_active_users(self):
         """Assign this category to all active users"""
-        active_users = GHLUser.objects.filter(status='active')
-        
-        for user in active_users:
-            UserCategoryAssignment.objects.get_or_create(
-                user=user,
-                category=self
-            )
+        from .helpers import bulk_assign_categories
+        return bulk_assign_categories(GHLUser.objects.filter(status='active'), [self])
 
 class Model(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='models')
@@ -64,16 +48,6 @@ class UserCategoryAssignment(models.Model):
     def __str__(self):
         return f"{self.user.name} - {self.category.name}"
     
-    def save(self, *args, **kwargs):
-        # Check if this is a new assignment
-        is_new = self._state.adding
-        super().save(*args, **kwargs)
-        
-        # Trigger signal for new assignments
-        if is_new:
-            from .signals import handle_category_assignment
-            handle_category_assignment(sender=UserCategoryAssignment, instance=self, created=True)
-    
 
 class Feedback(models.Model):
     user = models.ForeignKey(GHLUser, on_delete=models.CASCADE, related_name='feedbacks')
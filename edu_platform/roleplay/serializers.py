@@ -88,3 +88,7 @@ class FeedbackSerializer(serializers.ModelSerializer):
                 "email": "No active user found with this email."
             })
 
+
+class AssignDefaultCategoriesSerializer(serializers.Serializer):
+    location_id = serializers.CharField(required=False, allow_null=True, allow_blank=True, default=None)
+    dry_run = serializers.BooleanField(default=False)
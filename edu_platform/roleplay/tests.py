@@ -1,3 +1,146 @@
-from django.test import TestCase
+from unittest import mock
+from django.db import transaction
+from django.test import TestCase, override_settings
+from account.models import GHLAuthCredentials, GHLUser
+from account.tasks import notify_category_assignments_task
+from roleplay import dispatch, helpers
+from roleplay.dispatch import queue_assignment_events
+from roleplay.helpers import bulk_assign_categories
+from roleplay.models import Category, UserCategoryAssignment
 
-# Create your tests here.
+
+class RoleplayTestCase(TestCase):
+    """One location with inactive users (so the default-category signal stays quiet) and two categories"""
+
+    def setUp(self):
+        patcher = mock.patch.object(notify_category_assignments_task, 'delay')
+        self.notify = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.location = GHLAuthCredentials.objects.create(
+            user_id='owner', access_token='token', refresh_token='refresh', expires_in=3600, location_id='loc-1'
+        )
+        self.users = [
+            GHLUser.objects.create(
+                user_id=f'u{index}', location=self.location, location_ghl_id='loc-1',
+                name='Jane Doe', email=f'u{index}@example.com', status='inactive'
+            )
+            for index in range(3)
+        ]
+        self.categories = [Category.objects.create(name='Sales'), Category.objects.create(name='Support')]
+
+
+@override_settings(ALLOWED_HOSTS=['*'])
+class AssignDefaultCategoriesViewTests(RoleplayTestCase):
+    url = '/api/roleplay/users/assign_default_categories/'
+
+    def setUp(self):
+        super().setUp()
+        GHLUser.objects.filter(pk=self.users[0].pk).update(status='active')
+        Category.objects.filter(pk=self.categories[0].pk).update(is_default=True)
+
+    def test_dry_run_reports_without_writing(self):
+        for value in ('true', '1', True):
+            response = self.client.post(self.url, {'dry_run': value}, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.json()['message'].startswith('Would assign 1 default categories'))
+            self.assertEqual(response.json()['assignments_created'], 1)
+        self.assertFalse(UserCategoryAssignment.objects.exists())
+
+    def test_false_values_assign(self):
+        response = self.client.post(self.url, {'dry_run': 'false'}, content_type='application/json')
+
+        self.assertTrue(response.json()['message'].startswith('Assigned 1 default categories'))
+        self.assertEqual(UserCategoryAssignment.objects.count(), 1)
+
+    def test_invalid_dry_run_is_rejected(self):
+        response = self.client.post(self.url, {'dry_run': 'maybe'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class BulkAssignCategoriesTests(RoleplayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(helpers, 'queue_assignments')
+        self.queue_assignments = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _queued_pairs(self):
+        return {
+            (assignment.user_id, assignment.category_id)
+            for call in self.queue_assignments.call_args_list for assignment in call.args[0]
+        }
+
+    def test_only_missing_pairs_are_inserted(self):
+        UserCategoryAssignment.objects.create(user=self.users[0], category=self.categories[0])
+        self.queue_assignments.reset_mock()
+
+        result = bulk_assign_categories(GHLUser.objects.all(), self.categories, batch_size=2)
+
+        self.assertEqual(result, {'users_count': 3, 'categories_count': 2, 'assignments_created': 5})
+        self.assertEqual(UserCategoryAssignment.objects.count(), 6)
+        self.assertEqual(len(self._queued_pairs()), 5)
+
+    def test_dry_run_counts_without_writing(self):
+        result = bulk_assign_categories(GHLUser.objects.all(), self.categories, dry_run=True)
+
+        self.assertEqual(result['assignments_created'], 6)
+        self.assertFalse(UserCategoryAssignment.objects.exists())
+        self.assertEqual(self._queued_pairs(), set())
+
+    def test_pairs_inserted_concurrently_are_not_reported(self):
+        insert = helpers._insert_assignments
+
+        def insert_after_concurrent_writer(assignments, batch_size):
+            UserCategoryAssignment.objects.bulk_create([
+                UserCategoryAssignment(user=self.users[0], category=self.categories[0])
+            ])
+            return insert(assignments, batch_size)
+
+        with mock.patch.object(helpers, '_insert_assignments', side_effect=insert_after_concurrent_writer):
+            result = bulk_assign_categories(GHLUser.objects.all(), self.categories[:1])
+
+        self.assertEqual(result['assignments_created'], 2)
+        self.assertEqual(UserCategoryAssignment.objects.count(), 3)
+        self.assertNotIn((self.users[0].pk, self.categories[0].pk), self._queued_pairs())
+
+
+class AssignmentDispatchTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(notify_category_assignments_task, 'delay')
+        self.notify = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_events_are_sent_once_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            queue_assignment_events([(1, 10), (2, 10)])
+            queue_assignment_events([(3, 11)])
+            self.notify.assert_not_called()
+
+        self.assertEqual(len(callbacks), 1)
+        self.notify.assert_called_once_with([(1, 10), (2, 10), (3, 11)])
+
+    def test_events_are_sent_in_batches(self):
+        with mock.patch.object(dispatch, 'NOTIFICATION_BATCH_SIZE', 2):
+            with self.captureOnCommitCallbacks(execute=True):
+                queue_assignment_events([(1, 10), (2, 10), (3, 10)])
+
+        self.assertEqual(self.notify.call_args_list, [mock.call([(1, 10), (2, 10)]), mock.call([(3, 10)])])
+
+    def test_events_of_a_rolled_back_savepoint_are_dropped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    queue_assignment_events([(1, 10)])
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            queue_assignment_events([(2, 10)])
+
+        self.notify.assert_called_once_with([(2, 10)])
+
+    def test_nothing_is_sent_for_no_events(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            queue_assignment_events([])
+        self.assertEqual(callbacks, [])
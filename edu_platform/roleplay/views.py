@@ -6,10 +6,11 @@ from django.shortcuts import get_object_or_404
 from django.db.models import Avg, Count, Q, Max, Min
 from datetime import datetime, timezone
 from .models import Category, Model, UserCategoryAssignment, Feedback
+from .helpers import assign_default_categories
 from account.models import GHLUser
 from .serializers import (
     CategorySerializer, ModelSerializer, 
-    GHLUserSerializer, FeedbackSerializer,
+    GHLUserSerializer, FeedbackSerializer, AssignDefaultCategoriesSerializer,
 )
 
 class CategoryViewSet(viewsets.ModelViewSet):
@@ -152,22 +153,21 @@ class GHLUserViewSet(viewsets.ViewSet):
     @action(detail=False, methods=['post'])
     def assign_default_categories(self, request):
         """
-        Assign default categories to all active users
+        Assign default categories to all active users (optionally for one location)
         """
-        default_categories = Category.objects.filter(is_default=True)
-        active_users = GHLUser.objects.filter(status='active')
-        
-        assignments_created = 0
-        for user in active_users:
-            for category in default_categories:
-                # Check if assignment already exists
-                if not UserCategoryAssignment.objects.filter(user=user, category=category).exists():
-                    UserCategoryAssignment.objects.create(user=user, category=category)
-                    assignments_created += 1
+        params = AssignDefaultCategoriesSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        dry_run = params.validated_data['dry_run']
+        result = assign_default_categories(
+            location_id=params.validated_data['location_id'] or None,
+            dry_run=dry_run
+        )
         
+        verb = "Would assign" if dry_run else "Assigned"
         return Response({
-            "message": f"Assigned {len(default_categories)} default categories to {active_users.count()} users",
-            "assignments_created": assignments_created
+            "message": f"{verb} {result['categories_count']} default categories to {result['users_count']} users",
+            "assignments_created": result['assignments_created'],
+            "dry_run": dry_run
         })
 
 class UserAccessViewSet(viewsets.ViewSet):